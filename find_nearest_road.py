@@ -1,17 +1,191 @@
+import hashlib
+import json
 import math
 import os
+import re
 import sys
 from pathlib import Path
 
 import folium
+import numpy as np
 
-from helper.distance import distance
-from helper.global_var import FLAG_FIND_NEAREST_ROAD_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE
-# import numpy as np
+from helper.distance import distance, distance_array
+from helper.global_var import FLAG_DEBUG, FLAG_FIND_NEAREST_ROAD_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE, \
+    CONFIG_ROUTE_GEOMETRY_FOLDER, CONFIG_GRAPH_HASH_FILE
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX
 from helper.graph_reader import graph_reader
 
 
-def find_nearest_road(final_node_table, final_way_table, final_relation_table, relation_ids, datapoint, margin=0.01):
+def get_bus_route_to_relation_index(final_relation_table):
+    """
+    Get the relations of each bus route, by the number at the beginning of the "ref" tag of the relation.
+
+    Parameters
+    ----------
+    final_relation_table: Dict
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    Returns
+    -------
+    bus_route_to_relation_index: Dictionary
+        A dictionary that use the route number as key and the set of relation id as value
+    """
+    bus_route_to_relation_index = {}
+    for relation_index, relation_detail in final_relation_table.items():
+        re_result = re.match(r"[0-9]+", relation_detail[1]['ref'])
+        if re_result is None:
+            continue
+        temp_route = int(re_result.group())
+        if temp_route not in bus_route_to_relation_index:
+            bus_route_to_relation_index[temp_route] = set()
+        bus_route_to_relation_index[temp_route].add(relation_index)
+    return bus_route_to_relation_index
+
+
+def get_possible_relations(route_id, bus_route_to_relation_index, final_relation_table):
+    """
+    Get the relations that a bus running the given route could be on.
+
+    Parameters
+    ----------
+    route_id: int
+        route_id_curr of the data
+
+    bus_route_to_relation_index: Dictionary
+        The return of get_bus_route_to_relation_index
+
+    final_relation_table: Dict
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    Returns
+    -------
+    Set of relation id, empty if none is found
+    """
+    if route_id in bus_route_to_relation_index:
+        return bus_route_to_relation_index[route_id]
+    possible_relations = set()
+    for key, relation_detail in final_relation_table.items():
+        if str(route_id) in relation_detail[1]['ref']:
+            possible_relations.add(key)
+    return possible_relations
+
+
+def build_way_index(final_node_table, final_way_table, final_relation_table, cell_size=0.01):
+    """
+    Build a uniform grid spatial index over the nodes of the ways, so that find_nearest_road does not need to check
+    every node of every way of the route for each datapoint.
+
+    Parameters
+    ----------
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    cell_size: float
+        The size of each grid cell (in degree), by default is 0.01, the same as the default margin of find_nearest_road
+
+    Returns
+    -------
+    way_index: Dictionary
+        "cell_size": the size of each grid cell
+        "cells": {(row, col): (latitude array, longitude array, way id array)} of the nodes in each cell. A node shared
+                 by several ways is stored once per way.
+        "way_nodes": {way id: (latitude array, longitude array)} of the nodes of each way, in order
+        "relation_ways": {relation id: {way id: the first position of the way in the relation}}, only contains the
+                         ways in final_way_table
+    """
+    cell_entries = {}
+    for way_id, node_ids in final_way_table.items():
+        for node_id in node_ids:
+            lat, lng = final_node_table[node_id]
+            cell = (math.floor(lat / cell_size), math.floor(lng / cell_size))
+            if cell not in cell_entries:
+                cell_entries[cell] = ([], [], [])
+            cell_entries[cell][0].append(lat)
+            cell_entries[cell][1].append(lng)
+            cell_entries[cell][2].append(way_id)
+
+    cells = {}
+    for cell, (lats, lngs, way_ids) in cell_entries.items():
+        cells[cell] = (np.array(lats, dtype=np.float64), np.array(lngs, dtype=np.float64),
+                       np.array(way_ids, dtype=np.int64))
+
+    way_nodes = {}
+    for way_id, node_ids in final_way_table.items():
+        way_nodes[way_id] = (np.array([final_node_table[node_id][0] for node_id in node_ids], dtype=np.float64),
+                             np.array([final_node_table[node_id][1] for node_id in node_ids], dtype=np.float64))
+
+    relation_ways = {}
+    for relation_id, relation in final_relation_table.items():
+        way_positions = {}
+        for position, way in enumerate(relation[0]):
+            if way in final_way_table and way not in way_positions:
+                way_positions[way] = position
+        relation_ways[relation_id] = way_positions
+
+    return {"cell_size": cell_size, "cells": cells, "way_nodes": way_nodes, "relation_ways": relation_ways}
+
+
+def query_way_index(way_index, relation_ids, datapoint, margin=0.01):
+    """
+    Get the ways of the given relations that have at least one node within the margin of the datapoint.
+
+    The result is the same as the linear search in find_nearest_road, including the order of the ways (by relation in
+    the iteration order of relation_ids, then by the position in the relation), which decides the way chosen when two
+    ways share the nearest node.
+
+    Parameters
+    ----------
+    way_index: Dictionary
+        The return of build_way_index
+
+    relation_ids: Set of int
+        List of int that represent the index of relation
+
+    datapoint: List of int
+        Longitude and Latitude of the given point
+
+    margin: float
+        the range of the nodes we will get (in degree), by default is 0.01
+
+    Returns
+    -------
+    List of way id
+    """
+    cell_size = way_index["cell_size"]
+    cells = way_index["cells"]
+    min_row = math.floor((datapoint[0] - margin) / cell_size)
+    max_row = math.floor((datapoint[0] + margin) / cell_size)
+    min_col = math.floor((datapoint[1] - margin) / cell_size)
+    max_col = math.floor((datapoint[1] + margin) / cell_size)
+
+    near_ways = set()
+    for row in range(min_row, max_row + 1):
+        for col in range(min_col, max_col + 1):
+            if (row, col) not in cells:
+                continue
+            lats, lngs, way_ids = cells[(row, col)]
+            mask = (datapoint[0] + margin > lats) & (lats > datapoint[0] - margin) & \
+                   (datapoint[1] + margin > lngs) & (lngs > datapoint[1] - margin)
+            near_ways.update(way_ids[mask].tolist())
+
+    way_order = {}
+    for relation_rank, relation_id in enumerate(relation_ids):
+        way_positions = way_index["relation_ways"][relation_id]
+        for way in near_ways:
+            if way not in way_order and way in way_positions:
+                way_order[way] = (relation_rank, way_positions[way])
+
+    return sorted(way_order, key=way_order.get)
+
+
+def find_nearest_road(final_node_table, final_way_table, final_relation_table, relation_ids, datapoint, margin=0.01,
+                      way_index=None):
     """
     Get the closest road for given datapoint
 
@@ -40,6 +214,10 @@ def find_nearest_road(final_node_table, final_way_table, final_relation_table, r
         the range of the nodes we will get (in degree), by default is 0.01
         Experimentally determined a +- value of .001 just by looking at the largest space between nodes
 
+    way_index: Dictionary
+        The return of build_way_index. If provided, the ways near the datapoint are found with the spatial index instead
+        of checking every node of the route. The result is the same.
+
     Returns
     -------
     min_projection: List of int
@@ -62,17 +240,21 @@ def find_nearest_road(final_node_table, final_way_table, final_relation_table, r
     possible_ways = {}
 
     if len(relations) > 0:
-        for relation in relations:
-            for way in relation[0]:
-                if way in final_way_table:
-                    temp_flag_near = False
-                    for node in final_way_table[way]:
-                        if datapoint[0] + margin > final_node_table[node][0] > datapoint[0] - margin:
-                            if datapoint[1] + margin > final_node_table[node][1] > datapoint[1] - margin:
-                                temp_flag_near = True
-                                break
-                    if temp_flag_near:
-                        possible_ways.update({way: final_way_table[way]})
+        if way_index is not None:
+            for way in query_way_index(way_index, relation_ids, datapoint, margin):
+                possible_ways[way] = final_way_table[way]
+        else:
+            for relation in relations:
+                for way in relation[0]:
+                    if way in final_way_table:
+                        temp_flag_near = False
+                        for node in final_way_table[way]:
+                            if datapoint[0] + margin > final_node_table[node][0] > datapoint[0] - margin:
+                                if datapoint[1] + margin > final_node_table[node][1] > datapoint[1] - margin:
+                                    temp_flag_near = True
+                                    break
+                        if temp_flag_near:
+                            possible_ways.update({way: final_way_table[way]})
 
         # For some unknown reason, in some case the bus is not close to any way in the route,
         # in that case we just put all way in it.
@@ -93,14 +275,29 @@ def find_nearest_road(final_node_table, final_way_table, final_relation_table, r
     # The minimum distance using haversine formula determines which point I calculate is closest
     # to the datapoint. If the projection is off the road (the road stops before the vector), it
     # will not be considered. Instead, the distance of the end of the road will be used.
-    for way_id, node_id in possible_ways.items():
-        for i in range(len(node_id)):
-            temp_distance = distance(final_node_table[node_id[i]], datapoint)
-            if temp_distance < min_dist:
-                min_dist = temp_distance
-                min_way = way_id
-                min_projection = final_node_table[node_id[i]]
-                mid_dist_index = i
+    if way_index is not None:
+        # The same search with numpy, argmin gives the first minimum as the loop below does
+        possible_way_ids = list(possible_ways)
+        way_nodes = [way_index["way_nodes"][way_id] for way_id in possible_way_ids]
+        node_distances = distance_array(np.concatenate([lats for lats, lngs in way_nodes]),
+                                        np.concatenate([lngs for lats, lngs in way_nodes]), datapoint)
+        if len(node_distances) > 0:
+            nearest = int(np.argmin(node_distances))
+            way_starts = np.cumsum([0] + [len(lats) for lats, lngs in way_nodes])
+            way_position = int(np.searchsorted(way_starts, nearest, side='right')) - 1
+            min_dist = float(node_distances[nearest])
+            min_way = possible_way_ids[way_position]
+            mid_dist_index = nearest - int(way_starts[way_position])
+            min_projection = final_node_table[possible_ways[min_way][mid_dist_index]]
+    else:
+        for way_id, node_id in possible_ways.items():
+            for i in range(len(node_id)):
+                temp_distance = distance(final_node_table[node_id[i]], datapoint)
+                if temp_distance < min_dist:
+                    min_dist = temp_distance
+                    min_way = way_id
+                    min_projection = final_node_table[node_id[i]]
+                    mid_dist_index = i
     if min_way == -1:
         print("projection is off the road?")
 
@@ -154,6 +351,487 @@ def find_nearest_road(final_node_table, final_way_table, final_relation_table, r
     return min_projection, min_way
 
 
+def get_relation_geometry(way_index, final_way_table, final_relation_table, relation_ids):
+    """
+    Get the nodes of all ways of the given relations as flat arrays, used by find_nearest_road_batch.
+
+    The ways are in the same order as the linear search of find_nearest_road (by relation in the iteration order of
+    relation_ids, then by the position in the relation). Ways without node are left out. The result is cached in the
+    way_index.
+
+    Parameters
+    ----------
+    way_index: Dictionary
+        The return of build_way_index
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    relation_ids: Set of int
+        List of int that represent the index of relation
+
+    Returns
+    -------
+    relation_geometry: Dictionary
+        "way_ids": np.ndarray of the way id
+        "way_starts": np.ndarray, the nodes of the i-th way are [way_starts[i], way_starts[i + 1])
+        "node_ways": np.ndarray, the position in way_ids of the way of each node
+        "lats", "lngs": np.ndarray, the coordinates of each node
+        "node_offsets": np.ndarray, the distance (in km) from the first node of the way to each node along the way
+    """
+    relation_key = tuple(relation_ids)
+    geometry_cache = way_index.setdefault("relation_geometry", {})
+    if relation_key in geometry_cache:
+        return geometry_cache[relation_key]
+
+    way_ids = []
+    for relation_id in relation_ids:
+        for way in final_relation_table[relation_id][0]:
+            if way in final_way_table and len(final_way_table[way]) > 0 and way not in way_ids:
+                way_ids.append(way)
+
+    way_nodes = [way_index["way_nodes"][way] for way in way_ids]
+    way_lengths = [len(lats) for lats, lngs in way_nodes]
+    way_starts = np.cumsum([0] + way_lengths).astype(np.int64)
+    node_ways = np.repeat(np.arange(len(way_ids), dtype=np.int64), way_lengths)
+    lats = np.concatenate([lats for lats, lngs in way_nodes]) if way_nodes else np.zeros(0)
+    lngs = np.concatenate([lngs for lats, lngs in way_nodes]) if way_nodes else np.zeros(0)
+
+    # The length of each segment, the ones between two ways do not count
+    segment_lengths = distance_array(lats[:-1], lngs[:-1], (lats[1:], lngs[1:]))
+    segment_lengths[node_ways[1:] != node_ways[:-1]] = 0
+    lengths_to_node = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    relation_geometry = {
+        "way_ids": np.array(way_ids, dtype=np.int64),
+        "way_starts": way_starts,
+        "node_ways": node_ways,
+        "lats": lats,
+        "lngs": lngs,
+        "node_offsets": lengths_to_node - lengths_to_node[way_starts[node_ways]] if way_nodes else np.zeros(0),
+    }
+    geometry_cache[relation_key] = relation_geometry
+    return relation_geometry
+
+
+def project_to_relation_geometry(relation_geometry, lats, lngs, margin=0.01):
+    """
+    Vectorized find_nearest_road for many points on the same relations.
+
+    Each step is the same computation as find_nearest_road, done for all the points and all the candidate nodes or
+    segments at once, so the result is the same.
+
+    Parameters
+    ----------
+    relation_geometry: Dictionary
+        The return of get_relation_geometry
+
+    lats: np.ndarray
+        Latitude of the points
+
+    lngs: np.ndarray
+        Longitude of the points
+
+    margin: float
+        the range of the nodes we will get (in degree), by default is 0.01
+
+    Returns
+    -------
+    projections: np.ndarray
+        (n, 2) array of the lat and lng of the projection points
+
+    way_ids: np.ndarray
+        The id of the way that closest to each point, -1 if the relations have no node
+
+    offsets: np.ndarray
+        The distance (in km) from the first node of the way to the projection point along the way, 0 if the relations
+        have no node
+    """
+    way_starts = relation_geometry["way_starts"]
+    node_lats = relation_geometry["lats"]
+    node_lngs = relation_geometry["lngs"]
+    lats = lats[:, np.newaxis]
+    lngs = lngs[:, np.newaxis]
+
+    if len(node_lats) == 0:
+        return np.zeros((len(lats), 2)), np.full(len(lats), -1, dtype=np.int64), np.zeros(len(lats))
+
+    # The ways having a node within the margin, all ways if there is none
+    near_nodes = (lats + margin > node_lats) & (node_lats > lats - margin) & \
+                 (lngs + margin > node_lngs) & (node_lngs > lngs - margin)
+    near_ways = np.logical_or.reduceat(near_nodes, way_starts[:-1], axis=1)
+    near_ways[~near_ways.any(axis=1)] = True
+
+    # The nearest node of the possible ways, argmin gives the first minimum as the loop in find_nearest_road does
+    node_distances = distance_array(node_lats, node_lngs, (lats, lngs))
+    node_distances[~near_ways[:, relation_geometry["node_ways"]]] = np.inf
+    nearest = np.argmin(node_distances, axis=1)
+    min_dist = node_distances[np.arange(len(nearest)), nearest]
+    way_positions = relation_geometry["node_ways"][nearest]
+    projections = np.stack([node_lats[nearest], node_lngs[nearest]], axis=1)
+    # The first node of the segment the projection is on, or the nearest node itself
+    projection_nodes = nearest.copy()
+
+    # The 1 to 3 segments around the nearest node that find_nearest_road checks
+    lats = lats[:, 0]
+    lngs = lngs[:, 0]
+    way_start = way_starts[way_positions]
+    way_length = way_starts[way_positions + 1] - way_start
+    mid_dist_index = nearest - way_start
+    segment_start = np.select([way_length <= 3, mid_dist_index == 0, mid_dist_index >= way_length - 2],
+                              [0, 0, way_length - 2], mid_dist_index - 1)
+    segment_count = np.select([way_length <= 3, mid_dist_index == 0, mid_dist_index >= way_length - 2],
+                              [way_length - 1, 2, 1], 3)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(3):
+            checked = i < segment_count
+            a = way_start + np.where(checked, segment_start + i, 0)
+            b = np.where(checked, a + 1, a)
+            u = [node_lats[b] - node_lats[a], node_lngs[b] - node_lngs[a]]
+            v = [lats - node_lats[a], lngs - node_lngs[a]]
+
+            projection_lat = (u[0] * v[0] + u[1] * v[1]) / (u[0] ** 2 + u[1] ** 2) * u[0] + node_lats[a]
+            projection_lng = (u[0] * v[0] + u[1] * v[1]) / (u[0] ** 2 + u[1] ** 2) * u[1] + node_lngs[a]
+
+            on_segment = checked & \
+                (np.minimum(node_lats[a], node_lats[b]) <= projection_lat) & \
+                (projection_lat <= np.maximum(node_lats[a], node_lats[b])) & \
+                (np.minimum(node_lngs[a], node_lngs[b]) <= projection_lng) & \
+                (projection_lng <= np.maximum(node_lngs[a], node_lngs[b]))
+            projection_dist = distance_array(projection_lat, projection_lng, (lats, lngs))
+            closer = on_segment & (projection_dist < min_dist)
+            min_dist = np.where(closer, projection_dist, min_dist)
+            projections[closer, 0] = projection_lat[closer]
+            projections[closer, 1] = projection_lng[closer]
+            projection_nodes[closer] = a[closer]
+
+    offsets = relation_geometry["node_offsets"][projection_nodes] + \
+        distance_array(node_lats[projection_nodes], node_lngs[projection_nodes], (projections[:, 0], projections[:, 1]))
+    return projections, relation_geometry["way_ids"][way_positions], offsets
+
+
+ROUTE_GEOMETRY_ARRAYS = ["route_ids", "route_node_offsets", "route_way_offsets", "lats", "lngs", "node_ways",
+                         "node_offsets", "way_ids", "way_starts"]
+
+
+def build_route_geometry(way_index, final_way_table, final_relation_table, bus_route_to_relation_index=None):
+    """
+    Compile the geometry of every bus route into contiguous arrays, so that it can be saved with save_route_geometry
+    and memory-mapped by load_route_geometry.
+
+    The ways of each route are flattened as in get_relation_geometry. Segment k of a way goes from node k to node k + 1
+    of the way, so the node arrays are also the arrays of the segment endpoints.
+
+    Parameters
+    ----------
+    way_index: Dictionary
+        The return of build_way_index
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    bus_route_to_relation_index: Dictionary
+        The return of get_bus_route_to_relation_index, it is built here if not provided.
+
+    Returns
+    -------
+    route_geometry_arrays: Dictionary
+        The arrays of all routes, keys are ROUTE_GEOMETRY_ARRAYS
+        "route_ids": the route_id_curr of each route, sorted
+        "route_node_offsets": the nodes of the i-th route are [route_node_offsets[i], route_node_offsets[i + 1])
+        "route_way_offsets": the ways of the i-th route are [route_way_offsets[i], route_way_offsets[i + 1])
+        "lats", "lngs", "node_ways": the same as get_relation_geometry for all routes, node_ways is the position of the
+                                     way in the route
+        "node_offsets": the same as get_relation_geometry for all routes
+        "way_ids": the same as get_relation_geometry for all routes
+        "way_starts": the same as get_relation_geometry for all routes, the i-th route has
+                      route_way_offsets[i + 1] - route_way_offsets[i] + 1 values, starting at route_way_offsets[i] + i
+    """
+    if bus_route_to_relation_index is None:
+        bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+
+    route_ids = sorted(bus_route_to_relation_index)
+    relation_geometries = [get_relation_geometry(way_index, final_way_table, final_relation_table,
+                                                 bus_route_to_relation_index[route_id]) for route_id in route_ids]
+    return {
+        "route_ids": np.array(route_ids, dtype=np.int64),
+        "route_node_offsets": np.cumsum([0] + [len(geometry["lats"]) for geometry in relation_geometries]),
+        "route_way_offsets": np.cumsum([0] + [len(geometry["way_ids"]) for geometry in relation_geometries]),
+        "lats": np.concatenate([geometry["lats"] for geometry in relation_geometries]),
+        "lngs": np.concatenate([geometry["lngs"] for geometry in relation_geometries]),
+        "node_ways": np.concatenate([geometry["node_ways"] for geometry in relation_geometries]),
+        "node_offsets": np.concatenate([geometry["node_offsets"] for geometry in relation_geometries]),
+        "way_ids": np.concatenate([geometry["way_ids"] for geometry in relation_geometries]),
+        "way_starts": np.concatenate([geometry["way_starts"] for geometry in relation_geometries]),
+    }
+
+
+def save_route_geometry(route_geometry_arrays, graph_path):
+    """
+    Save the return of build_route_geometry as .npy files in graph_path/CONFIG_ROUTE_GEOMETRY_FOLDER
+
+    Parameters
+    ----------
+    route_geometry_arrays: Dictionary
+        The return of build_route_geometry
+
+    graph_path: Path
+        The path of the graph folder
+    """
+    route_geometry_path = Path(graph_path) / CONFIG_ROUTE_GEOMETRY_FOLDER
+    route_geometry_path.mkdir(parents=True, exist_ok=True)
+    for name in ROUTE_GEOMETRY_ARRAYS:
+        np.save(route_geometry_path / "{}.npy".format(name), route_geometry_arrays[name])
+    if FLAG_DEBUG:
+        print("{} saved".format(route_geometry_path))
+
+
+def load_route_geometry(graph_path):
+    """
+    Memory-map the route geometry saved by save_route_geometry.
+
+    The files are ignored if they are older than the graph files (final_node_table, final_way_table and
+    final_relation_table) in graph_path, as they may not match the graph anymore.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    Returns
+    -------
+    route_geometry: Dictionary
+        {route_id_curr: relation geometry (see get_relation_geometry)}, the arrays are views of the memory-mapped files.
+        None if the files do not exist or are out of date.
+    """
+    graph_path = Path(graph_path)
+    route_geometry_files = [graph_path / CONFIG_ROUTE_GEOMETRY_FOLDER / "{}.npy".format(name)
+                            for name in ROUTE_GEOMETRY_ARRAYS]
+    if not all(route_geometry_file.is_file() for route_geometry_file in route_geometry_files):
+        return None
+    graph_mtimes = [graph_file.stat().st_mtime for graph_file in get_graph_files(graph_path)]
+    route_geometry_mtimes = [route_geometry_file.stat().st_mtime for route_geometry_file in route_geometry_files]
+    if len(graph_mtimes) > 0 and min(route_geometry_mtimes) < max(graph_mtimes):
+        return None
+
+    arrays = {name: np.load(route_geometry_file, mmap_mode='r')
+              for name, route_geometry_file in zip(ROUTE_GEOMETRY_ARRAYS, route_geometry_files)}
+    route_geometry = {}
+    for i, route_id in enumerate(arrays["route_ids"].tolist()):
+        node_start, node_end = arrays["route_node_offsets"][i:i + 2].tolist()
+        way_start, way_end = arrays["route_way_offsets"][i:i + 2].tolist()
+        route_geometry[route_id] = {
+            "way_ids": arrays["way_ids"][way_start:way_end],
+            "way_starts": arrays["way_starts"][way_start + i:way_end + i + 1],
+            "node_ways": arrays["node_ways"][node_start:node_end],
+            "lats": arrays["lats"][node_start:node_end],
+            "lngs": arrays["lngs"][node_start:node_end],
+            "node_offsets": arrays["node_offsets"][node_start:node_end],
+        }
+    return route_geometry
+
+
+def get_graph_files(graph_path):
+    """
+    Get the graph files (final_node_table, final_way_table and final_relation_table, in pickle, JSON or graph bundle)
+    in graph_path.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    Returns
+    -------
+    List of Path: the files that exist
+    """
+    graph_files = [Path(graph_path) / "{}{}".format(filename, suffix)
+                   for filename in ["final_node_table", "final_way_table", "final_relation_table"]
+                   for suffix in [".p", ".json", GRAPH_BUNDLE_SUFFIX]]
+    return [graph_file for graph_file in graph_files if graph_file.is_file()]
+
+
+def get_graph_hash(graph_path):
+    """
+    Hash the content of the graph files, used as the key of the results that depend on the graph, e.g., the matched
+    points cache of find_traffic_speed.
+
+    The hash is kept in graph_path/CONFIG_ROUTE_GEOMETRY_FOLDER/CONFIG_GRAPH_HASH_FILE with the modification time and
+    the size of each file, the files are only read again when one of them changes.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    Returns
+    -------
+    string: the sha1 hex digest of the graph files
+    """
+    graph_files = get_graph_files(graph_path)
+    file_stats = [graph_file.stat() for graph_file in graph_files]
+    file_versions = {graph_file.name: [file_stat.st_mtime_ns, file_stat.st_size]
+                     for graph_file, file_stat in zip(graph_files, file_stats)}
+    graph_hash_file = Path(graph_path) / CONFIG_ROUTE_GEOMETRY_FOLDER / CONFIG_GRAPH_HASH_FILE
+    try:
+        with open(graph_hash_file, 'r') as f:
+            graph_hash_cache = json.load(f)
+        if graph_hash_cache["files"] == file_versions:
+            return graph_hash_cache["graph_hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    graph_hash = hashlib.sha1()
+    for graph_file in graph_files:
+        graph_hash.update(graph_file.name.encode())
+        with open(graph_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                graph_hash.update(block)
+    try:
+        graph_hash_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = graph_hash_file.with_suffix(graph_hash_file.suffix + ".tmp")
+        with open(temp_file, 'w') as f:
+            json.dump({"files": file_versions, "graph_hash": graph_hash.hexdigest()}, f)
+        os.replace(temp_file, graph_hash_file)
+    except OSError:
+        # e.g., the graph folder is read-only, the hash is computed again next time
+        pass
+    return graph_hash.hexdigest()
+
+
+def load_way_index(graph_path, final_node_table, final_way_table, final_relation_table):
+    """
+    Build the way index for map matching, with the route geometry memory-mapped from graph_path. The route geometry is
+    compiled and saved first if it is missing or out of date.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    Returns
+    -------
+    way_index: Dictionary
+        The return of build_way_index, plus
+        "route_geometry": the return of load_route_geometry
+        "graph_hash": the return of get_graph_hash
+    """
+    way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+    route_geometry = load_route_geometry(graph_path)
+    if route_geometry is None:
+        save_route_geometry(build_route_geometry(way_index, final_way_table, final_relation_table), graph_path)
+        route_geometry = load_route_geometry(graph_path)
+    way_index["route_geometry"] = route_geometry
+    way_index["graph_hash"] = get_graph_hash(graph_path)
+    return way_index
+
+
+def find_nearest_road_batch(final_node_table, final_way_table, final_relation_table, route_ids, lats, lngs,
+                            bus_route_to_relation_index=None, margin=0.01, way_index=None, max_chunk_size=2000000,
+                            return_offsets=False):
+    """
+    Get the closest road for all the points of a bus trace at once, each point is matched only once.
+
+    The result of each point is the same as find_nearest_road with the relations of its route.
+
+    Parameters
+    ----------
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    route_ids: np.ndarray
+        route_id_curr of each point
+
+    lats: np.ndarray
+        Latitude of each point
+
+    lngs: np.ndarray
+        Longitude of each point
+
+    bus_route_to_relation_index: Dictionary
+        The return of get_bus_route_to_relation_index, it is built here if not provided.
+
+    margin: float
+        the range of the nodes we will get (in degree), by default is 0.01
+
+    way_index: Dictionary
+        The return of build_way_index or load_way_index, it is built here if not provided. The route geometry of
+        load_way_index is used when the route is in it.
+
+    max_chunk_size: int
+        The points are processed in chunks so that (points in a chunk) * (nodes of the route) is at most this number,
+        which bounds the memory used.
+
+    return_offsets: bool
+        Also return the offsets of the projection points along their ways
+
+    Returns
+    -------
+    projections: np.ndarray
+        (n, 2) array of the lat and lng of the projection points, [0, 0] if the point is not matched
+
+    way_ids: np.ndarray
+        The id of the way that closest to each point, -1 if no relation is found for the route of the point
+
+    offsets: np.ndarray
+        Only if return_offsets is True. The distance (in km) from the first node of the way to the projection point
+        along the way, 0 if the point is not matched
+    """
+    if bus_route_to_relation_index is None:
+        bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    if way_index is None:
+        way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+
+    route_ids = np.asarray(route_ids)
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    projections = np.zeros((len(route_ids), 2))
+    way_ids = np.full(len(route_ids), -1, dtype=np.int64)
+    offsets = np.zeros(len(route_ids))
+
+    route_geometry = way_index.get("route_geometry") or {}
+    for route_id in np.unique(route_ids).tolist():
+        if route_id in route_geometry:
+            relation_geometry = route_geometry[route_id]
+        else:
+            possible_relations = get_possible_relations(route_id, bus_route_to_relation_index, final_relation_table)
+            if len(possible_relations) <= 0:
+                continue
+            relation_geometry = get_relation_geometry(way_index, final_way_table, final_relation_table,
+                                                      possible_relations)
+        points = np.flatnonzero(route_ids == route_id)
+        chunk_size = max(1, max_chunk_size // max(1, len(relation_geometry["lats"])))
+        for chunk_start in range(0, len(points), chunk_size):
+            chunk = points[chunk_start:chunk_start + chunk_size]
+            projections[chunk], way_ids[chunk], offsets[chunk] = project_to_relation_geometry(
+                relation_geometry, lats[chunk], lngs[chunk], margin)
+
+    if return_offsets:
+        return projections, way_ids, offsets
+    return projections, way_ids
+
+
 if __name__ == '__main__':
     # compute_poly_fit(3, 0.0001)
     # exit(0)
@@ -1,32 +1,64 @@
 import csv
 import datetime
 import math
+import multiprocessing
 import os
 import pickle
-import re
 import sys
 import time
 from pathlib import Path
 
+import numpy as np
 from tqdm import tqdm
 
-from find_nearest_road import find_nearest_road, distance
+from find_nearest_road import build_way_index, find_nearest_road_batch, get_bus_route_to_relation_index, \
+    load_way_index, distance
 from helper.debug_show_traffic_speed_map import show_traffic_speed
-from helper.global_var import FLAG_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE, CONFIG_SINGLE_DAY_FOLDER, \
-    CONFIG_SINGLE_DAY_RESULT_FILE
+from helper.global_var import FLAG_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE, CONFIG_SINGLE_DAY_RESULT_FILE, \
+    CONFIG_RAW_DATA_FOLDER, CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE, CONFIG_SINGLE_DAY_MATCHED_POINTS_FILE, \
+    FIND_TRAFFIC_SPEED_WORKERS, REAL_TIME_MAX_IDLE_TIME
 from helper.graph_reader import graph_reader
 from helper.helper_time_range_index_to_str import time_range_index_to_time_range_str
+from helper.history_store import add_history_day, get_result_file_version
+from process_data import RAW_DATA_COLUMNS, get_data_source_name, list_data_sources, load_data_files, \
+    select_day_data, split_into_shards
+from reformat_data import group_data_by_bus, load_bus_traces
 
 
-def find_traffic_speed(date_str, final_node_table, final_way_table, final_relation_table,
-                       time_slot_interval=5, recent_data_time=0):
+def select_recent_data(trace, new_data_threshold_in_second_of_the_day):
     """
-    Get the road speed matrix
+    Only keep the data of a bus after the given time of the day.
 
     Parameters
     ----------
-    date_str: string
-        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+    trace: Dictionary
+        The data of the bus, see reformat_data.group_by_bus
+
+    new_data_threshold_in_second_of_the_day: int
+        The time of the day in seconds
+
+    Returns
+    -------
+    trace: Dictionary
+        The data of the bus after the given time
+    """
+    keep = trace["total_seconds"] >= new_data_threshold_in_second_of_the_day
+    return {key: value[keep] for key, value in trace.items()}
+
+
+# The points of a bus that the matched points cache is checked against
+MATCHED_POINTS_TRACE_KEYS = ["route_id", "lat", "lng", "location_time"]
+
+
+def match_bus_points(trace, final_node_table, final_way_table, final_relation_table, bus_route_to_relation_index,
+                     way_index, cached_matched_points=None):
+    """
+    Map match all the points of a bus, unless the cache of the previous run has the same points.
+
+    Parameters
+    ----------
+    trace: Dictionary
+        The data of the bus, see reformat_data.group_by_bus
 
     final_node_table: Dict
         A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
@@ -35,189 +67,257 @@ def find_traffic_speed(date_str, final_node_table, final_way_table, final_relati
         A dictionary that stored the way id and a list of node id's as a key value pair.
 
     final_relation_table:
-        final_relation_table is a dictionary that stored the relation id and a tuple that had a list of nodes and ways
-        and a list of tags. The list of nodes and ways were the stops and streets that made up a specific NFTA route.
-        Nodes are usually included because the routes start and end at points that are generally not the natural
-        endpoint of a road. The tags are useful because they possess information on the route like its name and what
-        type of vehicle traverse the route (e.g. bus).
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
 
-    time_slot_interval: Int
-        The length of each time interval in minutes. The input number should be divisible by 1440 (24 hour * 60 min)
-        by default it is 5 min
+    bus_route_to_relation_index: Dictionary
+        The return of find_nearest_road.get_bus_route_to_relation_index
 
-    recent_data_time: Int
-        If not 0, the function will only use the new data within [recent_data_time (in minute)] from the current time
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index
+
+    cached_matched_points: Dictionary
+        The matched points of the bus from load_matched_points, None if there is none
 
     Returns
     -------
-    road_speeds: Map of [Int to [List of Int]]
-        The lat and lng of the projection point from given point to the nearest road
+    bus_matched_points: Dictionary
+        "route_id", "lat", "lng", "location_time": the points of the trace (location_time is missing if the trace has
+                                                   no location_time)
+        "projection": (n, 2) np.ndarray, the lat and lng of the projection points
+        "way_id": np.ndarray, the id of the matched way, -1 if not matched
+        "offset": np.ndarray, the distance (in km) from the first node of the way to the projection point along the way
+
+    cached: bool
+        True if the matched points are taken from cached_matched_points
     """
+    if cached_matched_points is not None and \
+            all(key in trace and np.array_equal(cached_matched_points[key], trace[key])
+                for key in MATCHED_POINTS_TRACE_KEYS):
+        return cached_matched_points, True
 
-    time_slot_interval = int(time_slot_interval)
-    if time_slot_interval <= 0 or time_slot_interval > 1440:
-        raise RuntimeError('interval should be between (0, 1440]')
-    if 1440 % time_slot_interval != 0:
-        raise RuntimeError('interval is not divisible by 1440')
+    projections, ways, offsets = find_nearest_road_batch(final_node_table, final_way_table, final_relation_table,
+                                                         trace["route_id"], trace["lat"], trace["lng"],
+                                                         bus_route_to_relation_index, way_index=way_index,
+                                                         return_offsets=True)
+    bus_matched_points = {key: trace[key] for key in MATCHED_POINTS_TRACE_KEYS if key in trace}
+    bus_matched_points.update({"projection": projections, "way_id": ways, "offset": offsets})
+    return bus_matched_points, False
 
-    max_index = int(1440 / time_slot_interval)
 
-    data_directory = Path(CONFIG_SINGLE_DAY_FOLDER.format(date_str)) / "sorted"
-    output_path = Path(CONFIG_SINGLE_DAY_RESULT_FILE.format(date_str, time_slot_interval))
-    if recent_data_time > 0:
-        output_path = output_path.with_name(output_path.stem + "__latest_{}_min_only".format(recent_data_time) +
-                                            output_path.suffix)
+def load_matched_points(matched_points_file, graph_hash):
+    """
+    Load the matched points cache saved by save_matched_points.
 
-    # This data structures will have the final result.
-    # All of the keys will represent all of the ways that have a bus route go through them.
-    road_speeds = {}
+    Parameters
+    ----------
+    matched_points_file: Path
+        The path of the cache file
 
-    # Many roads would get multiple data points.
-    # The result is that we have to average speed.
-    # My solution for this was to have an array of speeds and average them in the end.
-    meta_speeds = {}
+    graph_hash: string
+        The hash of the graph files (see find_nearest_road.get_graph_hash), the cache is ignored if it was made with
+        another graph
 
-    for key, speed_samples in final_way_table.items():
-        row = []
-        for i in range(max_index):
-            row.append([])
-        meta_speeds.update({key: row})
-        road_speeds.update({key: [0] * max_index})
+    Returns
+    -------
+    matched_points: Dictionary
+        {bus_id: the matched points of the bus, see match_bus_points}, empty if the file does not exist or does not
+        match the graph
+    """
+    if not matched_points_file.is_file():
+        return {}
+    with np.load(matched_points_file) as arrays:
+        if str(arrays["graph_hash"]) != graph_hash:
+            return {}
+        arrays = {key: arrays[key] for key in arrays.files}
+
+    vehicle_ids = arrays["vehicle_id"]
+    boundaries = np.flatnonzero(np.diff(vehicle_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(vehicle_ids)]])
+    matched_points = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if start == end:
+            continue
+        bus_matched_points = {key: arrays[key][start:end] for key in MATCHED_POINTS_TRACE_KEYS + ["way_id", "offset"]}
+        bus_matched_points["projection"] = np.stack([arrays["projection_lat"][start:end],
+                                                     arrays["projection_lng"][start:end]], axis=1)
+        matched_points[int(vehicle_ids[start])] = bus_matched_points
+    return matched_points
 
-    # used_ways = set()  #  declare but never used
 
-    bus_route_to_relation_index = {}
-    for relation_index, relation_detail in final_relation_table.items():
-        re_result = re.match(r"[0-9]+", relation_detail[1]['ref'])
-        if re_result is None:
+def save_matched_points(date_str, matched_points, matched_points_file, graph_hash):
+    """
+    Save the matched points of a day as one row per point: vehicle, timestamp, way id, projected lat/lng and the offset
+    along the way, plus the route and the GPS location used to check the cache. The file is replaced at once.
+
+    The matched points files of the day made with another graph are deleted, they are never used again.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    matched_points: Dictionary
+        {bus_id: the matched points of the bus, see match_bus_points}, the buses without location_time are skipped
+
+    matched_points_file: Path
+        The path of the cache file
+
+    graph_hash: string
+        The hash of the graph files, see find_nearest_road.get_graph_hash
+    """
+    bus_ids = [bus_id for bus_id, bus_matched_points in matched_points.items()
+               if "location_time" in bus_matched_points]
+    if len(bus_ids) == 0:
+        return
+    points = [matched_points[bus_id] for bus_id in bus_ids]
+    arrays = {"vehicle_id": np.repeat(np.array(bus_ids, dtype=np.int64),
+                                      [len(bus_matched_points["way_id"]) for bus_matched_points in points])}
+    for key in MATCHED_POINTS_TRACE_KEYS + ["way_id", "offset"]:
+        arrays[key] = np.concatenate([bus_matched_points[key] for bus_matched_points in points])
+    arrays["projection_lat"] = np.concatenate([bus_matched_points["projection"][:, 0] for bus_matched_points in points])
+    arrays["projection_lng"] = np.concatenate([bus_matched_points["projection"][:, 1] for bus_matched_points in points])
+
+    matched_points_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = matched_points_file.with_suffix(matched_points_file.suffix + ".tmp")
+    with open(temp_file, 'wb') as f:
+        np.savez(f, graph_hash=np.array(graph_hash), **arrays)
+    os.replace(temp_file, matched_points_file)
+
+    day_matched_points_files = Path(CONFIG_SINGLE_DAY_MATCHED_POINTS_FILE.format(date_str, "*"))
+    for old_matched_points_file in day_matched_points_files.parent.glob(day_matched_points_files.name):
+        if old_matched_points_file != matched_points_file:
+            try:
+                os.remove(old_matched_points_file)
+            except OSError:
+                pass
+
+
+# The graph tables and the bus data used by the worker processes of find_traffic_speed. It is filled before the pool
+# is created, so the workers inherit it when they are forked instead of receiving it with each task.
+speed_worker_context = {}
+
+
+def get_bus_speed_samples(bus_id, trace, final_node_table, final_way_table, final_relation_table,
+                          time_slot_intervals, bus_route_to_relation_index, way_index, bus_matched_points=None):
+    """
+    Get the speed samples of one bus from its time sorted data.
+
+    Parameters
+    ----------
+    bus_id: int
+        The vehicle_id of the bus, only used in the debug messages
+
+    trace: Dictionary
+        The data of the bus, see reformat_data.group_by_bus
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    time_slot_intervals: List of Int
+        The lengths of the time intervals in minutes. The points are matched once and used for all of them.
+
+    bus_route_to_relation_index: Dictionary
+        The return of find_nearest_road.get_bus_route_to_relation_index
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index
+
+    bus_matched_points: Dictionary
+        The return of match_bus_points for the trace, the points are matched here if not provided.
+
+    Returns
+    -------
+    interval_speed_samples: Dictionary
+        {time_slot_interval: List of (way id, interval index, speed)}, the speeds (in mph) in the order they are added
+        to the ways
+    """
+    interval_speed_samples = {time_slot_interval: [] for time_slot_interval in time_slot_intervals}
+    # Takes the current data point and the next one and uses the pair
+    # for each calculation of distance and speed.
+    procressed_lines_data = list(zip(trace["route_id"].tolist(),  # route_id
+                                     trace["lat"].tolist(),  # lat
+                                     trace["lng"].tolist(),  # lng
+                                     trace["total_seconds"].tolist()))  # total_seconds
+    # Match all the points of the bus at once, instead of twice per point in the pairs below
+    if bus_matched_points is None:
+        bus_matched_points = match_bus_points(trace, final_node_table, final_way_table, final_relation_table,
+                                              bus_route_to_relation_index, way_index)[0]
+    projections = bus_matched_points["projection"].tolist()
+    ways = bus_matched_points["way_id"].tolist()
+
+    for i in range(len(procressed_lines_data) - 1):
+        # line1 = lines[i][:-1].split(',')
+        route_id1 = procressed_lines_data[i][0]
+        lat1 = procressed_lines_data[i][1]
+        lng1 = procressed_lines_data[i][2]
+        total_seconds1 = procressed_lines_data[i][3]
+
+        # line2 = lines[i + 1][:-1].split(',')
+        route_id2 = procressed_lines_data[i + 1][0]
+        lat2 = procressed_lines_data[i + 1][1]
+        lng2 = procressed_lines_data[i + 1][2]
+        total_seconds2 = procressed_lines_data[i + 1][3]
+
+        # These are all disqualifying pairs.
+        if total_seconds1 == total_seconds2:
+            # print('same time')
+            continue
+        if lat1 == lat2 and lng1 == lng2:
+            # print('same position')
+            continue
+        if lat1 >= 99.0 and lng1 >= 999.0:
+            # print('bad location 1')
+            continue
+        if lat2 >= 99.0 and lng1 >= 999.0:
+            # print('bad location 2')
+            continue
+        if route_id1 != route_id2:
+            # this usually works but it may fail if the bus takes an unofficial road to the new bus route
+            # start location， so I skip
             continue
-        temp_route = int(re_result.group())
-        if temp_route not in bus_route_to_relation_index:
-            bus_route_to_relation_index[temp_route] = set()
-        bus_route_to_relation_index[temp_route].add(relation_index)
 
-    debug_prof_count = [0, 0, 0]
-    current_time = datetime.datetime.now()
-    new_data_threshold_in_second_of_the_day = \
-        (current_time.hour * 3600 + current_time.minute * 60 + current_time.second) - (recent_data_time * 60)
+        # interval1_real_time = interval1 * 15
+        # print("{}:{}".format(interval1_real_time // 60, interval1_real_time % 60))
+
+        projection1, way1 = projections[i], ways[i]
+        if way1 < 0:
+            if FLAG_DEBUG:
+                print("No possible_relations found in {}, route_id {}, line {}".format(bus_id, route_id1, i))
+            continue
 
-    for filename in tqdm(os.listdir(data_directory)):
-        start_time = time.time()
-        procressed_lines_data = []
-        with open(data_directory / filename, "r", newline='') as csv_file:
-            reader_csv_file = csv.reader(csv_file)
+        projection2, way2 = projections[i + 1], ways[i + 1]
+        if way2 < 0:
+            if FLAG_DEBUG:
+                print("No possible_relations found in {}, line {}".format(bus_id, i + 1))
+            continue
 
-            # counter = 0  #declear but never used
-            # points = []  #declear but never used
-            # m = folium.Map(location=[42.89, -78.82], tiles="OpenStreetMap", zoom_start=12)
+        # print('{}:{}'.format(way,projection))
+        # print('{}:{}'.format(way2,projection2))
+        # print('{},{}'.format(lat,lng))
 
-            # Takes the current data point and the next one and uses the pair
-            # for each calculation of distance and speed.
+        speed = distance(projection1, projection2) / (total_seconds2 - total_seconds1)
+        # km/s -> mph
+        if speed == 0:
+            continue
+        speed = speed / 1.60934 * 3600
 
-            for temp_line in reader_csv_file:
-                # print(temp_line[10])
-                temp_total_second = int(temp_line[10][11:13]) * 3600 + int(temp_line[10][14:16]) * 60 + \
-                                    int(temp_line[10][17:19])
-                if recent_data_time > 0 and temp_total_second < new_data_threshold_in_second_of_the_day:
-                    continue
-                temp_data = [int(temp_line[1]),  # route_id
-                             float(temp_line[7]),  # lat
-                             float(temp_line[8]),  # lng
-                             temp_total_second,  # total_seconds
-                             int(temp_total_second / 300)]  # interval
-                # temp_data[4] = math.floor(temp_data[3] / 300)
-                procressed_lines_data.append(temp_data)
-
-        for i in range(len(procressed_lines_data) - 1):
-            # line1 = lines[i][:-1].split(',')
-            route_id1 = procressed_lines_data[i][0]
-            lat1 = procressed_lines_data[i][1]
-            lng1 = procressed_lines_data[i][2]
-            total_seconds1 = procressed_lines_data[i][3]
+        # The pair is used for every interval length, only the interval check below depends on it
+        for time_slot_interval in time_slot_intervals:
             interval1 = math.floor(total_seconds1 / (time_slot_interval * 60))
-
-            # line2 = lines[i + 1][:-1].split(',')
-            route_id2 = procressed_lines_data[i + 1][0]
-            lat2 = procressed_lines_data[i + 1][1]
-            lng2 = procressed_lines_data[i + 1][2]
-            total_seconds2 = procressed_lines_data[i + 1][3]
             interval2 = math.floor(total_seconds2 / (time_slot_interval * 60))
-
-            # These are all disqualifying pairs.
             if interval1 != interval2:
                 if not (2 < interval1 - interval2 < 2):
                     continue
                 # print('different interval')
                 # continue
-            if total_seconds1 == total_seconds2:
-                # print('same time')
-                continue
-            if lat1 == lat2 and lng1 == lng2:
-                # print('same position')
-                continue
-            if lat1 >= 99.0 and lng1 >= 999.0:
-                # print('bad location 1')
-                continue
-            if lat2 >= 99.0 and lng1 >= 999.0:
-                # print('bad location 2')
-                continue
-            if route_id1 != route_id2:
-                # this usually works but it may fail if the bus takes an unofficial road to the new bus route
-                # start location， so I skip
-                continue
-
-            # interval1_real_time = interval1 * 15
-            # print("{}:{}".format(interval1_real_time // 60, interval1_real_time % 60))
-
-            possible_relations1 = set()
-            if route_id1 in bus_route_to_relation_index:
-                possible_relations1 = bus_route_to_relation_index[route_id1]
-            else:
-                for key, speed_samples in final_relation_table.items():
-                    if str(route_id1) in speed_samples[1]['ref']:
-                        possible_relations1.add(key)
-
-            if len(possible_relations1) <= 0:
-                if FLAG_DEBUG:
-                    print("No possible_relations found in {}, route_id {}, line {}".format(filename, route_id1, i))
-                continue
-
-            projection1, way1 = find_nearest_road(final_node_table, final_way_table, final_relation_table,
-                                                  possible_relations1, [lat1, lng1])
-            if way1 < 0:
-                if FLAG_DEBUG:
-                    print("Error while running find_nearest_road in {}, line {}".format(filename, i))
-                continue
-
-            possible_relations2 = set()
-            if route_id2 in bus_route_to_relation_index:
-                possible_relations2 = bus_route_to_relation_index[route_id2]
-            else:
-                for key, speed_samples in final_relation_table.items():
-                    if str(route_id2) in speed_samples[1]['ref']:
-                        possible_relations2.add(key)
-
-            if len(possible_relations2) <= 0:
-                if FLAG_DEBUG:
-                    print("No possible_relations found in {}, line {}".format(filename, i + 1))
-                continue
-
-            projection2, way2 = find_nearest_road(final_node_table, final_way_table, final_relation_table,
-                                                  possible_relations2, [lat2, lng2])
-            if way1 < 0:
-                if FLAG_DEBUG:
-                    print("Error while running find_nearest_road in {}, line {}".format(filename, i + 1))
-                continue
-
-            # print('{}:{}'.format(way,projection))
-            # print('{}:{}'.format(way2,projection2))
-            # print('{},{}'.format(lat,lng))
-
-            speed = distance(projection1, projection2) / (total_seconds2 - total_seconds1)
-            # km/s -> mph
-            if speed == 0:
-                continue
-            speed = speed / 1.60934 * 3600
+            speed_samples = interval_speed_samples[time_slot_interval]
 
             # This code gives the same speed to all ways between the start location and the end location of the bus
             # route. I see very few places where this could fail, but if there is a -<=>- looking path the wrong
@@ -225,21 +325,21 @@ def find_traffic_speed(date_str, final_node_table, final_way_table, final_relati
             # See route 67, which openstreetmap marks as a backtrack for evidence of this problem
             if way1 == way2:
                 if interval1 == interval2:
-                    meta_speeds[way1][interval1].append(speed)
+                    speed_samples.append((way1, interval1, speed))
                 else:
-                    meta_speeds[way1][interval1].append(speed)
-                    meta_speeds[way1][interval2].append(speed)
+                    speed_samples.append((way1, interval1, speed))
+                    speed_samples.append((way1, interval2, speed))
                 # used_ways.add(way1)
                 # print('single speed: {}'.format(speed))
             else:
                 if interval1 == interval2:
-                    meta_speeds[way1][interval1].append(speed)
-                    meta_speeds[way2][interval1].append(speed)
+                    speed_samples.append((way1, interval1, speed))
+                    speed_samples.append((way2, interval1, speed))
                 else:
-                    meta_speeds[way1][interval1].append(speed)
-                    meta_speeds[way2][interval1].append(speed)
-                    meta_speeds[way1][interval2].append(speed)
-                    meta_speeds[way2][interval2].append(speed)
+                    speed_samples.append((way1, interval1, speed))
+                    speed_samples.append((way2, interval1, speed))
+                    speed_samples.append((way1, interval2, speed))
+                    speed_samples.append((way2, interval2, speed))
                 # used_ways.add(way1)
                 # used_ways.add(way2)
 
@@ -282,28 +382,226 @@ def find_traffic_speed(date_str, final_node_table, final_way_table, final_relati
             folium.Marker([lat2,lng2],icon=folium.Icon(color='red', icon_color='#FFFF00')).add_to(m)
             break
             '''
-        end_time = time.time()
-        # print("%s done, %d lines, %.3fs, %.3fs/100lines" % (
-        #     filename, len(procressed_lines_data), end_time - start_time,
-        #     (end_time - start_time) / len(procressed_lines_data) * 100))
-        debug_prof_count[0] += len(procressed_lines_data)
-        debug_prof_count[1] += end_time - start_time
-        debug_prof_count[2] += 1
-        # print(filename)
-    if FLAG_DEBUG and debug_prof_count[0] != 0:
-        print("All %d file processed, total %d lines, use %.2fs, %.4f/100lines" % (
-            debug_prof_count[2], debug_prof_count[0], debug_prof_count[1],
-            (debug_prof_count[1] * 100) / debug_prof_count[0]))
-    else:
-        print("All {} file processed".format(debug_prof_count[2]))
-    for way, speed_samples in meta_speeds.items():
-        # speed_intervals = []
-        for i in range(len(speed_samples)):
-            if len(speed_samples[i]) >= 1:
-                road_speeds[way][i] = sum(speed_samples[i]) / len(speed_samples[i])
+    return interval_speed_samples
+
+
+def get_shard_speed_samples(shard):
+    """
+    Get the speed samples of a shard of buses in a worker process of find_traffic_speed. The graph tables and the bus
+    data are read from speed_worker_context, which the worker inherits from the parent process.
+
+    Parameters
+    ----------
+    shard: List of int
+        The indexes of the buses in speed_worker_context["traces"]
+
+    Returns
+    -------
+    interval_speed_samples: Dictionary
+        {time_slot_interval: (ways, intervals, speeds)}, the speed samples of the buses as arrays (see
+        speed_samples_to_arrays), in the order of the buses in the shard
+
+    new_matched_points: Dictionary
+        {bus_id: the matched points of the bus}, only the buses that are not in speed_worker_context["matched_points"]
+        (the cache) and are matched again
+
+    line_count: int
+        The number of data points of the buses
+
+    elapsed: float
+        The time used (in seconds)
+    """
+    start_time = time.time()
+    context = speed_worker_context
+    interval_speed_samples = {time_slot_interval: [] for time_slot_interval in context["time_slot_intervals"]}
+    new_matched_points = {}
+    line_count = 0
+    for i in shard:
+        bus_id, trace = context["traces"][i]
+        bus_matched_points, cached = match_bus_points(trace, context["final_node_table"], context["final_way_table"],
+                                                      context["final_relation_table"],
+                                                      context["bus_route_to_relation_index"], context["way_index"],
+                                                      context["matched_points"].get(bus_id))
+        if not cached:
+            new_matched_points[bus_id] = bus_matched_points
+        bus_speed_samples = get_bus_speed_samples(bus_id, trace, context["final_node_table"],
+                                                  context["final_way_table"], context["final_relation_table"],
+                                                  context["time_slot_intervals"],
+                                                  context["bus_route_to_relation_index"], context["way_index"],
+                                                  bus_matched_points)
+        for time_slot_interval, speed_samples in bus_speed_samples.items():
+            interval_speed_samples[time_slot_interval] += speed_samples
+        line_count += len(trace["lat"])
+    interval_speed_samples = {time_slot_interval: speed_samples_to_arrays(speed_samples)
+                              for time_slot_interval, speed_samples in interval_speed_samples.items()}
+    return interval_speed_samples, new_matched_points, line_count, time.time() - start_time
+
+
+def speed_samples_to_arrays(speed_samples):
+    """
+    Convert the return of get_bus_speed_samples to arrays.
+
+    Parameters
+    ----------
+    speed_samples: List of (way id, interval index, speed)
+        The return of get_bus_speed_samples
+
+    Returns
+    -------
+    ways, intervals, speeds: np.ndarray
+        The way ids, the interval indexes and the speeds
+    """
+    ways = np.array([sample[0] for sample in speed_samples], dtype=np.int64)
+    intervals = np.array([sample[1] for sample in speed_samples], dtype=np.int64)
+    speeds = np.array([sample[2] for sample in speed_samples], dtype=np.float64)
+    return ways, intervals, speeds
+
+
+def get_way_row_index(way_rows):
+    """
+    The way ids of way_rows sorted, with their rows, to look up the rows of many ways at once with np.searchsorted (see
+    add_speed_samples).
+
+    Parameters
+    ----------
+    way_rows: Dictionary
+        {way id: row in the speed arrays}
+
+    Returns
+    -------
+    sorted_way_ids: np.ndarray
+        The way ids, sorted
+
+    sorted_rows: np.ndarray
+        The row of each way of sorted_way_ids
+    """
+    way_ids = np.fromiter(way_rows.keys(), dtype=np.int64, count=len(way_rows))
+    rows = np.fromiter(way_rows.values(), dtype=np.int64, count=len(way_rows))
+    order = np.argsort(way_ids)
+    return way_ids[order], rows[order]
+
+
+def add_speed_samples(speed_sums, speed_counts, way_row_index, ways, intervals, speeds):
+    """
+    Add the speed samples to the sum and the count of the speeds of each way and interval.
+
+    np.add.at adds the samples one by one in their order, so the sums are the same as summing the speeds of each way
+    and interval in a Python loop. The rows of the ways are looked up for all the samples at once.
+
+    Parameters
+    ----------
+    speed_sums: np.ndarray
+        (number of ways, number of intervals) array of the sum of the speeds, updated in place
+
+    speed_counts: np.ndarray
+        (number of ways, number of intervals) array of the number of the speeds, updated in place
+
+    way_row_index: (np.ndarray, np.ndarray)
+        The return of get_way_row_index, for the rows of speed_sums and speed_counts
+
+    ways, intervals, speeds: np.ndarray
+        The speed samples, see speed_samples_to_arrays
+    """
+    sorted_way_ids, sorted_rows = way_row_index
+    positions = np.minimum(np.searchsorted(sorted_way_ids, ways), len(sorted_way_ids) - 1)
+    unknown = sorted_way_ids[positions] != ways
+    if unknown.any():
+        raise KeyError(ways[unknown][0].item())
+    rows = sorted_rows[positions]
+    np.add.at(speed_sums, (rows, intervals), speeds)
+    np.add.at(speed_counts, (rows, intervals), 1)
+
+
+def get_time_slot_intervals(time_slot_interval):
+    """
+    Check the time_slot_interval argument of find_traffic_speed and turn it into a list.
+
+    Parameters
+    ----------
+    time_slot_interval: Int or List of Int
+        The length of each time interval in minutes. The input number should be divisible by 1440 (24 hour * 60 min)
+
+    Returns
+    -------
+    time_slot_intervals: List of Int
+        The lengths without duplicates
+    """
+    time_slot_intervals = time_slot_interval
+    if not isinstance(time_slot_interval, (list, tuple)):
+        time_slot_intervals = [time_slot_interval]
+    time_slot_intervals = [int(interval) for interval in time_slot_intervals]
+    for interval in time_slot_intervals:
+        if interval <= 0 or interval > 1440:
+            raise RuntimeError('interval should be between (0, 1440]')
+        if 1440 % interval != 0:
+            raise RuntimeError('interval is not divisible by 1440')
+    return list(dict.fromkeys(time_slot_intervals))
+
+
+def get_road_speeds(way_rows, speed_sums, speed_counts):
+    """
+    Average the speeds of each way and interval.
+
+    Parameters
+    ----------
+    way_rows: Dictionary
+        {way id: row in speed_sums and speed_counts}
+
+    speed_sums: np.ndarray
+        (number of ways, number of intervals) array of the sum of the speeds
+
+    speed_counts: np.ndarray
+        (number of ways, number of intervals) array of the number of the speeds
+
+    Returns
+    -------
+    road_speeds: Map of [Int to [List of Int]]
+        The average speed of each way in each interval, 0 if there is no data
+    """
+    # This data structures will have the final result.
+    # All of the keys will represent all of the ways that have a bus route go through them.
+    road_speeds = {}
+    average_speeds = (speed_sums / np.maximum(speed_counts, 1)).tolist()
+    for way, row in way_rows.items():
+        road_speeds[way] = [speed if count > 0 else 0
+                            for speed, count in zip(average_speeds[row], speed_counts[row].tolist())]
+    return road_speeds
+
+
+def save_road_speeds(date_str, road_speeds, time_slot_interval, recent_data_time=0, add_to_history=False):
+    """
+    Save the result of find_traffic_speed to data/yyyyMMdd/result/ as csv and pickle, and add the day to the history
+    store if add_to_history
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    road_speeds: Map of [Int to [List of Int]]
+        The return of get_road_speeds
+
+    time_slot_interval: Int
+        The length of each time interval in minutes
+
+    recent_data_time: Int
+        The recent_data_time of find_traffic_speed, it is added to the file name if not 0
+
+    add_to_history: bool
+        Add the day to the history store (see helper/history_store.py). Only for the finished days (e.g., the daily
+        batch of script/process_yesterday_data.py), not for the real time results that are updated all day long.
+    """
+    max_index = int(1440 / time_slot_interval)
+    output_path = Path(CONFIG_SINGLE_DAY_RESULT_FILE.format(date_str, time_slot_interval))
+    if recent_data_time > 0:
+        output_path = output_path.with_name(output_path.stem + "__latest_{}_min_only".format(recent_data_time) +
+                                            output_path.suffix)
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w+', newline='') as output_file:
+    # The files are written aside and replaced at once, as they may be read (e.g., by homepage.py) while the real time
+    # data is updated
+    temp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    with open(temp_path, 'w+', newline='') as output_file:
         writer = csv.writer(output_file)
         temp_row = ["Road ID"]
 
@@ -314,23 +612,505 @@ def find_traffic_speed(date_str, final_node_table, final_way_table, final_relati
 
         for key, value in road_speeds.items():
             writer.writerow([key] + value)
+    os.replace(temp_path, output_path)
 
-    with open(output_path.with_suffix('.p'), 'wb') as f:
+    temp_path = output_path.with_suffix('.p.tmp')
+    with open(temp_path, 'wb') as f:
         pickle.dump(road_speeds, f)
+    os.replace(temp_path, output_path.with_suffix('.p'))
+
+    if add_to_history and recent_data_time == 0:
+        # The predictions read the history from the history store, see helper/history_store.py
+        add_history_day(date_str, road_speeds, time_slot_interval,
+                        result_file_version=get_result_file_version(date_str, time_slot_interval))
+
+
+def find_traffic_speed(date_str, final_node_table, final_way_table, final_relation_table,
+                       time_slot_interval=5, recent_data_time=0, way_index=None, workers=FIND_TRAFFIC_SPEED_WORKERS,
+                       add_to_history=False):
+    """
+    Get the road speed matrix
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
 
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        final_relation_table is a dictionary that stored the relation id and a tuple that had a list of nodes and ways
+        and a list of tags. The list of nodes and ways were the stops and streets that made up a specific NFTA route.
+        Nodes are usually included because the routes start and end at points that are generally not the natural
+        endpoint of a road. The tags are useful because they possess information on the route like its name and what
+        type of vehicle traverse the route (e.g. bus).
+
+    time_slot_interval: Int or List of Int
+        The length of each time interval in minutes. The input number should be divisible by 1440 (24 hour * 60 min)
+        by default it is 5 min
+        If it is a list, the data is read and map matched once, and the result of each interval length is computed
+        from the same speed samples and saved in its own file.
+
+    recent_data_time: Int
+        If not 0, the function will only use the new data within [recent_data_time (in minute)] from the current time
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index, it is built here if not
+        provided.
+
+    workers: Int
+        The number of processes used to process the buses, by default is FIND_TRAFFIC_SPEED_WORKERS. The buses are
+        split into contiguous shards and the workers return the speed samples of their shards, which are added in the
+        order of the buses, so the result is the same as using 1 process. Only works where processes can be forked
+        (not on Windows), otherwise 1 process is used.
+
+    add_to_history: bool
+        Add the result to the history store, only when the day is finished, see save_road_speeds
+
+    The map matching result of the day is cached in CONFIG_SINGLE_DAY_MATCHED_POINTS_FILE when way_index comes from
+    find_nearest_road.load_way_index (which hashes the graph files). A later run with the same graph reuses the result
+    of each bus whose points did not change, and only matches the others. The cache is not used with recent_data_time.
+
+    Returns
+    -------
+    road_speeds: Map of [Int to [List of Int]]
+        The lat and lng of the projection point from given point to the nearest road
+        If time_slot_interval is a list, a dictionary {time_slot_interval: road_speeds} is returned.
+    """
+
+    time_slot_intervals = get_time_slot_intervals(time_slot_interval)
+
+    # Many roads would get multiple data points.
+    # The result is that we have to average speed.
+    # The sum and the count of the speeds of each way (row) and interval (column) are kept and averaged in the end.
+    way_rows = {way: row for row, way in enumerate(final_way_table)}
+    way_row_index = get_way_row_index(way_rows)
+    speed_sums = {}
+    speed_counts = {}
+    for interval in time_slot_intervals:
+        max_index = int(1440 / interval)
+        speed_sums[interval] = np.zeros((len(way_rows), max_index), dtype=np.float64)
+        speed_counts[interval] = np.zeros((len(way_rows), max_index), dtype=np.int64)
+
+    # used_ways = set()  #  declare but never used
+
+    bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    if way_index is None:
+        way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+
+    debug_prof_count = [0, 0, 0]
+    current_time = datetime.datetime.now()
+    new_data_threshold_in_second_of_the_day = \
+        (current_time.hour * 3600 + current_time.minute * 60 + current_time.second) - (recent_data_time * 60)
+
+    # The map matching result of the previous run, and the one of this run to save
+    matched_points = {}
+    day_matched_points = None
+    matched_points_file = None
+    if recent_data_time == 0 and "graph_hash" in way_index:
+        matched_points_file = Path(CONFIG_SINGLE_DAY_MATCHED_POINTS_FILE.format(date_str, way_index["graph_hash"][:16]))
+        matched_points = load_matched_points(matched_points_file, way_index["graph_hash"])
+        day_matched_points = {}
+    new_match_count = 0
+
+    traces = load_bus_traces(date_str)
+    if recent_data_time > 0:
+        traces = ((bus_id, select_recent_data(trace, new_data_threshold_in_second_of_the_day))
+                  for bus_id, trace in traces)
+
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # Each worker handles a contiguous shard of buses, and the samples are added in the order of the shards, so
+        # the speeds of each way are averaged in the same order as the serial loop below.
+        traces = list(traces)
+        speed_worker_context.update({"traces": traces, "final_node_table": final_node_table,
+                                     "final_way_table": final_way_table, "final_relation_table": final_relation_table,
+                                     "time_slot_intervals": time_slot_intervals,
+                                     "bus_route_to_relation_index": bus_route_to_relation_index,
+                                     "way_index": way_index, "matched_points": matched_points})
+        shards = split_into_shards(list(range(len(traces))), workers * 4)
+        try:
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                for interval_speed_samples, new_matched_points, line_count, elapsed in \
+                        tqdm(pool.imap(get_shard_speed_samples, shards), total=len(shards), unit="shard"):
+                    for interval, speed_samples in interval_speed_samples.items():
+                        add_speed_samples(speed_sums[interval], speed_counts[interval], way_row_index,
+                                          *speed_samples)
+                    matched_points.update(new_matched_points)
+                    new_match_count += len(new_matched_points)
+                    debug_prof_count[0] += line_count
+                    debug_prof_count[1] += elapsed
+        finally:
+            speed_worker_context.clear()
+        if day_matched_points is not None:
+            day_matched_points = {bus_id: matched_points[bus_id] for bus_id, trace in traces}
+        debug_prof_count[2] = len(traces)
+    else:
+        for bus_id, trace in tqdm(traces, unit="bus"):
+            start_time = time.time()
+            bus_matched_points, cached = match_bus_points(trace, final_node_table, final_way_table,
+                                                          final_relation_table, bus_route_to_relation_index, way_index,
+                                                          matched_points.get(bus_id))
+            if not cached:
+                new_match_count += 1
+            if day_matched_points is not None:
+                day_matched_points[bus_id] = bus_matched_points
+            interval_speed_samples = get_bus_speed_samples(bus_id, trace, final_node_table, final_way_table,
+                                                           final_relation_table, time_slot_intervals,
+                                                           bus_route_to_relation_index, way_index, bus_matched_points)
+            for interval, speed_samples in interval_speed_samples.items():
+                add_speed_samples(speed_sums[interval], speed_counts[interval], way_row_index,
+                                  *speed_samples_to_arrays(speed_samples))
+            end_time = time.time()
+            # print("%s done, %d lines, %.3fs, %.3fs/100lines" % (
+            #     filename, len(procressed_lines_data), end_time - start_time,
+            #     (end_time - start_time) / len(procressed_lines_data) * 100))
+            debug_prof_count[0] += len(trace["lat"])
+            debug_prof_count[1] += end_time - start_time
+            debug_prof_count[2] += 1
     if FLAG_DEBUG and debug_prof_count[0] != 0:
-        print("Generating map...")
-        show_traffic_speed(final_way_table, final_node_table, road_speeds, -1, -1, time_slot_interval, "OSM")
-        # for i in tqdm(range(0, 288, 12)):
-        #     debug_show_traffic_speed(final_way_table, final_node_table, road_speeds, i, i + 11)
+        print("All %d bus processed, total %d lines, use %.2fs, %.4f/100lines" % (
+            debug_prof_count[2], debug_prof_count[0], debug_prof_count[1],
+            (debug_prof_count[1] * 100) / debug_prof_count[0]))
+    else:
+        print("All {} bus processed".format(debug_prof_count[2]))
 
-    return road_speeds
+    if day_matched_points is not None and (new_match_count > 0 or day_matched_points.keys() != matched_points.keys()):
+        save_matched_points(date_str, day_matched_points, matched_points_file, way_index["graph_hash"])
+    if FLAG_DEBUG and matched_points_file is not None:
+        print("{} bus map matched, the others are read from {}".format(new_match_count, matched_points_file))
+
+    interval_road_speeds = {}
+    for interval in time_slot_intervals:
+        road_speeds = get_road_speeds(way_rows, speed_sums[interval], speed_counts[interval])
+        save_road_speeds(date_str, road_speeds, interval, recent_data_time, add_to_history)
+
+        if FLAG_DEBUG and debug_prof_count[0] != 0:
+            print("Generating map...")
+            show_traffic_speed(final_way_table, final_node_table, road_speeds, -1, -1, interval, "OSM")
+            # for i in tqdm(range(0, 288, 12)):
+            #     debug_show_traffic_speed(final_way_table, final_node_table, road_speeds, i, i + 11)
+
+        interval_road_speeds[interval] = road_speeds
+
+    if not isinstance(time_slot_interval, (list, tuple)):
+        return interval_road_speeds[time_slot_intervals[0]]
+    return interval_road_speeds
+
+
+def load_real_time_state(state_file, way_ids, time_slot_intervals):
+    """
+    Load the checkpoint of update_traffic_speed. A new empty state is returned if the file does not exist, or if it was
+    made with other ways or other interval lengths.
+
+    Parameters
+    ----------
+    state_file: Path
+        The path of the checkpoint file
+
+    way_ids: List of int
+        The way ids, in the order of the rows of the speed arrays
+
+    time_slot_intervals: List of Int
+        The lengths of the time intervals in minutes
+
+    Returns
+    -------
+    state: Dictionary
+        "way_ids", "time_slot_intervals": the same as the arguments
+        "consumed_sources": set of the names of the raw data files already used
+        "last_points": {bus_id: the last point used of the bus, a dictionary with the same keys as the trace (see
+                       reformat_data.group_by_bus)}
+        "speed_sums", "speed_counts": {time_slot_interval: np.ndarray}, the sum and the count of the speeds of each way
+                                      (row) and interval (column)
+    """
+    if state_file.is_file():
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        if state["way_ids"] == way_ids and state["time_slot_intervals"] == time_slot_intervals:
+            return state
+
+    state = {"way_ids": way_ids, "time_slot_intervals": time_slot_intervals, "consumed_sources": set(),
+             "last_points": {}, "speed_sums": {}, "speed_counts": {}}
+    for interval in time_slot_intervals:
+        state["speed_sums"][interval] = np.zeros((len(way_ids), int(1440 / interval)), dtype=np.float64)
+        state["speed_counts"][interval] = np.zeros((len(way_ids), int(1440 / interval)), dtype=np.int64)
+    return state
+
+
+def save_real_time_state(state, state_file):
+    """
+    Save the checkpoint of update_traffic_speed. The file is replaced at once, so a crash never leaves half of it.
+
+    Parameters
+    ----------
+    state: Dictionary
+        The state, see load_real_time_state
+
+    state_file: Path
+        The path of the checkpoint file
+    """
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = state_file.with_suffix(state_file.suffix + ".tmp")
+    with open(temp_file, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def stitch_real_time_traces(last_points, data):
+    """
+    Group newly arrived raw data by bus, and put the last point of each bus (from the previous data) in front of its
+    new points, so the pair between them is not lost.
+
+    New points that are not later than the last point of their bus have been used already (the raw files repeat the
+    last location of each bus) or arrived too late, and they are dropped.
+
+    Parameters
+    ----------
+    last_points: Dictionary
+        {bus_id: the last point of the bus, a dictionary with the same keys as the trace}, updated in place
+
+    data: DataFrame
+        The new raw data, the return of process_data.load_data_files
+
+    Returns
+    -------
+    List of (bus_id, trace), see reformat_data.group_by_bus
+    """
+    if data is None or len(data) == 0:
+        return []
+
+    traces = []
+    for bus_id, trace in group_data_by_bus(select_day_data(data)):
+        if bus_id in last_points:
+            last_point = last_points[bus_id]
+            new = trace["location_time"] > last_point["location_time"]
+            trace = {key: np.concatenate([[last_point[key]], value[new]]) for key, value in trace.items()}
+        last_points[bus_id] = {key: value[-1].item() for key, value in trace.items()}
+        traces.append((bus_id, trace))
+    return traces
+
+
+def add_real_time_data(state, data, final_node_table, final_way_table, final_relation_table, way_rows,
+                       bus_route_to_relation_index, way_index):
+    """
+    Add the speed samples of newly arrived raw data to the sums and counts of the real time state.
+
+    The last point of each bus is kept in the state, see stitch_real_time_traces.
+
+    Parameters
+    ----------
+    state: Dictionary
+        The real time state, see load_real_time_state, updated in place
+
+    data: DataFrame
+        The new raw data, the return of process_data.load_data_files
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    way_rows: Dictionary
+        {way id: row in the speed arrays of the state}
+
+    bus_route_to_relation_index: Dictionary
+        The return of find_nearest_road.get_bus_route_to_relation_index
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index
+
+    Returns
+    -------
+    int: the number of buses updated
+    """
+    traces = stitch_real_time_traces(state["last_points"], data)
+    way_row_index = get_way_row_index(way_rows)
+    for bus_id, trace in traces:
+        interval_speed_samples = get_bus_speed_samples(bus_id, trace, final_node_table, final_way_table,
+                                                       final_relation_table, state["time_slot_intervals"],
+                                                       bus_route_to_relation_index, way_index)
+        for interval, speed_samples in interval_speed_samples.items():
+            add_speed_samples(state["speed_sums"][interval], state["speed_counts"][interval], way_row_index,
+                              *speed_samples_to_arrays(speed_samples))
+    return len(traces)
+
+
+def drop_idle_buses(last_points, max_idle_time):
+    """
+    Forget the last point of the buses that have no data for a while, so the state does not grow with every bus seen.
+
+    A pair of points is only used when both are in the same interval, so nothing is lost when max_idle_time is longer
+    than the longest interval, unless the data of a bus arrives more than max_idle_time late.
+
+    Parameters
+    ----------
+    last_points: Dictionary
+        The last point of each bus, e.g., state["last_points"] of the real time state (see load_real_time_state),
+        updated in place
+
+    max_idle_time: int
+        The last point of a bus is dropped if it is more than max_idle_time seconds before the latest point of all
+        buses
+
+    Returns
+    -------
+    int: the number of buses dropped
+    """
+    if len(last_points) == 0:
+        return 0
+    latest_time = max(last_point["location_time"] for last_point in last_points.values())
+    idle_buses = [bus_id for bus_id, last_point in last_points.items()
+                  if latest_time - last_point["location_time"] > max_idle_time]
+    for bus_id in idle_buses:
+        del last_points[bus_id]
+    return len(idle_buses)
+
+
+def save_real_time_road_speeds(date_str, state, way_rows):
+    """
+    Average the sums and counts of the real time state and save the results as find_traffic_speed does.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    state: Dictionary
+        The real time state, see load_real_time_state
+
+    way_rows: Dictionary
+        {way id: row in the speed arrays of the state}
+
+    Returns
+    -------
+    interval_road_speeds: Dictionary
+        {time_slot_interval: road_speeds}, see find_traffic_speed
+    """
+    interval_road_speeds = {}
+    for interval in state["time_slot_intervals"]:
+        road_speeds = get_road_speeds(way_rows, state["speed_sums"][interval], state["speed_counts"][interval])
+        # the day is not finished, it is only added to the history store by the daily batch
+        save_road_speeds(date_str, road_speeds, interval, add_to_history=False)
+        interval_road_speeds[interval] = road_speeds
+    return interval_road_speeds
+
+
+def list_new_data_sources(date_str, state, min_file_size=10, min_file_age=10, verbose=True):
+    """
+    List the raw data files of the day that are not used by the real time state yet.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    state: Dictionary
+        The real time state, see load_real_time_state
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    min_file_age: int
+        Files modified in the last min_file_age seconds are left for later, as they may still be written.
+
+    verbose: bool
+        Print the number of files that are too small.
+
+    Returns
+    -------
+    list: the new data files, sorted by the file name
+    """
+    raw_path = Path(CONFIG_RAW_DATA_FOLDER.format(date_str))
+    current_time = time.time()
+    return [data_source for data_source in list_data_sources(raw_path, min_file_size, verbose=verbose)
+            if get_data_source_name(data_source) not in state["consumed_sources"] and
+            current_time - data_source.stat().st_mtime >= min_file_age]
+
+
+def update_traffic_speed(date_str, final_node_table, final_way_table, final_relation_table, time_slot_interval=5,
+                         way_index=None, min_file_size=10, min_file_age=10, max_idle_time=REAL_TIME_MAX_IDLE_TIME):
+    """
+    Incremental version of find_traffic_speed for the data of the current day.
+
+    Only the raw data files that were not used by the previous call are read (directly from data/yyyyMMdd/raw, without
+    preprocess_data). Their speed samples are added to the sums and counts kept in a checkpoint file
+    (CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE), so each call costs time proportional to the new data. See
+    add_real_time_data for how the pairs between the calls are handled.
+
+    The result files are the same as find_traffic_speed. The speeds are added in the order the files arrive instead of
+    bus by bus, so the averages may differ from find_traffic_speed in the last digits.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    time_slot_interval: Int or List of Int
+        See find_traffic_speed. The checkpoint is started over if it was made with other interval lengths.
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index, it is built here if not
+        provided.
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    min_file_age: int
+        Files modified in the last min_file_age seconds are left for the next call, as they may still be written.
+
+    max_idle_time: int
+        See drop_idle_buses
+
+    Returns
+    -------
+    road_speeds: Map of [Int to [List of Int]]
+        See find_traffic_speed
+    """
+    time_slot_intervals = get_time_slot_intervals(time_slot_interval)
+    way_rows = {way: row for row, way in enumerate(final_way_table)}
+    state_file = Path(CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE.format(date_str))
+    state = load_real_time_state(state_file, list(way_rows), time_slot_intervals)
+
+    bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    if way_index is None:
+        way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+
+    data_sources = list_new_data_sources(date_str, state, min_file_size, min_file_age)
+    data = load_data_files(data_sources, list(RAW_DATA_COLUMNS)) if len(data_sources) > 0 else None
+    bus_count = add_real_time_data(state, data, final_node_table, final_way_table, final_relation_table, way_rows,
+                                   bus_route_to_relation_index, way_index)
+    drop_idle_buses(state["last_points"], max_idle_time)
+    state["consumed_sources"].update(get_data_source_name(data_source) for data_source in data_sources)
+    save_real_time_state(state, state_file)
+    print("{} new files, {} bus updated".format(len(data_sources), bus_count))
+
+    interval_road_speeds = save_real_time_road_speeds(date_str, state, way_rows)
+    if not isinstance(time_slot_interval, (list, tuple)):
+        return interval_road_speeds[time_slot_intervals[0]]
+    return interval_road_speeds
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print("Usage:")
-        print("find_traffic_speed.py [date_str] <result path> <result format>")
+        print("find_traffic_speed.py [date_str] <result path> <result format> <workers>")
         print("")
         print("Require:")
         print("date_str       : 8 digit number of the date_str")
@@ -341,6 +1121,8 @@ if __name__ == '__main__':
         print("             by default is: graph/")
         print("Save format: the format to save the result, by default is pickle")
         print("             possible value: JSON or pickle")
+        print("Workers    : the number of processes used to process the buses, by default is {}".format(
+            FIND_TRAFFIC_SPEED_WORKERS))
         exit(0)
 
     date_str = sys.argv[1]
@@ -361,6 +1143,10 @@ if __name__ == '__main__':
             print("             possible value: JSON and pickle")
             exit(0)
 
+    workers = FIND_TRAFFIC_SPEED_WORKERS
+    if len(sys.argv) >= 5:
+        workers = int(sys.argv[4])
+
     if save_type == SAVE_TYPE_PICKLE:
         print("Result type: pickle")
     elif save_type == SAVE_TYPE_JSON:
@@ -373,10 +1159,12 @@ if __name__ == '__main__':
     final_way_table = map_dates[1]
     final_relation_table = map_dates[2]
 
+    way_index = load_way_index(result_file_path, final_node_table, final_way_table, final_relation_table)
+
     time_slot_interval = 5
 
     start_time = time.time()
     find_traffic_speed(date_str, final_node_table, final_way_table, final_relation_table,
-                       time_slot_interval=time_slot_interval)
+                       time_slot_interval=time_slot_interval, way_index=way_index, workers=workers)
     end_time = time.time()
     print("Total time = %.3fs" % (end_time - start_time))
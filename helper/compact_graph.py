@@ -0,0 +1,346 @@
+import os
+from collections.abc import ItemsView, Mapping
+from pathlib import Path
+
+import numpy as np
+
+from helper.global_var import CONFIG_COMPACT_GRAPH_FILE, FLAG_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX, read_graph_bundle, write_graph_bundle
+from helper.graph_reader import graph_reader
+
+COMPACT_GRAPH_ARRAYS = ["node_ids", "node_lats", "node_lons", "way_ids", "way_order", "way_node_offsets",
+                        "way_node_indices", "way_type_codes", "way_speed_limits", "type_names", "type_speed_limits",
+                        "way_graph_offsets", "way_graph_ways"]
+
+# The graph files the compact graph is built from, it is built again when one of them is newer than the arrays
+COMPACT_GRAPH_SOURCES = ["final_node_table", "final_way_table", "way_types", "way_type_avg_speed_limit", "way_graph"]
+
+# {graph_path: (versions of the source files, compact graph)}, see get_compact_graph
+compact_graph_cache = {}
+
+
+def build_compact_graph(final_node_table, final_way_table, way_types, way_type_avg_speed_limit, way_graph):
+    """
+    Compile the graph tables into contiguous numpy arrays, so that it can be saved with save_compact_graph and
+    memory-mapped by load_compact_graph.
+
+    Parameters
+    ----------
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    way_types: Dict
+        {way_id: the type of the way}, the ways that are not in it are "unclassified"
+
+    way_type_avg_speed_limit: Dict
+        {way type: the average speed limit of that type of way}
+
+    way_graph: Dict
+        {way_id: list of the way_id of the neighbors}
+
+    Returns
+    -------
+    compact_graph_arrays: Dictionary
+        The arrays of the graph, keys are COMPACT_GRAPH_ARRAYS
+        "node_ids": int64, the id of each node, sorted
+        "node_lats", "node_lons": float64, the coordinates of the node of the same position in node_ids
+        "way_ids": int64, the id of each way, in the order of final_way_table
+        "way_order": the positions in way_ids that sort way_ids, to look up a way with searchsorted
+        "way_node_offsets": the nodes of the i-th way are way_node_indices[way_node_offsets[i]:way_node_offsets[i + 1]]
+        "way_node_indices": int32, the position of each node of the ways in node_ids
+        "way_type_codes": int16, the position of the type of each way in type_names
+        "way_speed_limits": float64, the average speed limit of the type of each way
+        "type_names", "type_speed_limits": way_type_avg_speed_limit, "unclassified" is added if it is missing
+        "way_graph_offsets": the neighbors of the i-th way are way_graph_ways[way_graph_offsets[i]:...[i + 1]]
+        "way_graph_ways": int64, the way_id of the neighbors
+    """
+    node_ids = np.array(list(final_node_table), dtype=np.int64)
+    node_coordinates = np.array(list(final_node_table.values()), dtype=np.float64).reshape(-1, 2)
+    node_order = np.argsort(node_ids, kind="stable")
+    node_ids = node_ids[node_order]
+    node_coordinates = node_coordinates[node_order]
+
+    way_ids = np.array(list(final_way_table), dtype=np.int64)
+    way_node_ids = np.fromiter((node_id for nodes in final_way_table.values() for node_id in nodes), dtype=np.int64)
+    way_node_indices = np.searchsorted(node_ids, way_node_ids)
+    missing = (way_node_indices == len(node_ids)) | \
+        (node_ids[np.minimum(way_node_indices, len(node_ids) - 1)] != way_node_ids)
+    if missing.any():
+        raise ValueError("node {} of final_way_table is not in final_node_table".format(way_node_ids[missing][0]))
+
+    type_names = list(way_type_avg_speed_limit)
+    if "unclassified" not in way_type_avg_speed_limit:
+        type_names.append("unclassified")
+    type_codes = {way_type: code for code, way_type in enumerate(type_names)}
+    type_speed_limits = np.array([way_type_avg_speed_limit.get(way_type, 0) for way_type in type_names],
+                                 dtype=np.float64)
+    way_type_codes = np.array([type_codes[way_types.get(way_id, "unclassified")] for way_id in final_way_table],
+                              dtype=np.int16)
+
+    neighbors = [way_graph.get(way_id, []) for way_id in final_way_table]
+    return {
+        "node_ids": node_ids,
+        "node_lats": np.ascontiguousarray(node_coordinates[:, 0]),
+        "node_lons": np.ascontiguousarray(node_coordinates[:, 1]),
+        "way_ids": way_ids,
+        "way_order": np.argsort(way_ids, kind="stable"),
+        "way_node_offsets": np.cumsum([0] + [len(nodes) for nodes in final_way_table.values()], dtype=np.int64),
+        "way_node_indices": way_node_indices.astype(np.int32),
+        "way_type_codes": way_type_codes,
+        "way_speed_limits": type_speed_limits[way_type_codes],
+        "type_names": np.array(type_names, dtype=str),
+        "type_speed_limits": type_speed_limits,
+        "way_graph_offsets": np.cumsum([0] + [len(way_neighbors) for way_neighbors in neighbors], dtype=np.int64),
+        "way_graph_ways": np.fromiter((way for way_neighbors in neighbors for way in way_neighbors), dtype=np.int64),
+    }
+
+
+def save_compact_graph(compact_graph_arrays, graph_path, source_file=None):
+    """
+    Save the return of build_compact_graph as a graph bundle (see helper/graph_bundle.py) in
+    graph_path/CONFIG_COMPACT_GRAPH_FILE
+
+    Parameters
+    ----------
+    compact_graph_arrays: Dictionary
+        The return of build_compact_graph
+
+    graph_path: Path
+        The path of the graph folder
+
+    source_file: Path
+        The OSM file the graph is built from, its checksum is saved in the bundle
+    """
+    compact_graph_file = Path(graph_path) / "{}{}".format(CONFIG_COMPACT_GRAPH_FILE, GRAPH_BUNDLE_SUFFIX)
+    write_graph_bundle(compact_graph_file, {name: compact_graph_arrays[name] for name in COMPACT_GRAPH_ARRAYS},
+                       source_file)
+    if FLAG_DEBUG:
+        print("{} saved".format(compact_graph_file))
+
+
+def get_compact_graph_source_files(graph_path):
+    """
+    The graph files (pickle, JSON or graph bundle) in graph_path the compact graph is built from.
+    """
+    graph_path = Path(graph_path)
+    return [graph_path / "{}{}".format(name, suffix) for name in COMPACT_GRAPH_SOURCES
+            for suffix in [".p", ".json", GRAPH_BUNDLE_SUFFIX] if (graph_path / "{}{}".format(name, suffix)).is_file()]
+
+
+def load_compact_graph(graph_path):
+    """
+    Memory-map the compact graph saved by save_compact_graph.
+
+    The file is ignored if it is older than the graph files (see COMPACT_GRAPH_SOURCES) in graph_path, as it may not
+    match the graph anymore, or if it was written by another version of the graph bundle.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    Returns
+    -------
+    compact_graph: Dictionary
+        The arrays (see build_compact_graph) memory-mapped, and the compatibility views of add_compact_graph_views.
+        None if the file does not exist or is out of date.
+    """
+    graph_path = Path(graph_path)
+    compact_graph_file = graph_path / "{}{}".format(CONFIG_COMPACT_GRAPH_FILE, GRAPH_BUNDLE_SUFFIX)
+    if not compact_graph_file.is_file():
+        return None
+    graph_mtimes = [graph_file.stat().st_mtime for graph_file in get_compact_graph_source_files(graph_path)]
+    if len(graph_mtimes) > 0 and compact_graph_file.stat().st_mtime < max(graph_mtimes):
+        return None
+
+    try:
+        manifest, compact_graph = read_graph_bundle(compact_graph_file)
+    except ValueError as e:
+        print(e)
+        return None
+    if manifest["kind"] != "arrays" or sorted(compact_graph) != sorted(COMPACT_GRAPH_ARRAYS):
+        return None
+    return add_compact_graph_views(compact_graph)
+
+
+def get_compact_graph(graph_path=Path("graph/"), save_type=SAVE_TYPE_PICKLE):
+    """
+    The compact graph of graph_path, kept in memory for the later calls.
+
+    The arrays are memory-mapped from graph_path/CONFIG_COMPACT_GRAPH_FILE. If it is missing or out of date, they are
+    built from the graph files and saved (e.g., osm_interpreter.py was run by an older version), so only the first
+    call after the map is updated reads the graph files.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    save_type: int
+        The type of the graph files used to build the arrays, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE or SAVE_TYPE_NUMPY
+
+    Returns
+    -------
+    compact_graph: Dictionary
+        See load_compact_graph
+    """
+    cache_key = str(graph_path)
+    versions = []
+    for graph_file in get_compact_graph_source_files(graph_path):
+        file_stat = os.stat(graph_file)
+        versions.append((str(graph_file), file_stat.st_mtime_ns, file_stat.st_size))
+    if cache_key in compact_graph_cache and compact_graph_cache[cache_key][0] == versions:
+        return compact_graph_cache[cache_key][1]
+
+    compact_graph = load_compact_graph(graph_path)
+    if compact_graph is None:
+        graph_tables = graph_reader(Path(graph_path), save_type, COMPACT_GRAPH_SOURCES)
+        if save_type == SAVE_TYPE_JSON:
+            graph_tables = [{int(key) if key.lstrip("-").isdigit() else key: value for key, value in table.items()}
+                            for table in graph_tables]
+        compact_graph_arrays = build_compact_graph(*graph_tables)
+        try:
+            save_compact_graph(compact_graph_arrays, graph_path)
+        except OSError as e:
+            print("The compact graph cannot be saved in {}: {}".format(graph_path, e))
+        compact_graph = add_compact_graph_views(compact_graph_arrays)
+    compact_graph_cache[cache_key] = (versions, compact_graph)
+    return compact_graph
+
+
+def add_compact_graph_views(compact_graph):
+    """
+    Add the compatibility views to the arrays, for the code written for the dictionaries of graph_reader:
+    "final_node_table", "final_way_table", "way_types", "way_graph" (read-only Mapping, see CompactTableView), and
+    "way_type_avg_speed_limit" (a dictionary).
+    """
+    compact_graph["final_node_table"] = CompactTableView(compact_graph, compact_graph["node_ids"],
+                                                         np.arange(len(compact_graph["node_ids"])), get_node_value)
+    compact_graph["final_way_table"] = CompactTableView(compact_graph, compact_graph["way_ids"],
+                                                        compact_graph["way_order"], get_way_nodes)
+    compact_graph["way_types"] = CompactTableView(compact_graph, compact_graph["way_ids"], compact_graph["way_order"],
+                                                  get_way_type)
+    compact_graph["way_graph"] = CompactTableView(compact_graph, compact_graph["way_ids"], compact_graph["way_order"],
+                                                  get_way_neighbors)
+    compact_graph["way_type_avg_speed_limit"] = {
+        str(way_type): int(speed_limit) if float(speed_limit).is_integer() else float(speed_limit)
+        for way_type, speed_limit in zip(compact_graph["type_names"], compact_graph["type_speed_limits"])}
+    return compact_graph
+
+
+def get_node_value(compact_graph, position):
+    return [float(compact_graph["node_lats"][position]), float(compact_graph["node_lons"][position])]
+
+
+def get_way_nodes(compact_graph, position):
+    start, end = compact_graph["way_node_offsets"][position:position + 2].tolist()
+    return compact_graph["node_ids"][compact_graph["way_node_indices"][start:end]].tolist()
+
+
+def get_way_type(compact_graph, position):
+    return str(compact_graph["type_names"][compact_graph["way_type_codes"][position]])
+
+
+def get_way_neighbors(compact_graph, position):
+    start, end = compact_graph["way_graph_offsets"][position:position + 2].tolist()
+    return compact_graph["way_graph_ways"][start:end].tolist()
+
+
+def get_way_positions(compact_graph, way_ids):
+    """
+    The positions of the ways in compact_graph["way_ids"], -1 for the ways that are not in the graph.
+
+    Parameters
+    ----------
+    compact_graph: Dictionary
+        The return of get_compact_graph
+
+    way_ids: array-like of int
+
+    Returns
+    -------
+    np.ndarray of int64
+    """
+    way_ids = np.asarray(way_ids, dtype=np.int64)
+    sorted_way_ids = compact_graph["way_ids"][compact_graph["way_order"]]
+    sorted_positions = np.minimum(np.searchsorted(sorted_way_ids, way_ids), len(sorted_way_ids) - 1)
+    positions = np.asarray(compact_graph["way_order"])[sorted_positions]
+    return np.where(sorted_way_ids[sorted_positions] == way_ids, positions, -1)
+
+
+def get_way_points(compact_graph, position):
+    """
+    The [lat, lon] of each node of the way at position, i.e. [final_node_table[node] for node in final_way_table[way]]
+    """
+    start, end = compact_graph["way_node_offsets"][position:position + 2].tolist()
+    node_indices = compact_graph["way_node_indices"][start:end]
+    return np.column_stack((compact_graph["node_lats"][node_indices],
+                            compact_graph["node_lons"][node_indices])).tolist()
+
+
+def get_all_way_points(compact_graph):
+    """
+    The return of get_way_points for each way, in the order of compact_graph["way_ids"]. It is built at the first call
+    and kept in compact_graph, as the output of each request of homepage.py needs the points of most of the ways.
+    """
+    if "way_points" not in compact_graph:
+        way_node_offsets = compact_graph["way_node_offsets"].tolist()
+        way_node_indices = compact_graph["way_node_indices"]
+        points = np.column_stack((compact_graph["node_lats"][way_node_indices],
+                                  compact_graph["node_lons"][way_node_indices])).tolist()
+        compact_graph["way_points"] = [points[way_node_offsets[position]:way_node_offsets[position + 1]]
+                                       for position in range(len(way_node_offsets) - 1)]
+    return compact_graph["way_points"]
+
+
+class CompactTableView(Mapping):
+    """
+    Read-only dictionary view of a table of the compact graph, the values are built from the arrays when they are
+    accessed. The keys can also be given as str, as in the tables loaded from the JSON files.
+    """
+
+    def __init__(self, compact_graph, ids, order, get_value):
+        self.compact_graph = compact_graph
+        self.ids = ids
+        self.sorted_ids = ids[order]
+        self.order = order
+        self.get_value = get_value
+
+    def get_position(self, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return -1
+        sorted_position = np.searchsorted(self.sorted_ids, key)
+        if sorted_position < len(self.sorted_ids) and self.sorted_ids[sorted_position] == key:
+            return int(self.order[sorted_position])
+        return -1
+
+    def __getitem__(self, key):
+        position = self.get_position(key)
+        if position < 0:
+            raise KeyError(key)
+        return self.get_value(self.compact_graph, position)
+
+    def __contains__(self, key):
+        return self.get_position(key) >= 0
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        return CompactItemsView(self)
+
+
+class CompactItemsView(ItemsView):
+    def __iter__(self):
+        # faster than the default one that looks up each key
+        table = self._mapping
+        for position, key in enumerate(table.ids.tolist()):
+            yield key, table.get_value(table.compact_graph, position)
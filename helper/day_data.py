@@ -0,0 +1,136 @@
+from pathlib import Path
+
+import pandas as pd
+
+from helper.global_var import CONFIG_ALL_DAY_RAW_DATA_FILE, CONFIG_ALL_DAY_PARQUET_DATA_FILE, \
+    CONFIG_ALL_DAY_FEATHER_DATA_FILE, DAY_DATA_FORMAT_CSV, DAY_DATA_FORMAT_PARQUET, DAY_DATA_FORMAT_FEATHER
+
+# The columns of the merged data file of one day, i.e., data/yyyyMMdd/yyyyMMdd.csv
+DAY_DATA_COLUMNS = ['vehicle_id', 'route_id_curr', 'direction', 'block_id', 'next_tp_est', 'next_tp_sname',
+                    'next_tp_sched', 'X', 'Y', 'location time', 'datetime']
+
+# The dtypes used by the columnar formats. The nullable integer types are used as some raw data may miss a value.
+# X and Y keep float64, float32 cannot hold 6 digits after the decimal point for the coordinates of Buffalo.
+DAY_DATA_DTYPES = {'vehicle_id': 'int32', 'route_id_curr': 'int16', 'direction': 'Int16', 'block_id': 'Int32',
+                   'next_tp_est': 'Int32', 'next_tp_sname': 'category', 'next_tp_sched': 'Int32', 'X': 'float64',
+                   'Y': 'float64', 'location time': 'int64'}
+
+DAY_DATA_FILES = {DAY_DATA_FORMAT_PARQUET: CONFIG_ALL_DAY_PARQUET_DATA_FILE,
+                  DAY_DATA_FORMAT_FEATHER: CONFIG_ALL_DAY_FEATHER_DATA_FILE,
+                  DAY_DATA_FORMAT_CSV: CONFIG_ALL_DAY_RAW_DATA_FILE}
+
+
+def get_day_data_file(date_str, day_data_format=DAY_DATA_FORMAT_CSV):
+    """
+    Get the path of the merged data file of one day in the given format.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    day_data_format: int
+        The format of the file, use the following variable from helper.global_var
+        DAY_DATA_FORMAT_CSV, DAY_DATA_FORMAT_PARQUET or DAY_DATA_FORMAT_FEATHER
+
+    Returns
+    -------
+    Path: the path of the file
+    """
+    if day_data_format not in DAY_DATA_FILES:
+        raise ValueError("unknown day_data_format: {}".format(day_data_format))
+    return Path(DAY_DATA_FILES[day_data_format].format(date_str))
+
+
+def find_day_data_file(date_str):
+    """
+    Find the merged data file of one day. If there are more than one format, the latest one is used.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    Returns
+    -------
+    Path: the path of the file, None if the day has not been merged yet.
+    """
+    day_data_files = [get_day_data_file(date_str, day_data_format) for day_data_format in DAY_DATA_FILES]
+    day_data_files = [day_data_file for day_data_file in day_data_files if day_data_file.is_file()]
+    if len(day_data_files) == 0:
+        return None
+    return max(day_data_files, key=lambda day_data_file: day_data_file.stat().st_mtime)
+
+
+def write_day_data(data: pd.DataFrame, day_data_file: Path):
+    """
+    Write the merged data of one day, the format is decided by the suffix of the file.
+
+    The data should already be sorted by vehicle_id. In parquet, each row group then only covers a small range of
+    vehicles, so reading a few vehicles (see read_day_data) can skip most of the file.
+
+    Parameters
+    ----------
+    data: DataFrame
+        The merged data, with the columns in DAY_DATA_COLUMNS
+
+    day_data_file: Path
+        The path of the file
+    """
+    day_data_file = Path(day_data_file)
+    if day_data_file.suffix == ".csv":
+        data.to_csv(day_data_file, index=False)
+        return
+
+    data = data.astype({key: value for key, value in DAY_DATA_DTYPES.items() if key in data.columns})
+    data = data.reset_index(drop=True)
+    if day_data_file.suffix == ".parquet":
+        data.to_parquet(day_data_file, index=False, row_group_size=16384)
+    elif day_data_file.suffix == ".feather":
+        data.to_feather(day_data_file)
+    else:
+        raise ValueError("unknown day data file: {}".format(day_data_file))
+
+
+def read_day_data(day_data_file: Path, columns=None, vehicle_ids=None) -> pd.DataFrame:
+    """
+    Read the merged data of one day, only the given columns (and vehicles) are loaded.
+
+    Parameters
+    ----------
+    day_data_file: Path
+        The path of the file, e.g., the return of find_day_data_file
+
+    columns: List[str], default is None
+        The columns to read, None for all columns.
+
+    vehicle_ids: List[int], default is None
+        Only read the rows of these vehicles, None for all vehicles.
+
+    Returns
+    -------
+    DataFrame: the data. Note that the datetime column is a string when read from the csv file.
+    """
+    day_data_file = Path(day_data_file)
+    if day_data_file.suffix == ".parquet":
+        filters = None
+        if vehicle_ids is not None:
+            filters = [('vehicle_id', 'in', list(vehicle_ids))]
+        return pd.read_parquet(day_data_file, columns=columns, filters=filters)
+
+    read_columns = columns
+    if columns is not None and vehicle_ids is not None and 'vehicle_id' not in columns:
+        read_columns = list(columns) + ['vehicle_id']
+
+    if day_data_file.suffix == ".feather":
+        data = pd.read_feather(day_data_file, columns=read_columns)
+    elif day_data_file.suffix == ".csv":
+        data = pd.read_csv(day_data_file, usecols=read_columns)
+    else:
+        raise ValueError("unknown day data file: {}".format(day_data_file))
+
+    if vehicle_ids is not None:
+        data = data[data['vehicle_id'].isin(vehicle_ids)]
+    if columns is not None:
+        data = data[columns]
+    return data
@@ -18,18 +18,74 @@ GOOGLE_MAPS_API_KEY = api_key.GOOGLE_MAPS_API_KEY
 CONFIG_DATA_FOLDER = "data/"
 CONFIG_SINGLE_DAY_FOLDER = "data/{0}"
 CONFIG_ALL_DAY_RAW_DATA_FILE = "data/{0}/{0}.csv"
+CONFIG_ALL_DAY_PARQUET_DATA_FILE = "data/{0}/{0}.parquet"
+CONFIG_ALL_DAY_FEATHER_DATA_FILE = "data/{0}/{0}.feather"
 CONFIG_ALL_DAY_ARCHIVED_RAW_DATA_FILE = "data/{0}/raw_{0}.zip"
 CONFIG_RAW_DATA_FOLDER = "data/{0}/raw"
 CONFIG_SINGLE_DAY_RESULT_FILE = "data/{0}/result/{0}_{1}_min_road.csv"
+# The checkpoint of update_traffic_speed() in find_traffic_speed.py: the raw data files already used, the last point of
+# each bus and the sum and count of the speeds
+CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE = "data/{0}/result/{0}_real_time_state.p"
+# The map matching result of each point of the day, saved by find_traffic_speed() and reused by the later runs with the
+# same graph. {1} is the beginning of the hash of the graph files, see get_graph_hash() in find_nearest_road.py
+CONFIG_SINGLE_DAY_MATCHED_POINTS_FILE = "data/{0}/result/{0}_matched_points_{1}.npz"
+# The speeds of all the days in one array file per interval length, with an index of the dates and the ways, see
+# helper/history_store.py. {0} is the length of the interval in minutes, {1} is the number of ways
+CONFIG_HISTORY_STORE_FOLDER = "data/history_store"
+CONFIG_HISTORY_STORE_DATA_FILE = "{0}_min_speeds_{1}.dat"
+CONFIG_HISTORY_STORE_INDEX_FILE = "{0}_min_speeds.json"
+# The folder (in the graph folder, next to final_way_table.p etc.) of the route geometry arrays used by map matching,
+# see build_route_geometry() in find_nearest_road.py
+CONFIG_ROUTE_GEOMETRY_FOLDER = "route_geometry"
+# The hash of the graph files (in CONFIG_ROUTE_GEOMETRY_FOLDER) with the modification time and the size of each file,
+# so the files are only hashed again when they change, see get_graph_hash() in find_nearest_road.py
+CONFIG_GRAPH_HASH_FILE = "graph_hash.json"
+# The graph bundle (in the graph folder, see helper/graph_bundle.py) of the graph tables compiled into numpy arrays, see
+# helper/compact_graph.py
+CONFIG_COMPACT_GRAPH_FILE = "compact_graph"
 
 # save_type
 SAVE_TYPE_JSON = 1
 SAVE_TYPE_PICKLE = 2
+# numpy arrays with a manifest, memory-mapped when read, see helper/graph_bundle.py
+SAVE_TYPE_NUMPY = 3
+
+# day_data_format
+# The format of the merged data file of one day, see preprocess_data() in process_data.py and helper/day_data.py
+DAY_DATA_FORMAT_CSV = 1
+DAY_DATA_FORMAT_PARQUET = 2
+DAY_DATA_FORMAT_FEATHER = 3
 
 # process_data
 # The program will only read the data from PROCESS_DATA_START_TIME to PROCESS_DATA_END_TIME
 PROCESS_DATA_START_TIME = 0
 PROCESS_DATA_END_TIME = 24
+# The number of processes used to load the raw data files of one day, 1 means load them in the current process
+PROCESS_DATA_WORKERS = 1
+# The number of raw data files concatenated and parsed together in one CSV parse
+PROCESS_DATA_BATCH_SIZE = 256
+# The format of the merged data file of one day, DAY_DATA_FORMAT_CSV, DAY_DATA_FORMAT_PARQUET or DAY_DATA_FORMAT_FEATHER
+PROCESS_DATA_DAY_DATA_FORMAT = DAY_DATA_FORMAT_CSV
+
+# find_traffic_speed
+# The number of processes used to process the buses of one day, 1 means process them in the current process
+FIND_TRAFFIC_SPEED_WORKERS = 1
+
+# real time data, see update_traffic_speed() in find_traffic_speed.py, ingest_real_time_data.py and ingest_pipeline.py
+# The last point of a bus is forgotten when it is more than REAL_TIME_MAX_IDLE_TIME seconds before the latest data
+REAL_TIME_MAX_IDLE_TIME = 3600
+# How often (in seconds) ingest_real_time_data.py looks for new raw data files
+REAL_TIME_POLL_INTERVAL = 5
+# A raw data file is only read when it has not been modified for REAL_TIME_MIN_FILE_AGE seconds
+REAL_TIME_MIN_FILE_AGE = 2
+# How often (in seconds) ingest_real_time_data.py saves its state to CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE
+REAL_TIME_CHECKPOINT_INTERVAL = 60
+# The number of map matching processes of ingest_pipeline.py
+INGEST_PIPELINE_WORKERS = 1
+# The maximum number of items in each queue between the stages of ingest_pipeline.py
+INGEST_PIPELINE_QUEUE_SIZE = 32
+# How often (in seconds) ingest_pipeline.py prints the queue depths
+INGEST_PIPELINE_REPORT_INTERVAL = 30
 
 # predict_road_condition
 # See predict_road_condition() in predict_road_condition.py for more detail of each variable
@@ -40,8 +96,17 @@ PREDICT_ROAD_CONDITION_CONFIG_WEIGHT = [0.08821194073566006, 0.08402736745847723
                                         0.03803083890311526, 0.08628806480829161, 0.08805171256460817,
                                         0.08184255395533459, 0.07774612670061147, 0.06883249115674404,
                                         0.06392337112461549]
+# How the ways without data get their speed, see estimate_no_data_road_speed_matrix() in predict_road_condition.py
+# "bfs": the original BFS, one interval at a time (the reference, same result as estimate_no_data_road_speed_using_BFS)
+# "sparse": fill from the neighbors for all the intervals at once, faster but the estimated speeds differ a little
+PREDICT_ROAD_CONDITION_IMPUTATION_MODE = "bfs"
 
 # generate_prediction_in_large_batches (GPILB)
 # See save_path in predict_speed_dict_to_json() in script/generate_prediction_in_large_batches.py for more detail
 # This variable also use in retrieve_traffic_data() in homepage.py
 GPILB_CACHE_PATH = "cache/predict_result/{0}/{1}/{2}.json"
+# The payload sent by retrieve_traffic_data() in homepage.py, the color of each way without the geometry, gzip
+# compressed, see predict_speed_dict_to_status_payload() in script/generate_prediction_in_large_batches.py
+GPILB_STATUS_CACHE_PATH = "cache/predict_result/{0}/{1}/{2}_status.json.gz"
+# The number of payloads homepage.py keeps in memory
+HOMEPAGE_PAYLOAD_MEMORY_CACHE_SIZE = 256
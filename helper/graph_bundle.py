@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import pickle
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# A graph bundle (SAVE_TYPE_NUMPY) is one file per table:
+#   GRAPH_BUNDLE_MAGIC, the length of the manifest (uint64, little-endian), the manifest (JSON),
+#   then the arrays of the manifest, each one starting at a multiple of GRAPH_BUNDLE_ALIGNMENT
+# so the arrays can be memory-mapped in place. The version is increased when the layout or the kinds change, and the
+# files of an unknown version are refused.
+GRAPH_BUNDLE_MAGIC = b"NFTAGRPH"
+GRAPH_BUNDLE_VERSION = 1
+GRAPH_BUNDLE_ALIGNMENT = 64
+GRAPH_BUNDLE_SUFFIX = ".npb"
+
+
+def get_file_checksum(file_path):
+    """
+    The SHA-256 (hex) of the file, e.g. of the OSM file the graph is built from.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_key_array(keys):
+    if all(type(key) is int for key in keys):
+        return np.array(keys, dtype=np.int64)
+    if all(type(key) is str for key in keys):
+        return np.array(keys, dtype=str)
+    return None
+
+
+def get_value_array(values):
+    """
+    The values as an int64, float64 or str array, None if they are not all of the same one of these types.
+    """
+    if all(type(value) is int for value in values):
+        return np.array(values, dtype=np.int64)
+    if all(type(value) is float for value in values):
+        return np.array(values, dtype=np.float64)
+    if all(type(value) is str for value in values):
+        return np.array(values, dtype=str)
+    return None
+
+
+def encode_graph_table(table):
+    """
+    Convert a table of the graph to arrays.
+
+    Parameters
+    ----------
+    table:
+        The value saved by graph_writer
+
+    Returns
+    -------
+    kind: string
+        "dict_value": {key: int, float or str}, arrays are keys and values
+        "dict_rows": {key: list of int or list of float}, all the lists have the same length (e.g. final_node_table),
+                     arrays are keys and values, the list of the i-th key is values[i]
+        "dict_list": {key: list of int or list of float}, arrays are keys, offsets and values. The list of the i-th key
+                     is values[offsets[i]:offsets[i + 1]]
+        "arrays": {name: np.ndarray} (e.g. the compact graph of helper/compact_graph.py), the arrays are saved as they
+                  are, and read back memory-mapped
+        "pickle": any other value (e.g., final_relation_table and relations), array is data, the bytes of the pickle
+
+    arrays: Dictionary
+        {name: np.ndarray}
+    """
+    if isinstance(table, dict) and len(table) > 0 and \
+            all(type(key) is str and isinstance(value, np.ndarray) and value.dtype != object
+                for key, value in table.items()):
+        return "arrays", table
+    if isinstance(table, dict) and len(table) > 0:
+        try:
+            keys = get_key_array(list(table))
+            if keys is not None:
+                values = list(table.values())
+                value_array = get_value_array(values)
+                if value_array is not None:
+                    return "dict_value", {"keys": keys, "values": value_array}
+                if all(type(value) is list for value in values):
+                    value_array = get_value_array([item for value in values for item in value])
+                    if value_array is not None:
+                        lengths = [len(value) for value in values]
+                        if min(lengths) == max(lengths) > 0:
+                            return "dict_rows", {"keys": keys, "values": value_array.reshape(len(values), lengths[0])}
+                        offsets = np.cumsum([0] + lengths, dtype=np.int64)
+                        return "dict_list", {"keys": keys, "offsets": offsets, "values": value_array}
+        except OverflowError:
+            # an integer that does not fit in int64
+            pass
+    return "pickle", {"data": np.frombuffer(pickle.dumps(table), dtype=np.uint8)}
+
+
+def decode_graph_table(kind, arrays):
+    """
+    The inverse of encode_graph_table, the table is the same as the one saved (same keys, values, types and order).
+    The arrays of the kind "arrays" are returned as they are, i.e. memory-mapped by read_graph_bundle.
+    """
+    if kind == "dict_value" or kind == "dict_rows":
+        return dict(zip(arrays["keys"].tolist(), arrays["values"].tolist()))
+    if kind == "dict_list":
+        offsets = arrays["offsets"].tolist()
+        values = arrays["values"].tolist()
+        return {key: values[offsets[i]:offsets[i + 1]] for i, key in enumerate(arrays["keys"].tolist())}
+    if kind == "arrays":
+        return dict(arrays)
+    if kind == "pickle":
+        return pickle.loads(arrays["data"].tobytes())
+    raise ValueError("unknown kind of graph table: {}".format(kind))
+
+
+def write_graph_bundle(file_path, table, source_file=None, source_checksum=None):
+    """
+    Save a table of the graph as a graph bundle. The file is written aside and replaced at once, so the readers never
+    see a file that is half written.
+
+    Parameters
+    ----------
+    file_path: Path
+        The path of the bundle, e.g. graph/final_node_table.npb
+
+    table:
+        The value to save, see encode_graph_table
+
+    source_file: Path
+        The OSM file the graph is built from, its name and its checksum are saved in the manifest
+
+    source_checksum: string
+        The checksum of source_file (see get_file_checksum), it is computed if not provided
+    """
+    file_path = Path(file_path)
+    kind, arrays = encode_graph_table(table)
+    manifest = {"version": GRAPH_BUNDLE_VERSION, "name": file_path.stem, "kind": kind, "arrays": {}}
+    if source_file is not None:
+        manifest["source_file"] = Path(source_file).name
+        manifest["source_sha256"] = source_checksum if source_checksum is not None else get_file_checksum(source_file)
+
+    # The offsets depend on the length of the manifest, which depends on the offsets, so they are placed after a
+    # header of a fixed size that is large enough for the manifest
+    header_size = GRAPH_BUNDLE_ALIGNMENT
+    while True:
+        offset = header_size
+        for name, array in arrays.items():
+            manifest["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // GRAPH_BUNDLE_ALIGNMENT) * GRAPH_BUNDLE_ALIGNMENT
+        manifest_bytes = json.dumps(manifest).encode("utf-8")
+        if len(GRAPH_BUNDLE_MAGIC) + 8 + len(manifest_bytes) <= header_size:
+            break
+        header_size = -(-(len(GRAPH_BUNDLE_MAGIC) + 8 + len(manifest_bytes)) // GRAPH_BUNDLE_ALIGNMENT) * \
+            GRAPH_BUNDLE_ALIGNMENT
+
+    temp_file = file_path.with_suffix(file_path.suffix + ".tmp")
+    with open(temp_file, 'wb') as f:
+        f.write(GRAPH_BUNDLE_MAGIC + struct.pack("<Q", len(manifest_bytes)) + manifest_bytes)
+        for name, array in arrays.items():
+            f.seek(manifest["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(offset)
+    os.replace(temp_file, file_path)
+
+
+def read_graph_manifest(file_path):
+    """
+    Read the manifest of a graph bundle.
+
+    Returns
+    -------
+    manifest: Dictionary
+        version, name, kind, arrays ({name: dtype, shape and offset}), source_file and source_sha256 (if the bundle was
+        written with a source_file)
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(len(GRAPH_BUNDLE_MAGIC))
+        if magic != GRAPH_BUNDLE_MAGIC:
+            raise ValueError("{} is not a graph bundle".format(file_path))
+        manifest_size = struct.unpack("<Q", f.read(8))[0]
+        manifest = json.loads(f.read(manifest_size).decode("utf-8"))
+    if manifest["version"] != GRAPH_BUNDLE_VERSION:
+        raise ValueError("{} is a graph bundle of version {}, only version {} can be read, run osm_interpreter.py again"
+                         .format(file_path, manifest["version"], GRAPH_BUNDLE_VERSION))
+    return manifest
+
+
+def read_graph_bundle(file_path):
+    """
+    Memory-map the arrays of a graph bundle, only the parts that are used are read from the file.
+
+    Returns
+    -------
+    manifest: Dictionary
+        See read_graph_manifest
+
+    arrays: Dictionary
+        {name: read-only array}, see encode_graph_table
+    """
+    manifest = read_graph_manifest(file_path)
+    buffer = np.memmap(file_path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, array_info in manifest["arrays"].items():
+        dtype = np.dtype(array_info["dtype"])
+        size = int(np.prod(array_info["shape"])) * dtype.itemsize
+        arrays[name] = buffer[array_info["offset"]:array_info["offset"] + size].view(dtype).reshape(array_info["shape"])
+    return manifest, arrays
@@ -0,0 +1,145 @@
+import os
+import threading
+from pathlib import Path
+
+from helper.global_var import SAVE_TYPE_JSON, SAVE_TYPE_NUMPY, SAVE_TYPE_PICKLE, FLAG_DEBUG
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX
+from helper.graph_reader import graph_reader
+
+# {(graph_path, save_type, save_filename): (file version, data)}, see cached_graph_reader
+graph_cache = {}
+# {(name, graph_path, save_type, save_filename_list): (file versions, value)}, see cached_graph_value
+graph_value_cache = {}
+# Only one thread loads the files at a time, the others wait for it instead of loading the same files again
+graph_cache_lock = threading.Lock()
+
+
+def get_graph_file(graph_path, save_type, save_filename):
+    if save_type == SAVE_TYPE_PICKLE:
+        return Path(graph_path) / "{}.p".format(save_filename)
+    elif save_type == SAVE_TYPE_JSON:
+        return Path(graph_path) / "{}.json".format(save_filename)
+    elif save_type == SAVE_TYPE_NUMPY:
+        return Path(graph_path) / "{}{}".format(save_filename, GRAPH_BUNDLE_SUFFIX)
+    raise ValueError("unknown save_type: {}".format(save_type))
+
+
+def get_graph_file_version(graph_path, save_type, save_filename):
+    """
+    The modification time and the size of the file, a file is loaded again when they change.
+    """
+    file_stat = os.stat(get_graph_file(graph_path, save_type, save_filename))
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+def cached_graph_reader_with_versions(graph_path, save_type, save_filename_list):
+    """
+    cached_graph_reader that also returns the version (see get_graph_file_version) of each file it returns. The data
+    and the versions are taken together from the cache, so they always match, even when another thread updates the
+    cache at the same time.
+
+    Returns
+    -------
+    result_list: List
+        The same as graph_reader
+
+    versions: Tuple
+        The version of the file of each item of result_list
+    """
+    keys = [(str(graph_path), save_type, save_filename) for save_filename in save_filename_list]
+    versions = [get_graph_file_version(graph_path, save_type, save_filename) for save_filename in save_filename_list]
+    entries = [graph_cache.get(key) for key in keys]
+    if all(entry is not None and entry[0] == version for entry, version in zip(entries, versions)):
+        return [entry[1] for entry in entries], tuple(entry[0] for entry in entries)
+
+    with graph_cache_lock:
+        loaded = {}
+        for key, save_filename in zip(keys, save_filename_list):
+            version = get_graph_file_version(graph_path, save_type, save_filename)
+            if key in graph_cache and graph_cache[key][0] == version:
+                continue
+            try:
+                loaded[key] = (version, graph_reader(Path(graph_path), save_type, [save_filename])[0])
+            except Exception as e:
+                if key not in graph_cache:
+                    raise
+                print("Keep the loaded {}, it cannot be loaded again: {}".format(save_filename, e))
+        graph_cache.update(loaded)
+        if FLAG_DEBUG and len(loaded) > 0:
+            print("{} graph file(s) loaded in the cache".format(len(loaded)))
+        entries = [graph_cache[key] for key in keys]
+        return [entry[1] for entry in entries], tuple(entry[0] for entry in entries)
+
+
+def cached_graph_reader(graph_path, save_type, save_filename_list):
+    """
+    graph_reader that keeps the data in memory, for the long running processes (e.g., homepage.py) that need the graph
+    for every request.
+
+    Each file is only loaded the first time and when it changes (e.g., osm_interpreter.py is run again). The files are
+    checked with a stat at every call, which is much cheaper than unpickling them. The changed files of a call are all
+    loaded before any of them is replaced in the cache, and the data already returned is never modified, so a request
+    never sees half of an update. If a file cannot be loaded (e.g., it is being written), the data loaded before is
+    kept and the file is tried again at the next call.
+
+    The returned data is shared by all the callers, it must not be modified.
+
+    Parameters
+    ----------
+    graph_path: Path
+        The path of the graph folder
+
+    save_type: int
+        The type of the file, use the following variable from helper.global_var
+        SAVE_TYPE_JSON, SAVE_TYPE_PICKLE or SAVE_TYPE_NUMPY
+
+    save_filename_list: List of string
+        List of filename (without suffix) that need to be read.
+
+    Returns
+    -------
+    result_list: List
+        The same as graph_reader
+    """
+    return cached_graph_reader_with_versions(graph_path, save_type, save_filename_list)[0]
+
+
+def cached_graph_value(name, builder, graph_path, save_type, save_filename_list):
+    """
+    Keep a value computed from graph files (e.g. predict_road_condition.get_way_graph_index) in memory, it is computed
+    again only when one of the files changes.
+
+    Parameters
+    ----------
+    name: string
+        The name of the value
+
+    builder: function
+        Compute the value, it is called with the data of the files in the order of save_filename_list
+
+    graph_path, save_type, save_filename_list:
+        See cached_graph_reader
+
+    Returns
+    -------
+    The return of builder, shared by all the callers
+    """
+    key = (name, str(graph_path), save_type, tuple(save_filename_list))
+    # the value is keyed on the versions of the data it is built from
+    graph_data, versions = cached_graph_reader_with_versions(graph_path, save_type, save_filename_list)
+    cached_value = graph_value_cache.get(key)
+    if cached_value is not None and cached_value[0] == versions:
+        return cached_value[1]
+
+    with graph_cache_lock:
+        cached_value = graph_value_cache.get(key)
+        if cached_value is None or cached_value[0] != versions:
+            cached_value = (versions, builder(*graph_data))
+            graph_value_cache[key] = cached_value
+        return cached_value[1]
+
+
+def clear_graph_cache():
+    with graph_cache_lock:
+        graph_cache.clear()
+        graph_value_cache.clear()
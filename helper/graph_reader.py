@@ -1,6 +1,7 @@
 import json
 import pickle
-from helper.global_var import SAVE_TYPE_JSON, SAVE_TYPE_PICKLE, FLAG_DEBUG
+from helper.global_var import SAVE_TYPE_JSON, SAVE_TYPE_NUMPY, SAVE_TYPE_PICKLE, FLAG_DEBUG
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX, decode_graph_table, read_graph_bundle
 
 
 def graph_reader(graph_path, save_type, save_filename_list):
@@ -15,7 +16,7 @@ def graph_reader(graph_path, save_type, save_filename_list):
 
     save_type: int
         The type of the file, use the following variable from helper.global_var
-        SAVE_TYPE_JSON or SAVE_TYPE_PICKLE
+        SAVE_TYPE_JSON, SAVE_TYPE_PICKLE or SAVE_TYPE_NUMPY (see helper/graph_bundle.py)
 
     save_filename_list: List of string
         List of filename (without suffix) that need to be read.
@@ -39,4 +40,10 @@ def graph_reader(graph_path, save_type, save_filename_list):
                 result_list.append(json.load(f))
                 if FLAG_DEBUG:
                     print("{} loaded".format(temp_filepath))
+        elif save_type == SAVE_TYPE_NUMPY:
+            temp_filepath = graph_path / "{}{}".format(save_filename, GRAPH_BUNDLE_SUFFIX)
+            manifest, arrays = read_graph_bundle(temp_filepath)
+            result_list.append(decode_graph_table(manifest["kind"], arrays))
+            if FLAG_DEBUG:
+                print("{} loaded".format(temp_filepath))
     return result_list
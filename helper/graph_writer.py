@@ -1,9 +1,10 @@
 import json
 import pickle
-from helper.global_var import SAVE_TYPE_JSON, SAVE_TYPE_PICKLE, FLAG_DEBUG
+from helper.global_var import SAVE_TYPE_JSON, SAVE_TYPE_NUMPY, SAVE_TYPE_PICKLE, FLAG_DEBUG
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX, get_file_checksum, write_graph_bundle
 
 
-def graph_writer(graph_path, save_type, save_filename_list, save_variable_list):
+def graph_writer(graph_path, save_type, save_filename_list, save_variable_list, source_file=None):
     """
     Read the file in graph folder by provide the file name (without suffix)
     The result will be return in a list with the order of save_filename_list
@@ -15,7 +16,7 @@ def graph_writer(graph_path, save_type, save_filename_list, save_variable_list):
 
     save_type: int
         The type of the file, use the following variable from helper.global_var
-        SAVE_TYPE_JSON or SAVE_TYPE_PICKLE
+        SAVE_TYPE_JSON, SAVE_TYPE_PICKLE or SAVE_TYPE_NUMPY (see helper/graph_bundle.py)
 
     save_filename_list: List of string
         List of filename (without suffix) that need to be save.
@@ -23,11 +24,17 @@ def graph_writer(graph_path, save_type, save_filename_list, save_variable_list):
     save_variable_list: List
         List of value/variable that need to be save.
 
+    source_file: Path
+        The OSM file the graph is built from, its checksum is saved with SAVE_TYPE_NUMPY
+
     Returns
     -------
     0
         No return
     """
+    source_checksum = None
+    if save_type == SAVE_TYPE_NUMPY and source_file is not None:
+        source_checksum = get_file_checksum(source_file)
     for save_filename, save_variable in zip(save_filename_list, save_variable_list):
         if save_type == SAVE_TYPE_PICKLE:
             temp_filepath = graph_path / "{}.p".format(save_filename)
@@ -41,4 +48,9 @@ def graph_writer(graph_path, save_type, save_filename_list, save_variable_list):
                 json.dump(save_variable, f, indent=2)
                 if FLAG_DEBUG:
                     print("{} saved".format(temp_filepath))
+        elif save_type == SAVE_TYPE_NUMPY:
+            temp_filepath = graph_path / "{}{}".format(save_filename, GRAPH_BUNDLE_SUFFIX)
+            write_graph_bundle(temp_filepath, save_variable, source_file, source_checksum)
+            if FLAG_DEBUG:
+                print("{} saved".format(temp_filepath))
     return 0
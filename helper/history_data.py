@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import numpy as np
 
 from helper.global_var import CONFIG_SINGLE_DAY_RESULT_FILE
+from helper.history_store import get_history_day_row, load_result_file, open_history_store
 
 
 def get_history_data(current_timestamp, ways_list, interval, hours, days, weeks):
@@ -81,21 +82,19 @@ def get_recent_weeks_data(current_timestamp: int, ways_list, weeks: int, interva
 
 def get_history_data_by_interval_range(current_time, start_interval_index, end_interval_index, ways_list, interval):
     date_str = get_date_str(current_time)
-    result_file_path = CONFIG_SINGLE_DAY_RESULT_FILE.format(date_str, interval)
-    day_data = np.genfromtxt(result_file_path, delimiter=",", skip_header=1)
-
-    way_id_to_matrix_row = get_way_id_to_matrix_row(day_data)
-
-    day_data = np.delete(day_data, 0, axis=1)
-    day_data = day_data[:, start_interval_index:end_interval_index]
-
-    temp_result = np.zeros((len(ways_list), end_interval_index - start_interval_index))
-
-    for row_index in range(0, len(ways_list)):
-        way_id = ways_list[row_index]
-        temp_result[row_index] = day_data[way_id_to_matrix_row[way_id]]
-
-    return temp_result
+    # The day is sliced out of the history store, or read from its result file if it is not in the store (e.g. today)
+    store = open_history_store(interval)
+    day_row = get_history_day_row(store, date_str, interval)
+    if day_row is not None:
+        day_data = store["speeds"][day_row]
+        way_rows = [store["way_rows"][way_id] for way_id in ways_list]
+        return np.array(day_data[way_rows, start_interval_index:end_interval_index])
+
+    speed_matrix = load_result_file(date_str, interval)
+    if speed_matrix is None:
+        raise FileNotFoundError("{} not found".format(CONFIG_SINGLE_DAY_RESULT_FILE.format(date_str, interval)))
+    return np.array([speed_matrix[way_id][start_interval_index:end_interval_index] for way_id in ways_list],
+                    dtype=np.float64).reshape(len(ways_list), end_interval_index - start_interval_index)
 
 
 def round_down_to_interval_index(current_time, interval):
@@ -0,0 +1,311 @@
+import csv
+import json
+import os
+import pickle
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from helper.global_var import CONFIG_HISTORY_STORE_FOLDER, CONFIG_HISTORY_STORE_DATA_FILE, \
+    CONFIG_HISTORY_STORE_INDEX_FILE, CONFIG_SINGLE_DAY_RESULT_FILE
+
+# The speeds are kept as float64, so the predictions are exactly the same as the ones made from the result files.
+# A way that is not in the result file of a day is NaN for that day.
+HISTORY_STORE_DTYPE = np.float64
+
+# {(store_folder, interval): (stat of the index file, store)}, see open_history_store
+history_store_cache = {}
+
+
+def get_history_store_index_file(interval, store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    return Path(store_folder) / CONFIG_HISTORY_STORE_INDEX_FILE.format(interval)
+
+
+def load_history_store_index(interval, store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    """
+    Load the index of the history store of the interval length.
+
+    Parameters
+    ----------
+    interval: int
+        The length of each time interval in minutes
+
+    store_folder: string
+        The folder of the history store
+
+    Returns
+    -------
+    index: Dictionary
+        dates: the date_str of each day of the array, in the order they were added. None for the days that were
+            replaced by a newer version of the day (see add_history_day)
+        result_file_versions: {date_str: the version of the result file the day was added from (see
+            get_result_file_version)}
+        way_ids: the way id of each row of the array
+        interval_count: the number of intervals of each day
+        data_file: the name of the array file in store_folder
+        None if the store does not exist yet
+    """
+    index_file = get_history_store_index_file(interval, store_folder)
+    if not index_file.is_file():
+        return None
+    with open(index_file, 'r') as f:
+        return json.load(f)
+
+
+def save_history_store_index(index, interval, store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    index_file = get_history_store_index_file(interval, store_folder)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    # The index is written aside and replaced at once, the readers only see the days that are completely written
+    temp_file = index_file.with_suffix(index_file.suffix + ".tmp")
+    with open(temp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_file, index_file)
+    history_store_cache.pop((str(store_folder), interval), None)
+
+
+def open_history_store(interval, store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    """
+    Open the history store of the interval length, the array file is memory-mapped so only the days used are read.
+
+    The store stays open and is shared by the later calls, it is opened again when the index changes (e.g., a day is
+    added by find_traffic_speed).
+
+    Parameters
+    ----------
+    interval: int
+        The length of each time interval in minutes
+
+    store_folder: string
+        The folder of the history store
+
+    Returns
+    -------
+    store: Dictionary
+        The index (see load_history_store_index) and
+        date_rows: {date_str: the position of the day in the array}
+        way_rows: {way_id: the row of the way in the array}
+        speeds: (days, ways, intervals) read-only array, speeds[date_rows[date_str], way_rows[way_id]] are the speeds of
+            the way in the result file of the day
+        None if the store does not exist yet
+    """
+    index_file = get_history_store_index_file(interval, store_folder)
+    try:
+        index_stat = index_file.stat()
+    except FileNotFoundError:
+        return None
+    cache_key = (str(store_folder), interval)
+    index_version = (index_stat.st_mtime_ns, index_stat.st_size)
+    if cache_key in history_store_cache and history_store_cache[cache_key][0] == index_version:
+        return history_store_cache[cache_key][1]
+
+    store = load_history_store_index(interval, store_folder)
+    shape = (len(store["dates"]), len(store["way_ids"]), store["interval_count"])
+    if shape[0] == 0:
+        store["speeds"] = np.zeros(shape, dtype=HISTORY_STORE_DTYPE)
+    else:
+        store["speeds"] = np.memmap(Path(store_folder) / store["data_file"], dtype=HISTORY_STORE_DTYPE, mode='r',
+                                    shape=shape)
+    store["date_rows"] = {date_str: row for row, date_str in enumerate(store["dates"]) if date_str is not None}
+    store["way_rows"] = {way_id: row for row, way_id in enumerate(store["way_ids"])}
+    history_store_cache[cache_key] = (index_version, store)
+    return store
+
+
+def extend_history_store_ways(index, new_way_ids, interval, store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    """
+    Add rows for new ways (e.g., after the map is updated) to all the days of the store, they are NaN for the days
+    already in the store. The array is copied to a new file, so the readers of the old file are not disturbed.
+    """
+    store_folder = Path(store_folder)
+    way_count = len(index["way_ids"])
+    new_index = dict(index, way_ids=index["way_ids"] + list(new_way_ids),
+                     data_file=CONFIG_HISTORY_STORE_DATA_FILE.format(interval, len(index["way_ids"]) +
+                                                                     len(new_way_ids)))
+    if len(index["dates"]) > 0:
+        old_speeds = np.memmap(store_folder / index["data_file"], dtype=HISTORY_STORE_DTYPE, mode='r',
+                               shape=(len(index["dates"]), way_count, index["interval_count"]))
+        day_speeds = np.full((len(new_index["way_ids"]), index["interval_count"]), np.nan, dtype=HISTORY_STORE_DTYPE)
+        with open(store_folder / new_index["data_file"], 'wb') as f:
+            for day in range(len(index["dates"])):
+                day_speeds[:way_count] = old_speeds[day]
+                f.write(day_speeds.tobytes())
+        del old_speeds
+    save_history_store_index(new_index, interval, store_folder)
+    if len(index["dates"]) > 0 and index["data_file"] != new_index["data_file"]:
+        try:
+            os.remove(store_folder / index["data_file"])
+        except OSError:
+            # e.g., still memory-mapped by a reader on Windows, it is only a stale file
+            pass
+    return new_index
+
+
+def add_history_day(date_str, speed_matrix, interval, store_folder=CONFIG_HISTORY_STORE_FOLDER,
+                    result_file_version=None):
+    """
+    Add the speeds of a day to the history store, or replace them if the day is already in the store.
+
+    The day is appended to the end of the array file and then added to the index, so the readers never see a day that
+    is half written. A day that is replaced is appended as well, and its old row is only dropped from the index, the
+    array is never written in place while the readers have it memory-mapped.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    speed_matrix: Dictionary
+        {way_id: list of the speed of each interval}, e.g. the return of find_traffic_speed.get_road_speeds
+
+    interval: int
+        The length of each time interval in minutes
+
+    store_folder: string
+        The folder of the history store
+
+    result_file_version: List
+        The version of the result file of the day (see get_result_file_version), the day is read from the result file
+        instead of the store when the file changes (see get_history_day_row)
+    """
+    if len(speed_matrix) == 0:
+        return
+    store_folder = Path(store_folder)
+    interval_count = len(next(iter(speed_matrix.values())))
+    index = load_history_store_index(interval, store_folder)
+    if index is None:
+        index = {"dates": [], "way_ids": [], "interval_count": interval_count,
+                 "data_file": CONFIG_HISTORY_STORE_DATA_FILE.format(interval, len(speed_matrix))}
+    if index["interval_count"] != interval_count:
+        raise ValueError("{} intervals in {}, but the history store of {} min has {}".format(
+            interval_count, date_str, interval, index["interval_count"]))
+
+    way_rows = {way_id: row for row, way_id in enumerate(index["way_ids"])}
+    new_way_ids = [way_id for way_id in speed_matrix if way_id not in way_rows]
+    if len(new_way_ids) > 0:
+        index = extend_history_store_ways(index, new_way_ids, interval, store_folder)
+        way_rows = {way_id: row for row, way_id in enumerate(index["way_ids"])}
+
+    day_speeds = np.full((len(index["way_ids"]), interval_count), np.nan, dtype=HISTORY_STORE_DTYPE)
+    day_speeds[[way_rows[way_id] for way_id in speed_matrix]] = np.array(list(speed_matrix.values()),
+                                                                         dtype=HISTORY_STORE_DTYPE)
+
+    data_file = store_folder / index["data_file"]
+    store_folder.mkdir(parents=True, exist_ok=True)
+    with open(data_file, 'ab') as f:
+        # drop what an interrupted append may have left after the last day of the index
+        f.truncate(len(index["dates"]) * day_speeds.nbytes)
+        f.write(day_speeds.tobytes())
+    index["dates"] = [None if stored_date_str == date_str else stored_date_str for stored_date_str in index["dates"]]
+    index["dates"].append(date_str)
+    index.setdefault("result_file_versions", {})[date_str] = result_file_version
+    save_history_store_index(index, interval, store_folder)
+
+
+def is_finished_day(date_str):
+    """
+    Only the days before today are added to the history store, the result files of today are still updated by the real
+    time data.
+    """
+    return date_str < datetime.today().strftime('%Y%m%d')
+
+
+def get_result_file_version(date_str, interval, result_file_path=CONFIG_SINGLE_DAY_RESULT_FILE):
+    """
+    The modification time and the size of the result file read by load_result_file, None if the day has no result
+    file.
+    """
+    result_file_csv = Path(result_file_path.format(date_str, interval))
+    for result_file in [result_file_csv.with_suffix('.p'), result_file_csv]:
+        try:
+            file_stat = result_file.stat()
+        except FileNotFoundError:
+            continue
+        return [file_stat.st_mtime_ns, file_stat.st_size]
+    return None
+
+
+def get_history_day_row(store, date_str, interval, result_file_path=CONFIG_SINGLE_DAY_RESULT_FILE):
+    """
+    The position of the day in the array of the store (see open_history_store), None if the day is not in the store,
+    or if its result file changed since it was added (e.g., find_traffic_speed.py was run again for the day), then the
+    result file should be read instead (see load_result_file).
+
+    The store is only read, the days are added by import_history_days and the daily batch.
+    """
+    if store is None or date_str not in store["date_rows"]:
+        return None
+    result_file_version = get_result_file_version(date_str, interval, result_file_path)
+    if result_file_version is not None and \
+            store.get("result_file_versions", {}).get(date_str) != result_file_version:
+        return None
+    return store["date_rows"][date_str]
+
+
+def load_result_file(date_str, interval, result_file_path=CONFIG_SINGLE_DAY_RESULT_FILE):
+    """
+    Load the speeds of a day from its result file (the pickle if it exists, the csv otherwise).
+
+    Returns
+    -------
+    speed_matrix: Dictionary
+        {way_id: list of the speed of each interval}, None if the day has no result file
+    """
+    result_file_csv = Path(result_file_path.format(date_str, interval))
+    result_file_p = result_file_csv.with_suffix('.p')
+    if result_file_p.is_file():
+        with open(result_file_p, 'rb') as f:
+            return pickle.load(f)
+    if result_file_csv.is_file():
+        speed_matrix = {}
+        with open(result_file_csv, newline='') as f:
+            next(f)  # Skip first line
+            for line in csv.reader(f):
+                speed_matrix[int(line[0])] = list(map(float, line[1:]))
+        return speed_matrix
+    return None
+
+
+def import_history_days(date_str_list, interval, result_file_path=CONFIG_SINGLE_DAY_RESULT_FILE,
+                        store_folder=CONFIG_HISTORY_STORE_FOLDER):
+    """
+    Add the days that are not in the history store yet from their result files, e.g., the days computed before the
+    store existed, and the days whose result file changed since they were added. The days that are not finished (see
+    is_finished_day) are skipped.
+
+    This writes the store, it is run by script/build_history_store.py and the batches, not by the requests of
+    homepage.py, which only read the store (see get_history_day_row).
+
+    Parameters
+    ----------
+    date_str_list: List of string
+        The days to add
+
+    interval: int
+        The length of each time interval in minutes
+
+    result_file_path: String
+        The path (also the format) to the result .csv files.
+        {0} is a 8-digit date_str in yyyyMMdd format.
+        {1} is the value of interval
+
+    store_folder: string
+        The folder of the history store
+
+    Returns
+    -------
+    int: the number of days added
+    """
+    day_count = 0
+    for date_str in date_str_list:
+        if not is_finished_day(date_str):
+            continue
+        store = open_history_store(interval, store_folder)
+        if store is not None and get_history_day_row(store, date_str, interval, result_file_path) is not None:
+            continue
+        result_file_version = get_result_file_version(date_str, interval, result_file_path)
+        speed_matrix = load_result_file(date_str, interval, result_file_path)
+        if speed_matrix is not None:
+            add_history_day(date_str, speed_matrix, interval, store_folder, result_file_version)
+            day_count += 1
+    return day_count
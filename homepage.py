@@ -3,21 +3,31 @@ To run:
 
 $ python homepage.py
 '''
-import json
+import gzip
+import hashlib
 import pickle
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from flask import Flask, render_template, jsonify, redirect
+from flask import Flask, render_template, jsonify, redirect, request, make_response
 
 import predict_road_condition
 import script.generate_prediction_in_large_batches as predict_result_helper
-from helper.global_var import SAVE_TYPE_PICKLE, GOOGLE_MAPS_API_KEY, GPILB_CACHE_PATH
-from helper.graph_reader import graph_reader
+from helper.compact_graph import get_compact_graph
+from helper.global_var import GOOGLE_MAPS_API_KEY, GPILB_STATUS_CACHE_PATH, HOMEPAGE_PAYLOAD_MEMORY_CACHE_SIZE
 
 app = Flask(__name__)
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = timedelta(hours=3)
 
+# {payload file: (stat of the file, payload)}, the most recently used last, see get_status_payload
+payload_memory_cache = OrderedDict()
+payload_memory_cache_lock = threading.Lock()
+# "compact_graph": the compact graph of the payload, "payload": see get_way_geometry_payload
+way_geometry_cache = {}
+way_geometry_cache_lock = threading.Lock()
+
 
 @app.route("/")
 def home_page():
@@ -33,6 +43,11 @@ def retrieve_traffic_data(timestamp, time_interval):
     """
     Get the traffic data for the given timestamp (at the nearest time interval/slot) and time_interval.
 
+    The response is the payload saved by the batch prediction (see predict_speed_dict_to_status_payload() in
+    script/generate_prediction_in_large_batches.py), or made and saved at the first request of the interval. It is sent
+    gzip compressed with an ETag and a Last-Modified, and the requests with If-None-Match or If-Modified-Since get a
+    304 (Not Modified) if it has not changed.
+
     Parameters
     ----------
     timestamp: str
@@ -45,16 +60,15 @@ def retrieve_traffic_data(timestamp, time_interval):
     -------
     Serialized Json object, containing traffic data, which has the following format,
     {
-        "generate_timestr": "2021-03-02 19:52:44",
-        "generate_timestamp": 1614732764, .
+        "date": "03/02/2021",
+        "time": "07:52:44 PM",
+        "timestamp": 1614732764,
         "time_slot_interval": 15,
         "interval_idx": 0,
         "predict_time_range": "2020-07-30 00:00 - 00:14",
-        "road_speed": {way_id: {"speed": 16.274295463111194,
-                                "speed_ratio": 0.46497987037460553},
-                        ...
-                      }
+        "road_status": {way_id: "#34eb95", ...}
     }
+    The points of each way are not included, see load_way_structure()
     """
     # retrieve traffic at the specific timestamp (during the nearest interval)
     # print(timestamp)
@@ -65,54 +79,130 @@ def retrieve_traffic_data(timestamp, time_interval):
     dt_diff_min = int((dt_target - dt_now).seconds / 60)
     dt_diff_day = int((dt_target.date() - dt_now.date()).days)
 
+    # find the nearest interval of the timestamp based on the time_interval size
+    interval_idx = get_nearest_interval(dt_target, time_interval)
+    date_str = dt_target.strftime("%Y%m%d")
+    payload_path = Path(GPILB_STATUS_CACHE_PATH.format(date_str, time_interval, interval_idx))
+
     if dt_diff_day >= 0:
         if dt_diff_min <= 120:
             # Less than 2 hours
             return jsonify({"error": "no_data"})
-        else:
-            # find the nearest interval of the timestamp based on the time_interval size
-            interval_idx = get_nearest_interval(dt_target, time_interval)
-
-            data_path = Path(GPILB_CACHE_PATH.format(dt_target.strftime('%Y%m%d'), time_interval,
-                                                     interval_idx))
-            if data_path.is_file():
-                with open(data_path, 'r') as fp:
-                    data = json.load(fp)
-            else:
-                predict_speed_dict = predict_road_condition.predict_road_condition(dt_target.timestamp(),
-                                                                                   interval=int(time_interval))
-                data = predict_result_helper.get_output_dict_with_less_parameter(predict_speed_dict, dt_target,
-                                                                                 time_interval)
-
-            return jsonify(data)  # serialize and use JSON headers
+        payload = get_status_payload(payload_path, [],
+                                     lambda: get_predicted_status_dict(dt_target, time_interval))
     else:
         # Past time, can use existing data
-        interval_idx = get_nearest_interval(dt_target, time_interval)
-        date_str = dt_target.strftime("%Y%m%d")
         temp_filepath_csv = Path("data/{0}/result/{0}_{1}_min_road.csv".format(date_str, time_interval))
         temp_filepath_p = temp_filepath_csv.with_suffix('.p')
-        speed_matrix = {}
-        if temp_filepath_p.is_file():
-            with open(temp_filepath_p, 'rb') as f:
-                speed_matrix = pickle.load(f)
-        elif temp_filepath_csv.is_file():
-            speed_matrix = predict_road_condition.read_speed_matrix_from_file(temp_filepath_csv)
-        else:
+        if not temp_filepath_p.is_file() and not temp_filepath_csv.is_file():
             return jsonify({"error": "no_data"})
-        predict_speed_dict = {}
-        for way_id, his_speeds in speed_matrix.items():
-            predict_speed_dict[way_id] = his_speeds[interval_idx]
-
-        save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit"]
-        temp_map_dates = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
-        way_graph = temp_map_dates[0]
-        way_types = temp_map_dates[1]
-        way_type_avg_speed_limit = temp_map_dates[2]
-        predict_speed_dict = predict_road_condition.estimate_no_data_road_speed_using_BFS(predict_speed_dict, way_graph,
-                                                                                          way_types,
-                                                                                          way_type_avg_speed_limit)
-        data = predict_result_helper.get_output_dict_with_less_parameter(predict_speed_dict, dt_target, time_interval)
-        return jsonify(data)
+        payload = get_status_payload(payload_path, [temp_filepath_p, temp_filepath_csv],
+                                     lambda: get_past_status_dict(temp_filepath_p, temp_filepath_csv, dt_target,
+                                                                  time_interval, interval_idx))
+
+    if payload is None:
+        return jsonify({"error": "no_data"})
+    return make_payload_response(payload)
+
+
+def get_predicted_status_dict(dt_target, time_interval):
+    predict_speed_dict = predict_road_condition.predict_road_condition(dt_target.timestamp(),
+                                                                       interval=int(time_interval))
+    if not isinstance(predict_speed_dict, dict) or "Error" in predict_speed_dict:
+        return None
+    return predict_result_helper.get_status_dict_with_less_parameter(predict_speed_dict, dt_target, time_interval)
+
+
+def get_past_status_dict(temp_filepath_p, temp_filepath_csv, dt_target, time_interval, interval_idx):
+    if temp_filepath_p.is_file():
+        with open(temp_filepath_p, 'rb') as f:
+            speed_matrix = pickle.load(f)
+    else:
+        speed_matrix = predict_road_condition.read_speed_matrix_from_file(temp_filepath_csv)
+    predict_speed_dict = {}
+    for way_id, his_speeds in speed_matrix.items():
+        predict_speed_dict[way_id] = his_speeds[interval_idx]
+
+    way_graph_index = predict_road_condition.load_way_graph_index(Path("graph/"))
+    predict_speed_dict = predict_road_condition.estimate_no_data_road_speed(predict_speed_dict, way_graph_index)
+    return predict_result_helper.get_status_dict_with_less_parameter(predict_speed_dict, dt_target, time_interval)
+
+
+def get_status_payload(payload_path, source_files, get_status_dict):
+    """
+    Get the payload of retrieve_traffic_data() from payload_path, it is made with get_status_dict and saved if the file
+    does not exist or is older than one of the source_files. The payloads recently sent are kept in memory, the file
+    is only checked with a stat for them.
+
+    Parameters
+    ----------
+    payload_path: Path
+        The file of the payload, see GPILB_STATUS_CACHE_PATH
+
+    source_files: List of Path
+        The files the payload is made from
+
+    get_status_dict: function
+        Make the status dict (see get_status_dict_from_compact_graph() in
+        script/generate_prediction_in_large_batches.py), it returns None if there is no data
+
+    Returns
+    -------
+    payload: Dictionary
+        body: the gzip compressed JSON
+        etag: the hash of body
+        last_modified: the time the payload was saved
+        None if get_status_dict returns None
+    """
+    source_mtimes = [source_file.stat().st_mtime for source_file in source_files if source_file.is_file()]
+    try:
+        payload_stat = payload_path.stat()
+    except FileNotFoundError:
+        payload_stat = None
+    if payload_stat is None or (len(source_mtimes) > 0 and payload_stat.st_mtime < max(source_mtimes)):
+        status_dict = get_status_dict()
+        if status_dict is None:
+            return None
+        predict_result_helper.save_status_payload(predict_result_helper.encode_status_payload(status_dict),
+                                                  payload_path)
+        payload_stat = payload_path.stat()
+
+    cache_key = str(payload_path)
+    payload_version = (payload_stat.st_mtime_ns, payload_stat.st_size)
+    with payload_memory_cache_lock:
+        if cache_key in payload_memory_cache and payload_memory_cache[cache_key][0] == payload_version:
+            payload_memory_cache.move_to_end(cache_key)
+            return payload_memory_cache[cache_key][1]
+
+    body = payload_path.read_bytes()
+    payload = {"body": body, "etag": hashlib.sha1(body).hexdigest(),
+               "last_modified": datetime.fromtimestamp(payload_stat.st_mtime, timezone.utc)}
+    with payload_memory_cache_lock:
+        payload_memory_cache[cache_key] = (payload_version, payload)
+        while len(payload_memory_cache) > HOMEPAGE_PAYLOAD_MEMORY_CACHE_SIZE:
+            payload_memory_cache.popitem(last=False)
+    return payload
+
+
+def make_payload_response(payload, mimetype="application/json"):
+    """
+    The response of a payload of get_status_payload, gzip compressed (unless the client does not accept it), with its
+    ETag and Last-Modified. A 304 (Not Modified) without body is returned if the request has the same ETag in
+    If-None-Match, or a If-Modified-Since not older than the payload.
+    """
+    if request.accept_encodings["gzip"]:
+        response = make_response(payload["body"])
+        response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(payload["etag"])
+    else:
+        response = make_response(gzip.decompress(payload["body"]))
+        response.set_etag(payload["etag"] + "-identity")
+    response.mimetype = mimetype
+    response.vary.add("Accept-Encoding")
+    response.last_modified = payload["last_modified"]
+    # the client can keep the payload, but has to check if it has changed before using it
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @app.route("/load_way_structure")
@@ -120,15 +210,30 @@ def load_way_structure():
     """
     Answer the call from frontend to load and send back the way structure, i.e., {way_id: [points]}.
 
+    The points are sent in the binary form of encode_way_geometry() in script/generate_prediction_in_large_batches.py
+    (decoded by decode_way_structure() in templates/index_js.js), gzip compressed once and kept in memory until the
+    graph changes. The same ETag and conditional requests as retrieve_traffic_data() are supported.
+
     Returns
     -------
-    json
-        A json object (python dictionary)
+    bytes
+        The encoded way structure
+    """
+    return make_payload_response(get_way_geometry_payload(), "application/octet-stream")
+
+
+def get_way_geometry_payload():
+    """
+    The payload (see get_status_payload) of load_way_structure(), made again when the compact graph changes.
     """
-    way_structure_path = Path('.') / 'static' / 'mapdata' / 'way_structure.json'
-    with open(way_structure_path, 'r') as fp:
-        way_structure = json.load(fp)
-    return jsonify(way_structure)
+    compact_graph = get_compact_graph(Path("graph/"))
+    with way_geometry_cache_lock:
+        if way_geometry_cache.get("compact_graph") is not compact_graph:
+            body = gzip.compress(predict_result_helper.encode_way_geometry(compact_graph), mtime=0)
+            way_geometry_cache["payload"] = {"body": body, "etag": hashlib.sha1(body).hexdigest(),
+                                             "last_modified": datetime.now(timezone.utc).replace(microsecond=0)}
+            way_geometry_cache["compact_graph"] = compact_graph
+        return way_geometry_cache["payload"]
 
 
 def get_nearest_interval(dt: datetime, interval_size: int) -> int:
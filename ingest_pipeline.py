@@ -0,0 +1,394 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import signal
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from find_nearest_road import build_way_index, get_bus_route_to_relation_index, load_way_index
+from find_traffic_speed import add_speed_samples, drop_idle_buses, get_bus_speed_samples, get_time_slot_intervals, \
+    get_way_row_index, list_new_data_sources, load_real_time_state, save_real_time_road_speeds, save_real_time_state, \
+    speed_samples_to_arrays, stitch_real_time_traces
+from helper.global_var import SAVE_TYPE_PICKLE, CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE, \
+    REAL_TIME_CHECKPOINT_INTERVAL, REAL_TIME_MAX_IDLE_TIME, REAL_TIME_MIN_FILE_AGE, REAL_TIME_POLL_INTERVAL, \
+    INGEST_PIPELINE_QUEUE_SIZE, INGEST_PIPELINE_REPORT_INTERVAL, INGEST_PIPELINE_WORKERS
+from helper.graph_reader import graph_reader
+from process_data import RAW_DATA_COLUMNS, filter_raw_data, get_data_source_name, read_raw_data_csv
+
+# The names of the queues between the stages, in the order of the stages:
+# discover -> "files" -> parse -> "parsed" -> filter -> "filtered" -> map match -> "matched" -> aggregate
+PIPELINE_QUEUES = ["files", "parsed", "filtered", "matched"]
+
+# The graph tables used by the map matching processes. It is filled before the processes are started, so they inherit
+# it when they are forked instead of receiving it with each task.
+pipeline_worker_context = {}
+
+
+def get_traces_speed_samples(traces):
+    """
+    Map match the stitched traces of a batch of raw data files and get their speed samples, in a map matching process.
+
+    Parameters
+    ----------
+    traces: List of (bus_id, trace)
+        The return of find_traffic_speed.stitch_real_time_traces
+
+    Returns
+    -------
+    interval_speed_samples: Dictionary
+        {time_slot_interval: (ways, intervals, speeds)}, see find_traffic_speed.speed_samples_to_arrays
+    """
+    context = pipeline_worker_context
+    interval_speed_samples = {time_slot_interval: [] for time_slot_interval in context["time_slot_intervals"]}
+    for bus_id, trace in traces:
+        bus_speed_samples = get_bus_speed_samples(bus_id, trace, context["final_node_table"],
+                                                  context["final_way_table"], context["final_relation_table"],
+                                                  context["time_slot_intervals"],
+                                                  context["bus_route_to_relation_index"], context["way_index"])
+        for time_slot_interval, speed_samples in bus_speed_samples.items():
+            interval_speed_samples[time_slot_interval] += speed_samples
+    return {time_slot_interval: speed_samples_to_arrays(speed_samples)
+            for time_slot_interval, speed_samples in interval_speed_samples.items()}
+
+
+async def discover_files(date_str, state, queues, follow_day, poll_interval, min_file_size, min_file_age, max_polls):
+    """
+    Stage 1: look for the new raw data files and put them in queues["files"]. None is put at the end.
+
+    It stops when the day is over (if follow_day), or after max_polls polls. When the day is over, the files of the
+    day are not written anymore, so a last poll lists all of them, without waiting for min_file_age. A file is only
+    listed once: the ones already in the pipeline are remembered until the aggregate stage marks them as consumed.
+    """
+    listed_sources = set()
+    poll_count = 0
+    while max_polls is None or poll_count < max_polls:
+        poll_count += 1
+        day_over = follow_day and datetime.today().strftime('%Y%m%d') != date_str
+        data_sources = list_new_data_sources(date_str, state, min_file_size, 0 if day_over else min_file_age,
+                                             verbose=False)
+        for data_source in data_sources:
+            if data_source not in listed_sources:
+                listed_sources.add(data_source)
+                # waits here when the queue is full, so a burst of files never piles up in memory
+                await queues["files"].put(data_source)
+        listed_sources &= set(data_sources)
+        if day_over:
+            break
+        if max_polls is None or poll_count < max_polls:
+            await asyncio.sleep(poll_interval)
+    await queues["files"].put(None)
+
+
+async def parse_files(state, queues, statistics):
+    """
+    Stage 2: read the raw data files from queues["files"] into DataFrames, in a thread so the other stages keep going.
+
+    A file that cannot be parsed (e.g. a ragged or truncated line) is dropped with a message and marked as consumed at
+    once, so discover_files does not list it again. It adds nothing to the state, so the checkpoints stay consistent.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        data_source = await queues["files"].get()
+        if data_source is None:
+            break
+        try:
+            data = await loop.run_in_executor(None, read_raw_data_csv, data_source, list(RAW_DATA_COLUMNS))
+        except (ValueError, OSError) as e:
+            print("Skip {}, it cannot be parsed: {}".format(get_data_source_name(data_source), e))
+            state["consumed_sources"].add(get_data_source_name(data_source))
+            statistics["skipped_files"] += 1
+            continue
+        await queues["parsed"].put((data_source, data))
+    await queues["parsed"].put(None)
+
+
+async def filter_data(queues):
+    """
+    Stage 3: filter the raw data, see process_data.filter_raw_data.
+    """
+    while True:
+        item = await queues["parsed"].get()
+        if item is None:
+            break
+        data_source, data = item
+        await queues["filtered"].put((data_source, filter_raw_data(data)))
+    await queues["filtered"].put(None)
+
+
+async def match_traces(queues, executor, workers, last_points, max_idle_time):
+    """
+    Stage 4: stitch the data to the last point of each bus (see find_traffic_speed.stitch_real_time_traces) and map
+    match it in the executor. The futures are put in queues["matched"] in the order of the files.
+
+    A batch is only sent when a worker is free. Meanwhile the new files wait in queues["filtered"], and all of them
+    are taken as the next batch, so during a burst each bus is map matched once for many files instead of once per
+    file.
+
+    last_points is the copy of the last points used by this stage. It runs ahead of the aggregate stage, which keeps
+    the last points of the state in step with the files it has added, so a checkpoint is always consistent.
+    """
+    loop = asyncio.get_running_loop()
+    free_workers = asyncio.Semaphore(workers)
+    finished = False
+    while not finished:
+        items = [await queues["filtered"].get()]
+        await free_workers.acquire()
+        while not queues["filtered"].empty():
+            items.append(queues["filtered"].get_nowait())
+        if items[-1] is None:
+            finished = True
+            items.pop()
+        if len(items) == 0:
+            free_workers.release()
+            break
+
+        data_sources = [data_source for data_source, data in items]
+        traces = stitch_real_time_traces(last_points, pd.concat([data for data_source, data in items],
+                                                                ignore_index=True))
+        drop_idle_buses(last_points, max_idle_time)
+        batch_last_points = {bus_id: last_points[bus_id] for bus_id, trace in traces if bus_id in last_points}
+        speed_samples_future = loop.run_in_executor(executor, get_traces_speed_samples, traces)
+        speed_samples_future.add_done_callback(lambda future: free_workers.release())
+        await queues["matched"].put((data_sources, len(traces), batch_last_points, speed_samples_future))
+    await queues["matched"].put(None)
+
+
+async def aggregate_speeds(date_str, state, state_file, queues, way_rows, max_idle_time, checkpoint_interval,
+                           statistics):
+    """
+    Stage 5: add the speed samples to the state, in the order of the files. The results are saved whenever the
+    pipeline has caught up with the new files (and at least every checkpoint_interval seconds during a long burst),
+    the state every checkpoint_interval seconds, and both at the end.
+    """
+    loop = asyncio.get_running_loop()
+    way_row_index = get_way_row_index(way_rows)
+    last_checkpoint_time = time.time()
+    last_save_time = time.time()
+    results_changed = False
+    state_changed = False
+    try:
+        while True:
+            item = await queues["matched"].get()
+            if item is None:
+                break
+            data_sources, bus_count, batch_last_points, speed_samples_future = item
+            interval_speed_samples = await speed_samples_future
+            for interval, speed_samples in interval_speed_samples.items():
+                add_speed_samples(state["speed_sums"][interval], state["speed_counts"][interval], way_row_index,
+                                  *speed_samples)
+            state["last_points"].update(batch_last_points)
+            drop_idle_buses(state["last_points"], max_idle_time)
+            state["consumed_sources"].update(get_data_source_name(data_source) for data_source in data_sources)
+            statistics["files"] += len(data_sources)
+            statistics["buses"] += bus_count
+            results_changed = True
+            state_changed = True
+
+            if all(queue.empty() for queue in queues.values()) or \
+                    time.time() - last_save_time >= checkpoint_interval:
+                await loop.run_in_executor(None, save_real_time_road_speeds, date_str, state, way_rows)
+                results_changed = False
+                last_save_time = time.time()
+            if time.time() - last_checkpoint_time >= checkpoint_interval:
+                await loop.run_in_executor(None, save_real_time_state, state, state_file)
+                state_changed = False
+                last_checkpoint_time = time.time()
+    finally:
+        # also when the pipeline is stopped, the state is consistent between two batches
+        if results_changed:
+            save_real_time_road_speeds(date_str, state, way_rows)
+        if state_changed:
+            save_real_time_state(state, state_file)
+
+
+async def report_queue_depths(queues, report_interval, statistics):
+    """
+    Print the number of items waiting in each queue every report_interval seconds, and keep the largest ones in
+    statistics["max_queue_depths"].
+    """
+    while True:
+        depths = {name: queues[name].qsize() for name in PIPELINE_QUEUES}
+        for name, depth in depths.items():
+            statistics["max_queue_depths"][name] = max(statistics["max_queue_depths"][name], depth)
+        if report_interval is not None:
+            print("{}: queue depth {}, {} files done".format(
+                datetime.now().strftime('%H:%M:%S'),
+                ", ".join("{} {}/{}".format(name, depth, queues[name].maxsize) for name, depth in depths.items()),
+                statistics["files"]))
+        await asyncio.sleep(report_interval if report_interval is not None else 0.1)
+
+
+async def run_day_pipeline(date_str, follow_day, executor, workers, way_rows, time_slot_intervals, queue_size,
+                           poll_interval, min_file_size, min_file_age, checkpoint_interval, max_idle_time,
+                           report_interval, max_polls):
+    """
+    Run the pipeline for the raw data files of one day, see run_ingest_pipeline.
+    """
+    state_file = Path(CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE.format(date_str))
+    state = load_real_time_state(state_file, list(way_rows), time_slot_intervals)
+    print("Watching {}, {} files used before".format(date_str, len(state["consumed_sources"])))
+
+    queues = {name: asyncio.Queue(maxsize=queue_size) for name in PIPELINE_QUEUES}
+    statistics = {"files": 0, "skipped_files": 0, "buses": 0,
+                  "max_queue_depths": {name: 0 for name in PIPELINE_QUEUES}}
+    reporter = asyncio.create_task(report_queue_depths(queues, report_interval, statistics))
+    try:
+        await asyncio.gather(
+            discover_files(date_str, state, queues, follow_day, poll_interval, min_file_size, min_file_age,
+                           max_polls),
+            parse_files(state, queues, statistics),
+            filter_data(queues),
+            match_traces(queues, executor, workers, dict(state["last_points"]), max_idle_time),
+            aggregate_speeds(date_str, state, state_file, queues, way_rows, max_idle_time, checkpoint_interval,
+                             statistics))
+    finally:
+        reporter.cancel()
+    return statistics
+
+
+def run_ingest_pipeline(final_node_table, final_way_table, final_relation_table, time_slot_interval=5,
+                        way_index=None, date_str=None, workers=INGEST_PIPELINE_WORKERS,
+                        queue_size=INGEST_PIPELINE_QUEUE_SIZE, poll_interval=REAL_TIME_POLL_INTERVAL,
+                        min_file_size=10, min_file_age=REAL_TIME_MIN_FILE_AGE,
+                        checkpoint_interval=REAL_TIME_CHECKPOINT_INTERVAL, max_idle_time=REAL_TIME_MAX_IDLE_TIME,
+                        report_interval=INGEST_PIPELINE_REPORT_INTERVAL, max_polls=None):
+    """
+    The asyncio version of ingest_real_time_data.watch_real_time_data: the raw data files go through the stages
+    discover -> parse -> filter -> map match -> aggregate, connected by queues of at most queue_size items.
+
+    Each stage works on the next file while the later stages are busy with the previous ones, and map matching (the
+    slow part) runs in a pool of worker processes. When a burst of files arrives, the queues fill up and each stage
+    waits for room in the next queue, so the memory stays bounded and the files are taken at the pace of the slowest
+    stage. The files are aggregated in order, only the batches may differ from watch_real_time_data, so the averages
+    may differ from it in the last digits.
+
+    The state is kept in CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE, the same as find_traffic_speed.update_traffic_speed.
+
+    Parameters
+    ----------
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    time_slot_interval: Int or List of Int
+        See find_traffic_speed.find_traffic_speed
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index, it is built here if not
+        provided.
+
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731). By default it is the current day, and the
+        pipeline moves to the next day at midnight.
+
+    workers: int
+        The number of map matching processes. Threads are used where processes cannot be forked (e.g. on Windows).
+
+    queue_size: int
+        The maximum number of items in each queue
+
+    poll_interval: int
+        The time (in seconds) between two looks at data/yyyyMMdd/raw
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    min_file_age: int
+        Files modified in the last min_file_age seconds are left for the next poll, as they may still be written.
+
+    checkpoint_interval: int
+        The time (in seconds) between two saves of the state
+
+    max_idle_time: int
+        See find_traffic_speed.drop_idle_buses
+
+    report_interval: int
+        The time (in seconds) between two prints of the queue depths, None to not print them
+
+    max_polls: int
+        Stop after this number of polls (of each day), None to run until interrupted (Ctrl+C)
+
+    Returns
+    -------
+    statistics: Dictionary
+        The statistics of the last day, None if it is stopped with Ctrl+C
+        "files": the number of files added
+        "skipped_files": the number of files that cannot be parsed, see parse_files
+        "buses": the number of bus traces added (a bus is counted once per batch of files)
+        "max_queue_depths": {queue name: the largest number of items seen in the queue}
+    """
+    time_slot_intervals = get_time_slot_intervals(time_slot_interval)
+    way_rows = {way: row for row, way in enumerate(final_way_table)}
+    bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    if way_index is None:
+        way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+
+    pipeline_worker_context.update({"final_node_table": final_node_table, "final_way_table": final_way_table,
+                                    "final_relation_table": final_relation_table,
+                                    "time_slot_intervals": time_slot_intervals,
+                                    "bus_route_to_relation_index": bus_route_to_relation_index,
+                                    "way_index": way_index})
+    if "fork" in multiprocessing.get_all_start_methods():
+        # Ctrl+C stops the pipeline in the main process, which then shuts the workers down
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                                          initializer=signal.signal,
+                                                          initargs=(signal.SIGINT, signal.SIG_IGN))
+        # start the processes now, before the event loop and its threads exist
+        list(executor.map(int, range(workers)))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    statistics = None
+    try:
+        while True:
+            day_date_str = date_str if date_str is not None else datetime.today().strftime('%Y%m%d')
+            statistics = asyncio.run(run_day_pipeline(day_date_str, date_str is None, executor, workers, way_rows,
+                                                      time_slot_intervals, queue_size, poll_interval, min_file_size,
+                                                      min_file_age, checkpoint_interval, max_idle_time,
+                                                      report_interval, max_polls))
+            if date_str is not None or max_polls is not None:
+                break
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        executor.shutdown()
+        pipeline_worker_context.clear()
+    return statistics
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] in ["-h", "--help"]:
+        print("Usage:")
+        print("ingest_pipeline.py <date_str> <workers>")
+        print("")
+        print("Keep updating the speed results of the day in data/<date_str>/result as the raw data files arrive,")
+        print("with the map matching in several processes. Stop with Ctrl+C.")
+        print("")
+        print("Optional:")
+        print("date_str       : 8 digit number of the date_str, by default is the current day")
+        print("workers        : the number of map matching processes, by default is {}".format(
+            INGEST_PIPELINE_WORKERS))
+        exit(0)
+
+    date_str = None
+    if len(sys.argv) >= 2 and sys.argv[1] != "today":
+        date_str = sys.argv[1]
+    workers = INGEST_PIPELINE_WORKERS
+    if len(sys.argv) >= 3:
+        workers = int(sys.argv[2])
+
+    save_filename_list = ["final_node_table", "final_way_table", "final_relation_table"]
+    final_node_table, final_way_table, final_relation_table = graph_reader(Path("graph"), SAVE_TYPE_PICKLE,
+                                                                           save_filename_list)
+    way_index = load_way_index(Path("graph"), final_node_table, final_way_table, final_relation_table)
+    run_ingest_pipeline(final_node_table, final_way_table, final_relation_table, time_slot_interval=[5, 15],
+                        way_index=way_index, date_str=date_str, workers=workers)
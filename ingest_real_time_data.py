@@ -0,0 +1,261 @@
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from find_nearest_road import build_way_index, get_bus_route_to_relation_index, load_way_index
+from find_traffic_speed import add_real_time_data, drop_idle_buses, get_time_slot_intervals, list_new_data_sources, \
+    load_real_time_state, save_real_time_road_speeds, save_real_time_state
+from helper.global_var import SAVE_TYPE_PICKLE, CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE, PROCESS_DATA_BATCH_SIZE, \
+    REAL_TIME_CHECKPOINT_INTERVAL, REAL_TIME_MAX_IDLE_TIME, REAL_TIME_MIN_FILE_AGE, REAL_TIME_POLL_INTERVAL
+from helper.graph_reader import graph_reader
+from process_data import RAW_DATA_COLUMNS, SOURCE_FILE_COLUMN, get_data_source_name, load_data_files
+
+
+def load_readable_data_files(data_sources, columns):
+    """
+    process_data.load_data_files, but a file that cannot be parsed (e.g. a ragged or truncated line) is skipped with a
+    message instead of stopping the service. The batch is parsed at once, and only when it fails each file alone.
+
+    Parameters
+    ----------
+    data_sources: list
+        The raw data files, see process_data.load_data_files
+
+    columns: List[str]
+        A list of strings denote the headers of each column.
+
+    Returns
+    -------
+    data: DataFrame
+        The data of the files that can be parsed, None if there is none
+
+    bad_sources: list
+        The files that cannot be parsed
+    """
+    try:
+        return load_data_files(data_sources, list(columns)), []
+    except (ValueError, OSError):
+        pass
+
+    all_data = []
+    bad_sources = []
+    for data_source in data_sources:
+        try:
+            all_data.append(load_data_files([data_source], list(columns)))
+        except (ValueError, OSError) as e:
+            print("Skip {}, it cannot be parsed: {}".format(get_data_source_name(data_source), e))
+            bad_sources.append(data_source)
+    if len(all_data) == 0:
+        return None, bad_sources
+    data = pd.concat(all_data, ignore_index=True)
+    data[SOURCE_FILE_COLUMN] = data[SOURCE_FILE_COLUMN].astype(pd.CategoricalDtype(
+        [get_data_source_name(data_source) for data_source in data_sources if data_source not in bad_sources]))
+    return data, bad_sources
+
+
+def ingest_data_sources(date_str, state, data_sources, final_node_table, final_way_table, final_relation_table,
+                        way_rows, bus_route_to_relation_index, way_index, max_idle_time=REAL_TIME_MAX_IDLE_TIME,
+                        batch_size=PROCESS_DATA_BATCH_SIZE):
+    """
+    Add the new raw data files to the real time state and save the updated results.
+
+    The files are read batch_size at a time, so a long backlog (e.g., after the service was stopped for hours) does not
+    have to fit in memory at once.
+
+    The files that cannot be parsed are skipped (see load_readable_data_files) but still marked as consumed, so they are
+    not read again at each poll or restart.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731)
+
+    state: Dictionary
+        The real time state, see find_traffic_speed.load_real_time_state, updated in place
+
+    data_sources: list
+        The new raw data files, see find_traffic_speed.list_new_data_sources
+
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    way_rows: Dictionary
+        {way id: row in the speed arrays of the state}
+
+    bus_route_to_relation_index: Dictionary
+        The return of find_nearest_road.get_bus_route_to_relation_index
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index
+
+    max_idle_time: int
+        See find_traffic_speed.drop_idle_buses
+
+    batch_size: int
+        The number of files read at a time
+
+    Returns
+    -------
+    int: the number of buses updated
+    """
+    bus_count = 0
+    for batch_start in range(0, len(data_sources), batch_size):
+        batch = data_sources[batch_start:batch_start + batch_size]
+        data, bad_sources = load_readable_data_files(batch, RAW_DATA_COLUMNS)
+        if data is not None:
+            bus_count += add_real_time_data(state, data, final_node_table, final_way_table, final_relation_table,
+                                            way_rows, bus_route_to_relation_index, way_index)
+        drop_idle_buses(state["last_points"], max_idle_time)
+        state["consumed_sources"].update(get_data_source_name(data_source) for data_source in batch)
+    save_real_time_road_speeds(date_str, state, way_rows)
+    return bus_count
+
+
+def watch_real_time_data(final_node_table, final_way_table, final_relation_table, time_slot_interval=5,
+                         way_index=None, date_str=None, poll_interval=REAL_TIME_POLL_INTERVAL, min_file_size=10,
+                         min_file_age=REAL_TIME_MIN_FILE_AGE, checkpoint_interval=REAL_TIME_CHECKPOINT_INTERVAL,
+                         max_idle_time=REAL_TIME_MAX_IDLE_TIME, max_polls=None):
+    """
+    Keep watching data/yyyyMMdd/raw and update the speed results of the day as soon as new raw data files arrive.
+
+    This is the long-running version of find_traffic_speed.update_traffic_speed. The state (the sums and counts of the
+    speeds and the last point of each bus) stays in memory between the polls, so a new file only costs its own parsing
+    and map matching, and the results are updated a few seconds after the file is written. The memory is bounded: only
+    one point per bus is kept (see find_traffic_speed.drop_idle_buses) and the speed arrays have a fixed size.
+
+    The state is saved to CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE every checkpoint_interval seconds and when the service
+    stops, so it can be restarted (or update_traffic_speed can be run) without reading the day again. The files after
+    the last checkpoint are simply read again.
+
+    The folder is polled, which works on any file system (including network mounts, where inotify does not).
+
+    Parameters
+    ----------
+    final_node_table: Dict
+        A dictionary that stored the node id and the latitude/longitude coordinates as a key value pair.
+
+    final_way_table: Dict
+        A dictionary that stored the way id and a list of node id's as a key value pair.
+
+    final_relation_table:
+        A dictionary that stored the relation id and a tuple that had a list of nodes and ways and a list of tags.
+
+    time_slot_interval: Int or List of Int
+        See find_traffic_speed.find_traffic_speed
+
+    way_index: Dictionary
+        The return of find_nearest_road.build_way_index or find_nearest_road.load_way_index, it is built here if not
+        provided.
+
+    date_str: string
+        8 digit number of the date_str in yyyyMMdd format (e.g. 20200731). By default it is the current day, and the
+        service moves to the next day at midnight.
+
+    poll_interval: int
+        The time (in seconds) between two looks at the folder
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    min_file_age: int
+        Files modified in the last min_file_age seconds are left for the next poll, as they may still be written.
+
+    checkpoint_interval: int
+        The time (in seconds) between two saves of the state
+
+    max_idle_time: int
+        See find_traffic_speed.drop_idle_buses
+
+    max_polls: int
+        Stop after this number of polls, None to run until interrupted (Ctrl+C)
+    """
+    time_slot_intervals = get_time_slot_intervals(time_slot_interval)
+    way_rows = {way: row for row, way in enumerate(final_way_table)}
+    bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    if way_index is None:
+        way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+
+    current_date_str = None
+    state = None
+    state_file = None
+    state_changed = False
+    last_checkpoint_time = time.time()
+    poll_count = 0
+    try:
+        while max_polls is None or poll_count < max_polls:
+            poll_count += 1
+            poll_date_str = date_str if date_str is not None else datetime.today().strftime('%Y%m%d')
+            if current_date_str is None:
+                current_date_str = poll_date_str
+                state_file = Path(CONFIG_SINGLE_DAY_REAL_TIME_STATE_FILE.format(current_date_str))
+                state = load_real_time_state(state_file, list(way_rows), time_slot_intervals)
+                state_changed = False
+                print("Watching {}, {} files used before".format(current_date_str, len(state["consumed_sources"])))
+
+            # After midnight the files of the day are not written anymore, the last poll of the day takes all of them
+            # without waiting for min_file_age, then the next poll moves to the new day
+            day_over = poll_date_str != current_date_str
+            data_sources = list_new_data_sources(current_date_str, state, min_file_size,
+                                                 0 if day_over else min_file_age, verbose=False)
+            if len(data_sources) > 0:
+                start_time = time.time()
+                bus_count = ingest_data_sources(current_date_str, state, data_sources, final_node_table,
+                                                final_way_table, final_relation_table, way_rows,
+                                                bus_route_to_relation_index, way_index, max_idle_time)
+                state_changed = True
+                print("{}: {} new files, {} bus updated, {} bus tracked, {:.2f}s".format(
+                    datetime.now().strftime('%H:%M:%S'), len(data_sources), bus_count, len(state["last_points"]),
+                    time.time() - start_time))
+
+            if state_changed and (day_over or time.time() - last_checkpoint_time >= checkpoint_interval):
+                save_real_time_state(state, state_file)
+                state_changed = False
+                last_checkpoint_time = time.time()
+            if day_over:
+                current_date_str = None
+
+            if max_polls is None or poll_count < max_polls:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        if state_changed:
+            save_real_time_state(state, state_file)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] in ["-h", "--help"]:
+        print("Usage:")
+        print("ingest_real_time_data.py <date_str> <poll interval>")
+        print("")
+        print("Keep updating the speed results of the day in data/<date_str>/result as the raw data files arrive.")
+        print("Stop with Ctrl+C.")
+        print("")
+        print("Optional:")
+        print("date_str       : 8 digit number of the date_str, by default is the current day")
+        print("poll interval  : the time (in seconds) between two looks at data/<date_str>/raw")
+        print("             by default is: {}".format(REAL_TIME_POLL_INTERVAL))
+        exit(0)
+
+    date_str = None
+    if len(sys.argv) >= 2 and sys.argv[1] != "today":
+        date_str = sys.argv[1]
+    poll_interval = REAL_TIME_POLL_INTERVAL
+    if len(sys.argv) >= 3:
+        poll_interval = float(sys.argv[2])
+
+    save_filename_list = ["final_node_table", "final_way_table", "final_relation_table"]
+    final_node_table, final_way_table, final_relation_table = graph_reader(Path("graph"), SAVE_TYPE_PICKLE,
+                                                                           save_filename_list)
+    way_index = load_way_index(Path("graph"), final_node_table, final_way_table, final_relation_table)
+    watch_real_time_data(final_node_table, final_way_table, final_relation_table, time_slot_interval=[5, 15],
+                         way_index=way_index, date_str=date_str, poll_interval=poll_interval)
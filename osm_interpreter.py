@@ -5,7 +5,9 @@ import sys
 import time
 from pathlib import Path
 
-from helper.global_var import FLAG_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_PICKLE
+from find_nearest_road import build_route_geometry, build_way_index, save_route_geometry
+from helper.compact_graph import build_compact_graph, save_compact_graph
+from helper.global_var import FLAG_DEBUG, SAVE_TYPE_JSON, SAVE_TYPE_NUMPY, SAVE_TYPE_PICKLE
 from helper.graph_writer import graph_writer
 from osm_handler import OSMHandler
 
@@ -71,7 +73,7 @@ def get_map_data(map_file, result_file_path, save_type):
 
     save_type: int
         The type to store the file, use the following variable
-        SAVE_TYPE_JSON or SAVE_TYPE_PICKLE
+        SAVE_TYPE_JSON, SAVE_TYPE_PICKLE or SAVE_TYPE_NUMPY
 
     Returns
     -------
@@ -221,7 +223,15 @@ def get_map_data(map_file, result_file_path, save_type):
                           "way_types", "way_type_avg_speed_limit"]
     save_variable_list = [final_node_table, final_way_table, final_relation_table, relations, way_graph_by_list,
                           way_types, way_type_avg_speed_limit]
-    graph_writer(result_file_path, save_type, save_filename_list, save_variable_list)
+    graph_writer(result_file_path, save_type, save_filename_list, save_variable_list, map_file)
+
+    # Compile the route geometry used by map matching, see load_way_index() in find_nearest_road.py
+    way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+    save_route_geometry(build_route_geometry(way_index, final_way_table, final_relation_table), result_file_path)
+
+    # Compile the tables into arrays, see helper/compact_graph.py
+    save_compact_graph(build_compact_graph(final_node_table, final_way_table, way_types, way_type_avg_speed_limit,
+                                           way_graph_by_list), result_file_path, map_file)
 
     return final_node_table, final_way_table, final_relation_table, relations
 
@@ -238,7 +248,7 @@ if __name__ == '__main__':
         print("Result path: the path to the folder that store the result files")
         print("             by default is: graph/")
         print("Save format: the format to save the result, by default is pickle")
-        print("             possible value: JSON and pickle")
+        print("             possible value: JSON, pickle and numpy")
         exit(0)
 
     map_file = Path(sys.argv[1])
@@ -252,10 +262,12 @@ if __name__ == '__main__':
             save_type = SAVE_TYPE_JSON
         elif sys.argv[3] == "pickle":
             save_type = SAVE_TYPE_PICKLE
+        elif sys.argv[3] == "numpy":
+            save_type = SAVE_TYPE_NUMPY
         else:
             print("invalid Save format")
             print("Save format: the format to save the result, by default is pickle")
-            print("             possible value: JSON and pickle")
+            print("             possible value: JSON, pickle and numpy")
             exit(0)
 
     print("Map File   : %s" % map_file)
@@ -264,6 +276,8 @@ if __name__ == '__main__':
         print("Result type: pickle")
     elif save_type == SAVE_TYPE_JSON:
         print("Result type: JSON")
+    elif save_type == SAVE_TYPE_NUMPY:
+        print("Result type: numpy")
 
     start = time.process_time()
     get_map_data(map_file, result_file_path, save_type)
@@ -1,17 +1,24 @@
 import csv
 import math
+import operator
 import os
 import pickle
 import queue
 import sys
 import time
+from collections import deque
 from datetime import datetime, timedelta
+from itertools import chain
 from pathlib import Path
 
+import numpy as np
+
 from helper.debug_predict_road_condition_map import show_traffic_speed
 from helper.global_var import FLAG_DEBUG, SAVE_TYPE_PICKLE, PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE, \
-    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT
-from helper.graph_reader import graph_reader
+    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, \
+    PREDICT_ROAD_CONDITION_IMPUTATION_MODE, CONFIG_HISTORY_STORE_FOLDER
+from helper.graph_cache import cached_graph_reader, cached_graph_value
+from helper.history_store import get_history_day_row, load_result_file, open_history_store
 
 
 def reassign_weight(config_weight, history_data_missing_idx_set):
@@ -224,6 +231,9 @@ def estimate_no_data_road_speed_using_BFS(predict_speed_dict, way_graph, way_typ
     This function will find a non-zero way as starting point. Use BFS to visit all ways. If a way is missing, it will
     use near by way's speed to predict it's speed.
 
+    The predictions use estimate_no_data_road_speed, which does not walk the graph again for every interval. This
+    function is kept as the reference of its "bfs" mode.
+
     Parameters
     ----------
     predict_speed_dict: Dictionary
@@ -292,9 +302,615 @@ def estimate_no_data_road_speed_using_BFS(predict_speed_dict, way_graph, way_typ
     return predict_speed_dict
 
 
+def get_way_graph_index(way_graph, way_types, way_type_avg_speed_limit):
+    """
+    Turn way_graph into arrays indexed by row, used to estimate the speed of the ways without data (see
+    estimate_no_data_road_speed_matrix). It only depends on the map, build it once and use it for all the predictions.
+
+    The adjacency of way_graph is kept in CSR (compressed sparse row) format: the neighbors of the way in row i are the
+    rows indices[indptr[i]:indptr[i + 1]], in the order of way_graph.
+
+    Parameters
+    ----------
+    way_graph: Graph (Dictionary)
+        A graph use way_id as the node of the graph and use [OSM's node] as the edge of the graph. Use adjacency list
+        to represent the graph.
+
+    way_types: Dictionary
+        A dictionary that use way_id as key and the type of the way as the value
+
+    way_type_avg_speed_limit: Dictionary
+        A dictionary that use way_type as key and the average speed limit of that type of way as the value
+
+    Returns
+    -------
+    way_graph_index: Dictionary
+        way_ids: the way of each row
+        way_rows: {way_id: row}
+        neighbors: the rows of the neighbors of each row, as lists (used by the BFS)
+        indptr, indices: the adjacency in CSR format
+        neighbor_weight: the weight of the speed of each neighbor in indices, 1 for the neighbors of the same kind
+            (motorway or not), 4 for the other neighbors of a motorway and 0 for the motorway neighbors of the other
+            ways (see estimate_no_data_road_speed_using_BFS)
+        motorway: if the way of each row is a motorway
+        speed_limit: the average speed limit of the type of the way of each row
+        default_speed: the speed of the way of each row when there is no data at all
+        way_types, way_type_avg_speed_limit: the input
+        bfs_orders: {start row: the rows in the order the BFS visits them}, filled by get_bfs_order
+    """
+    way_ids = list(way_graph)
+    way_rows = {way: row for row, way in enumerate(way_ids)}
+    for neighbors in way_graph.values():
+        for neighbor in neighbors:
+            if neighbor not in way_rows:
+                way_rows[neighbor] = len(way_ids)
+                way_ids.append(neighbor)
+
+    neighbors = [[way_rows[neighbor] for neighbor in way_graph.get(way, [])] for way in way_ids]
+    indptr = np.zeros(len(way_ids) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row_neighbors) for row_neighbors in neighbors])
+    indices = np.array([neighbor for row_neighbors in neighbors for neighbor in row_neighbors], dtype=np.int64)
+
+    motorway = np.array(["motorway" in way_types.get(way, "") for way in way_ids], dtype=bool)
+    edge_motorway = np.repeat(motorway, np.diff(indptr))
+    neighbor_weight = np.where(edge_motorway == motorway[indices], 1.0, np.where(edge_motorway, 4.0, 0.0))
+
+    return {
+        "way_ids": way_ids,
+        "way_rows": way_rows,
+        "neighbors": neighbors,
+        "indptr": indptr,
+        "indices": indices,
+        "neighbor_weight": neighbor_weight,
+        "motorway": motorway,
+        # a type without speed limit (e.g. "unclassified" is not in the map) is 0, as in build_compact_graph
+        "speed_limit": np.array([way_type_avg_speed_limit.get(way_types.get(way, "unclassified"), 0)
+                                 for way in way_ids], dtype=np.float64),
+        "default_speed": np.array([way_type_avg_speed_limit.get(way_types.get(way, "unclassified"), 30)
+                                   for way in way_ids], dtype=np.float64),
+        "way_types": way_types,
+        "way_type_avg_speed_limit": way_type_avg_speed_limit,
+        "bfs_orders": {}
+    }
+
+
+def load_way_graph_index(graph_path=Path("graph/")):
+    """
+    The return of get_way_graph_index for the graph in graph_path. It is kept in memory by helper/graph_cache.py, and
+    only built again when the graph files change.
+    """
+    return cached_graph_value("way_graph_index", get_way_graph_index, graph_path, SAVE_TYPE_PICKLE,
+                              ["way_graph", "way_types", "way_type_avg_speed_limit"])
+
+
+def get_bfs_order(way_graph_index, start_row):
+    """
+    The rows in the order the BFS of estimate_no_data_road_speed_using_BFS visits them from start_row. It only depends
+    on the graph, so it is cached in way_graph_index.
+    """
+    if start_row not in way_graph_index["bfs_orders"]:
+        neighbors = way_graph_index["neighbors"]
+        bfs_order = [start_row]
+        bfs_explored = {start_row}
+        bfs_to_explore = deque([start_row])
+        while bfs_to_explore:
+            for neighbor in neighbors[bfs_to_explore.popleft()]:
+                if neighbor not in bfs_explored:
+                    bfs_order.append(neighbor)
+                    bfs_to_explore.append(neighbor)
+                    bfs_explored.add(neighbor)
+        way_graph_index["bfs_orders"][start_row] = bfs_order
+    return way_graph_index["bfs_orders"][start_row]
+
+
+def estimate_no_data_road_speed_bfs(speeds, start_row, way_graph_index):
+    """
+    estimate_no_data_road_speed_using_BFS on a list of speeds indexed by the rows of way_graph_index. The ways are
+    visited in the same order and the missing speeds are computed the same way, so the results are exactly the same.
+
+    Parameters
+    ----------
+    speeds: List of float
+        The predict speed of the way of each row, 0 if there is no data. Updated in place.
+
+    start_row: int
+        The row of the first way with data, where the BFS starts
+
+    way_graph_index: Dictionary
+        The return of get_way_graph_index
+
+    Returns
+    -------
+    bfs_order: List of int
+        The rows visited by the BFS, i.e. the rows whose speed is set
+    """
+    neighbors = way_graph_index["neighbors"]
+    motorway = way_graph_index["motorway"].tolist()
+    speed_limit = way_graph_index["speed_limit"].tolist()
+    bfs_order = get_bfs_order(way_graph_index, start_row)
+    for row in bfs_order:
+        if speeds[row] <= 0:
+            row_motorway = motorway[row]
+            temp_sample = []
+            for neighbor in neighbors[row]:
+                neighbor_speed = speeds[neighbor]
+                if neighbor_speed > 0:
+                    if row_motorway == motorway[neighbor]:
+                        temp_sample.append(neighbor_speed)
+                    elif row_motorway:
+                        temp_sample.append(4 * neighbor_speed)
+            temp_sample.append(speed_limit[row])
+            speeds[row] = sum(temp_sample) / len(temp_sample)
+    return bfs_order
+
+
+def sum_neighbors(edge_values, indptr):
+    """
+    The sum of the values of the neighbors of each row, i.e. the product of the adjacency matrix and the values.
+
+    Parameters
+    ----------
+    edge_values: np.ndarray
+        (edges, intervals) array, the values taken at the indices of the adjacency, e.g. values[indices]
+
+    indptr: np.ndarray
+        The indptr of the adjacency, see get_way_graph_index
+
+    Returns
+    -------
+    np.ndarray: (rows, intervals) array
+    """
+    result = np.zeros((len(indptr) - 1,) + edge_values.shape[1:], dtype=edge_values.dtype)
+    # np.add.reduceat does not give 0 for the rows without neighbors, so they are skipped
+    has_neighbor = indptr[:-1] < indptr[1:]
+    if has_neighbor.any():
+        result[has_neighbor] = np.add.reduceat(edge_values, indptr[:-1][has_neighbor], axis=0)
+    return result
+
+
+def estimate_no_data_road_speed_matrix(speed_matrix, way_graph_index, start_rows=None,
+                                       mode=PREDICT_ROAD_CONDITION_IMPUTATION_MODE):
+    """
+    Use near by way's speed to estimate the speed of the ways without data (speed <= 0), for many intervals at once.
+
+    A way without data gets the average of the speeds of its neighbors and its speed limit, the same as
+    estimate_no_data_road_speed_using_BFS. The mode decides the order the ways are filled:
+        "bfs": estimate_no_data_road_speed_using_BFS for each interval, one way at a time from start_rows. This is the
+            original behavior, kept as the reference.
+        "sparse": the fill is done in rounds, each round fills all the ways (of all the intervals) next to a way with a
+            speed, with sparse matrix operations. Unlike the BFS, a way only uses the speeds of the previous rounds
+            (and not the ones of the same round filled just before it), and the parts of the graph not connected to
+            the start way of the BFS are filled as well.
+    An interval without data at all gets the default speed of each way.
+
+    Parameters
+    ----------
+    speed_matrix: np.ndarray
+        (rows, intervals) array, the predict speed of the way of each row of way_graph_index, <= 0 if there is no data
+
+    way_graph_index: Dictionary
+        The return of get_way_graph_index
+
+    start_rows: List of int
+        The row where the BFS of each interval starts, only used by the "bfs" mode. By default it is the first row with
+        data.
+
+    mode: String
+        "sparse" or "bfs", see above
+
+    Returns
+    -------
+    speeds: np.ndarray
+        (rows, intervals) array, the speeds with the missing ones estimated
+
+    visited: np.ndarray
+        (rows, intervals) array, True where the speed is set by the fill
+    """
+    speeds = np.array(speed_matrix, dtype=np.float64)
+    visited = np.zeros(speeds.shape, dtype=bool)
+    known = speeds > 0
+    no_data = ~known.any(axis=0)
+    speeds[:, no_data] = way_graph_index["default_speed"][:, None]
+
+    if mode == "bfs":
+        for interval_idx in np.flatnonzero(~no_data).tolist():
+            interval_speeds = speeds[:, interval_idx].tolist()
+            if start_rows is None:
+                start_row = int(np.argmax(known[:, interval_idx]))
+            else:
+                start_row = start_rows[interval_idx]
+            bfs_order = estimate_no_data_road_speed_bfs(interval_speeds, start_row, way_graph_index)
+            speeds[:, interval_idx] = interval_speeds
+            visited[bfs_order, interval_idx] = True
+        return speeds, visited
+
+    if mode != "sparse":
+        raise ValueError("Unknown imputation mode: {}".format(mode))
+
+    indptr = way_graph_index["indptr"]
+    indices = way_graph_index["indices"]
+    neighbor_weight = way_graph_index["neighbor_weight"][:, None]
+    speed_limit = way_graph_index["speed_limit"][:, None]
+    known[:, no_data] = True
+    while True:
+        neighbor_known = known[indices]
+        to_fill = ~known & sum_neighbors(neighbor_known, indptr)
+        if not to_fill.any():
+            break
+        # The same sum as the BFS: the speeds of the neighbors (times their weight) then the speed limit
+        neighbor_speed = np.where(neighbor_known, speeds[indices], 0.0) * neighbor_weight
+        sample_sum = sum_neighbors(neighbor_speed, indptr) + speed_limit
+        sample_count = sum_neighbors((neighbor_known & (neighbor_weight > 0)).astype(np.float64), indptr) + 1
+        speeds[to_fill] = (sample_sum / sample_count)[to_fill]
+        known |= to_fill
+        visited |= to_fill
+    return speeds, visited
+
+
+def estimate_no_data_road_speed_dict_list(predict_speed_dict_list, way_graph_index,
+                                          mode=PREDICT_ROAD_CONDITION_IMPUTATION_MODE):
+    """
+    estimate_no_data_road_speed_using_BFS for many predict_speed_dict at once (e.g. all the intervals of a day), with
+    estimate_no_data_road_speed_matrix.
+
+    The ways of way_graph reached by the fill are added to the dictionaries, like the BFS does. With the "bfs" mode the
+    speeds are exactly the same as estimate_no_data_road_speed_using_BFS, only the order of the added ways can differ.
+
+    Parameters
+    ----------
+    predict_speed_dict_list: List of Dictionary
+        A dictionary that use way_id as key and the predict bus speed on that road at the given time as value, for each
+        interval. Updated in place.
+
+    way_graph_index: Dictionary
+        The return of get_way_graph_index
+
+    mode: String
+        See estimate_no_data_road_speed_matrix
+
+    Returns
+    -------
+    predict_speed_dict_list: List of Dictionary
+    """
+    way_ids = way_graph_index["way_ids"]
+    way_rows = way_graph_index["way_rows"]
+    way_types = way_graph_index["way_types"]
+    way_type_avg_speed_limit = way_graph_index["way_type_avg_speed_limit"]
+
+    with_data = []
+    start_rows = []
+    for predict_speed_dict in predict_speed_dict_list:
+        # the BFS starts from the first way with data
+        start_way = next((way for way, speed in predict_speed_dict.items() if speed > 0 and way in way_rows), None)
+        if start_way is None:
+            if FLAG_DEBUG:
+                print("No data at all, assume all roads have good condition.")
+            for way in predict_speed_dict:
+                predict_speed_dict[way] = way_type_avg_speed_limit.get(way_types.get(way, "unclassified"), 30)
+        else:
+            with_data.append(predict_speed_dict)
+            start_rows.append(way_rows[start_way])
+    if len(with_data) == 0:
+        return predict_speed_dict_list
+
+    # The dictionaries of the intervals usually have the same ways in the same order, so the rows are only looked up
+    # when the ways change
+    speed_matrix = np.zeros((len(way_ids), len(with_data)))
+    dict_ways = None
+    dict_rows_list = []
+    for interval_idx, predict_speed_dict in enumerate(with_data):
+        if dict_ways != list(predict_speed_dict):
+            dict_ways = list(predict_speed_dict)
+            dict_rows = np.array([way_rows.get(way, -1) for way in dict_ways], dtype=np.int64)
+            in_graph = np.flatnonzero(dict_rows >= 0)
+            dict_rows = (dict_ways, dict_rows[in_graph], in_graph)
+        dict_rows_list.append(dict_rows)
+        speeds = np.fromiter(predict_speed_dict.values(), dtype=np.float64, count=len(predict_speed_dict))
+        speed_matrix[dict_rows[1], interval_idx] = speeds[dict_rows[2]]
+
+    speeds, visited = estimate_no_data_road_speed_matrix(speed_matrix, way_graph_index, start_rows, mode)
+
+    for interval_idx, predict_speed_dict in enumerate(with_data):
+        dict_ways, rows, in_graph = dict_rows_list[interval_idx]
+        new_speeds = speeds[rows, interval_idx]
+        changed = np.flatnonzero(new_speeds != speed_matrix[rows, interval_idx])
+        for way_idx, speed in zip(in_graph[changed].tolist(), new_speeds[changed].tolist()):
+            predict_speed_dict[dict_ways[way_idx]] = speed
+        # the ways of way_graph that are not in the dictionary yet
+        for row, speed in zip(np.flatnonzero(visited[:, interval_idx]).tolist(),
+                              speeds[visited[:, interval_idx], interval_idx].tolist()):
+            if way_ids[row] not in predict_speed_dict:
+                predict_speed_dict[way_ids[row]] = speed
+    return predict_speed_dict_list
+
+
+def estimate_no_data_road_speed(predict_speed_dict, way_graph_index, mode=PREDICT_ROAD_CONDITION_IMPUTATION_MODE):
+    """
+    estimate_no_data_road_speed_using_BFS with a prebuilt way_graph_index, see estimate_no_data_road_speed_dict_list.
+
+    Parameters
+    ----------
+    predict_speed_dict: Dictionary
+        A dictionary that use way_id as key and the predict bus speed on that road at the given time as value.
+
+    way_graph_index: Dictionary
+        The return of get_way_graph_index
+
+    mode: String
+        See estimate_no_data_road_speed_matrix
+
+    Returns
+    -------
+    predict_speed_dict: Dictionary
+    """
+    return estimate_no_data_road_speed_dict_list([predict_speed_dict], way_graph_index, mode)[0]
+
+
+def get_history_speed_tensor(history_speed_matrix_list, way_ids, interval_indices=None):
+    """
+    Stack the history speed matrices into one array, used by compute_speed_array.
+
+    Parameters
+    ----------
+    history_speed_matrix_list: List of speed matrix
+        List of speed matrix, the return of get_history_speed_matrix_list
+
+    way_ids: List of way_id
+        The ways to stack, they should exist in all speed matrix (see get_way_id_set)
+
+    interval_indices: List of int
+        Only stack these intervals (e.g. the return of get_interval_indices for a single prediction), None to stack all
+        the intervals.
+
+    Returns
+    -------
+    history_speed_tensor: np.ndarray
+        (days, ways, intervals) array, history_speed_tensor[d, i, j] is the speed of way_ids[i] in the j-th interval of
+        the d-th speed matrix (the interval_indices[j]-th interval if interval_indices is given)
+    """
+    if interval_indices is None:
+        return np.array([[speed_matrix[way_id] for way_id in way_ids] for speed_matrix in history_speed_matrix_list],
+                        dtype=np.float64).reshape(len(history_speed_matrix_list), len(way_ids), -1)
+
+    # the speeds are read straight into the array, without building the nested lists
+    get_speeds = operator.itemgetter(*interval_indices)
+    speeds = chain.from_iterable(map(get_speeds, map(speed_matrix.__getitem__, way_ids))
+                                 for speed_matrix in history_speed_matrix_list)
+    if len(interval_indices) > 1:
+        # itemgetter gives a tuple of speeds for each way
+        speeds = chain.from_iterable(speeds)
+    shape = (len(history_speed_matrix_list), len(way_ids), len(interval_indices))
+    return np.fromiter(speeds, dtype=np.float64, count=shape[0] * shape[1] * shape[2]).reshape(shape)
+
+
+def get_history_speed_tensor_from_store(history_data_date_str, config_weight, interval, result_file_path,
+                                        history_store_folder=CONFIG_HISTORY_STORE_FOLDER, interval_indices=None):
+    """
+    get_history_speed_matrix_list, get_way_id_set and get_history_speed_tensor with the history store (see
+    helper/history_store.py): the days are sliced out of the memory-mapped array instead of parsing their files.
+
+    The store is only read (the requests of homepage.py never write it). The days that are not in the store (e.g.
+    today, or the days not added yet by script/build_history_store.py) and the days whose result file changed since
+    they were added are read from their result files, see history_store.get_history_day_row.
+
+    Parameters
+    ----------
+    history_data_date_str, config_weight, interval, result_file_path:
+        See get_history_speed_matrix_list
+
+    history_store_folder: String
+        The folder of the history store
+
+    interval_indices: List of int
+        See get_history_speed_tensor
+
+    Returns
+    -------
+    history_speed_tensor: np.ndarray
+        The same as get_history_speed_tensor(history_speed_matrix_list, list(usable_way_id_set)), None if no day has
+        data
+
+    config_weight:
+        See get_history_speed_matrix_list
+
+    full_way_id_set, usable_way_id_set:
+        See get_way_id_set
+    """
+    store = open_history_store(interval, history_store_folder)
+    way_ids = [] if store is None else list(store["way_ids"])
+    way_rows = {} if store is None else dict(store["way_rows"])
+
+    history_data_missing_idx_set = set()
+    # For each day, its row in the store or the speed matrix of its result file
+    days = []
+    for i, date_str in enumerate(history_data_date_str):
+        day_row = get_history_day_row(store, date_str, interval, result_file_path)
+        speed_matrix = None
+        if day_row is None:
+            speed_matrix = load_result_file(date_str, interval, result_file_path)
+        if day_row is not None:
+            days.append(day_row)
+        elif speed_matrix is not None and len(speed_matrix) > 0:
+            days.append(speed_matrix)
+            for way_id in speed_matrix:
+                if way_id not in way_rows:
+                    way_rows[way_id] = len(way_ids)
+                    way_ids.append(way_id)
+        else:
+            history_data_missing_idx_set.add(i)
+            if FLAG_DEBUG:
+                print(date_str, " missing")
+    config_weight = reassign_weight(config_weight, history_data_missing_idx_set)
+    if len(days) == 0:
+        return None, config_weight, set(), set()
+
+    if all(isinstance(day, int) for day in days) and interval_indices is None:
+        day_speeds = np.array(store["speeds"][days])
+    elif all(isinstance(day, int) for day in days):
+        day_speeds = np.stack([store["speeds"][day][:, interval_indices] for day in days])
+    else:
+        if interval_indices is not None:
+            interval_count = len(interval_indices)
+        elif store is not None:
+            interval_count = store["interval_count"]
+        else:
+            interval_count = len(next(iter(next(day for day in days if isinstance(day, dict)).values())))
+        day_speeds = np.full((len(days), len(way_ids), interval_count), np.nan, dtype=np.float64)
+        for i, day in enumerate(days):
+            if isinstance(day, dict):
+                day_speeds[i, [way_rows[way_id] for way_id in day]] = \
+                    get_history_speed_tensor([day], list(day), interval_indices)[0]
+            elif interval_indices is None:
+                day_speeds[i, :len(store["way_ids"])] = store["speeds"][day]
+            else:
+                day_speeds[i, :len(store["way_ids"])] = store["speeds"][day][:, interval_indices]
+    # The ways of each day, in the same order as in its result file, so the sets are the same as get_way_id_set gives
+    way_id_array = np.array(way_ids, dtype=np.int64)
+    day_way_ids = [day if isinstance(day, dict) else dict.fromkeys(way_id_array[~np.isnan(speeds[:, 0])].tolist())
+                   for day, speeds in zip(days, day_speeds)]
+    full_way_id_set, usable_way_id_set = get_way_id_set(day_way_ids)
+
+    usable_way_rows = [way_rows[way_id] for way_id in usable_way_id_set]
+    return day_speeds[:, usable_way_rows, :], config_weight, full_way_id_set, usable_way_id_set
+
+
+def load_history_speed(history_data_date_str, config_weight, interval, result_file_path,
+                       history_store_folder=CONFIG_HISTORY_STORE_FOLDER, interval_indices=None):
+    """
+    Load the history of a prediction, from the history store or from the result files.
+
+    Parameters
+    ----------
+    history_data_date_str, config_weight, interval, result_file_path:
+        See get_history_speed_matrix_list
+
+    history_store_folder: String
+        The folder of the history store, None to read the result files directly
+
+    interval_indices: List of int
+        The intervals used by the prediction (see get_interval_indices), only they are loaded. None for all the
+        intervals.
+
+    Returns
+    -------
+    history_speed_matrix_list: List of speed matrix
+        See get_history_speed_matrix_list, None when the history store is used
+
+    history_speed_tensor: np.ndarray
+        See get_history_speed_tensor_from_store, None if no day has data
+
+    config_weight:
+        See get_history_speed_matrix_list
+
+    full_way_id_set, usable_way_id_set:
+        See get_way_id_set
+    """
+    if history_store_folder is not None:
+        history_speed_tensor, config_weight, full_way_id_set, usable_way_id_set = \
+            get_history_speed_tensor_from_store(history_data_date_str, config_weight, interval, result_file_path,
+                                                history_store_folder, interval_indices)
+        return None, history_speed_tensor, config_weight, full_way_id_set, usable_way_id_set
+
+    history_speed_matrix_list, config_weight = get_history_speed_matrix_list(history_data_date_str, config_weight,
+                                                                             interval, result_file_path)
+    if len(history_speed_matrix_list) == 0:
+        return history_speed_matrix_list, None, config_weight, set(), set()
+    full_way_id_set, usable_way_id_set = get_way_id_set(history_speed_matrix_list)
+    history_speed_tensor = get_history_speed_tensor(history_speed_matrix_list, list(usable_way_id_set),
+                                                    interval_indices)
+    return history_speed_matrix_list, history_speed_tensor, config_weight, full_way_id_set, usable_way_id_set
+
+
+def get_interval_indices(interval_idx, config_history_data_range):
+    """
+    The intervals of the history read by compute_speed_array to predict interval_idx: the interval itself and the
+    nearby ones of config_history_data_range, with the same wrap around.
+
+    Returns
+    -------
+    List of int: sorted, without duplicates
+    """
+    return sorted({interval_idx} | {(interval_idx + i) % 96 for i in config_history_data_range})
+
+
+def compute_speed_array(interval_idx, history_speed_tensor, config_history_data_range, config_weight,
+                        interval_indices=None):
+    """
+    The weighted sum of compute_speed_dict for all the ways at once, and for many intervals at once if interval_idx is
+    an array of indices (e.g. all the intervals of a day, see compute_speed_dict_list).
+
+    Each step is done for all ways with array operations, in the same order as the loop over the ways did (the days
+    are still added one by one), so the speeds are exactly the same:
+        1. a missing speed (<= 0) is replaced by the first nearby interval with data in config_history_data_range
+        2. if still missing, the weight of the day is given to the other days (see estimate_missing_value)
+        3. the dot product of the speeds and the weights (see compute_predict_speed)
+
+    Parameters
+    ----------
+    interval_idx: Int or np.ndarray of int
+        The index of the period to predict, or the indices of the periods
+
+    history_speed_tensor: np.ndarray
+        (days, ways, intervals) array, the return of get_history_speed_tensor
+
+    config_history_data_range: List of int
+        See compute_speed_dict
+
+    config_weight: List of float
+        See compute_speed_dict, one weight for each day in history_speed_tensor
+
+    interval_indices: List of int
+        The intervals of history_speed_tensor when it only has some of them (see get_history_speed_tensor), it must
+        contain all the intervals used (see get_interval_indices). None if it has all the intervals.
+
+    Returns
+    -------
+    speeds: np.ndarray
+        The predict speed of each way, (ways, len(interval_idx)) if interval_idx is an array
+
+    no_data: np.ndarray
+        True for the ways that have no data in all days, their speed is 0. Same shape as speeds
+    """
+    def get_column(idx):
+        return idx if interval_indices is None else np.searchsorted(interval_indices, idx)
+
+    day_count = history_speed_tensor.shape[0]
+    history_speed = history_speed_tensor[:, :, get_column(interval_idx)].copy()
+    result_shape = history_speed.shape[1:]
+
+    # Use near by data as the data for the target time. The wrap around 96 intervals is the same as the loop version.
+    missing = history_speed <= 0
+    for i in config_history_data_range:
+        nearby_speed = history_speed_tensor[:, :, get_column((interval_idx + i) % 96)]
+        found = missing & (nearby_speed > 0)
+        history_speed[found] = nearby_speed[found]
+        missing &= ~found
+
+    # The weight of the days with data and the weighted sum of their speeds, added day by day
+    remain_weight = np.zeros(result_shape)
+    weighted_sum = np.zeros(result_shape)
+    for day in range(day_count):
+        remain_weight += np.where(missing[day], 0.0, config_weight[day])
+        weighted_sum += np.where(missing[day], 0.0, history_speed[day] * config_weight[day])
+
+    # Estimate the missing days with the weights, a way without weight left gets 0 for all days
+    has_weight = remain_weight != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_average = weighted_sum / remain_weight
+    speeds = np.zeros(result_shape)
+    for day in range(day_count):
+        day_speed = np.where(missing[day], weighted_average * config_weight[day], history_speed[day])
+        speeds += np.where(has_weight, day_speed, 0.0) * config_weight[day]
+
+    no_data = missing.sum(axis=0) >= len(config_weight)
+    speeds[no_data] = 0
+    return speeds, no_data
+
+
 def compute_speed_dict(interval, interval_idx, history_speed_matrix_list, full_way_id_set, usable_way_id_set,
                        config_history_data_range, config_weight, way_graph, way_types,
-                       way_type_avg_speed_limit):
+                       way_type_avg_speed_limit, history_speed_tensor=None, way_graph_index=None,
+                       imputation_mode=PREDICT_ROAD_CONDITION_IMPUTATION_MODE, interval_indices=None):
     """
     This function is part of the predict_road_condition function. This function will reading historical data and using
     weighted sum calculate the bus speed on the road at the given interval_idx.
@@ -309,7 +925,7 @@ def compute_speed_dict(interval, interval_idx, history_speed_matrix_list, full_w
         The index of the period of the predict_timestamp in predict_road_condition
 
     history_speed_matrix_list: List of speed matrix
-        List of speed matrix
+        List of speed matrix, only used (and can be None otherwise) when history_speed_tensor is not provided
 
     full_way_id_set: Set of way_id
         A set that contain all way that exist in history_speed_matrix_list.
@@ -337,76 +953,128 @@ def compute_speed_dict(interval, interval_idx, history_speed_matrix_list, full_w
     way_type_avg_speed_limit: Dictionary
         A dictionary that use way_type as key and the average speed limit of that type of way as the value
 
+    history_speed_tensor: np.ndarray
+        The return of get_history_speed_tensor(history_speed_matrix_list, list(usable_way_id_set)). It is built here if
+        not provided, pass it when computing many interval_idx with the same history.
+
+    way_graph_index: Dictionary
+        The return of get_way_graph_index(way_graph, way_types, way_type_avg_speed_limit). It is built here if not
+        provided.
+
+    imputation_mode: String
+        How the ways without data get their speed, see estimate_no_data_road_speed_matrix
+
+    interval_indices: List of int
+        The intervals of history_speed_tensor when it only has some of them, see compute_speed_array
+
     Returns
     -------
     predict_speed_dict: Dictionary
     A dictionary that use way_id as key and the predict bus speed on that road at the given time as value.
     When there is an error, it will return a dictionary with key "Error" and the detail of the error as the value
     """
-    predict_speed_dict = {}
-    max_idx = int(1440 / interval)
-    # iterate every way that all speed_matrix has
-    for way_id in usable_way_id_set:
-        temp_history_speed = []
-        temp_need_estimate_idx = set()
-        for speed_matrix in history_speed_matrix_list:
-            temp_speed = speed_matrix[way_id][interval_idx]
-            if temp_speed <= 0:
-
-                # Use near by data as the data for the target time
-                for i in config_history_data_range:
-                    temp_speed = speed_matrix[way_id][(interval_idx + i) % 96]
-                    if temp_speed > 0:
-                        break
-
-                # # Use near by data as the data for the target time, this will ignore the config_history_data_range
-                # # and check all day's dta
-                # temp_min_diff = 86401
-                # for i in range(len(speed_matrix[way_id])):
-                #     if speed_matrix[way_id][i] > 0:
-                #         temp_diff = abs(i - interval_idx)
-                #         if temp_diff < temp_min_diff:
-                #             temp_min_diff = temp_diff
-                #             temp_speed = speed_matrix[way_id][i]
-                #         elif temp_diff > temp_min_diff:
-                #             break
-
-                if temp_speed <= 0:
-                    temp_need_estimate_idx.add(len(temp_history_speed))
-
-            temp_history_speed.append(temp_speed)
-
-        # print(temp_history_speed)
-
-        if len(temp_need_estimate_idx) >= len(config_weight):
-            # all history day has no data for this way
-            # we assign 0 as the speed for the road for now
-            predict_speed_dict[way_id] = 0
-        else:
-            if 0 < len(temp_need_estimate_idx):
-                # some day's data is missing, we estimate the data using weight.
-                # what it really do is just re-assign the weight
-                temp_history_speed = estimate_missing_value(temp_history_speed, temp_need_estimate_idx, config_weight)
+    # the ways are kept in the order of usable_way_id_set, which decides where estimate_no_data_road_speed_using_BFS
+    # starts
+    usable_way_ids = list(usable_way_id_set)
+    if history_speed_tensor is None:
+        history_speed_tensor = get_history_speed_tensor(history_speed_matrix_list, usable_way_ids, interval_indices)
+    speeds, no_data = compute_speed_array(interval_idx, history_speed_tensor, config_history_data_range,
+                                          config_weight, interval_indices)
+
+    predict_speed_dict = get_predict_speed_dict(usable_way_ids, speeds.tolist(), no_data.tolist(),
+                                                full_way_id_set - usable_way_id_set)
+
+    # Use nearby way to estimate the way that has 0 as predict speed.
+    if way_graph_index is None:
+        way_graph_index = get_way_graph_index(way_graph, way_types, way_type_avg_speed_limit)
+    predict_speed_dict = estimate_no_data_road_speed(predict_speed_dict, way_graph_index, imputation_mode)
 
-            # Compute the speed using dot product
-            predict_speed_dict[way_id] = compute_predict_speed(temp_history_speed, config_weight)
+    return predict_speed_dict
+
+
+def get_predict_speed_dict(usable_way_ids, speeds, no_data, other_way_ids):
+    """
+    Put the speeds of one interval (a column of compute_speed_array) in a predict_speed_dict, before the BFS fill.
+
+    Parameters
+    ----------
+    usable_way_ids: List of way_id
+        The ways of the rows of the speeds, in the order of list(usable_way_id_set)
+
+    speeds: List of float
+        The predict speed of each way in usable_way_ids
+
+    no_data: List of bool
+        True for the ways that have no data in all days
+
+    other_way_ids: Iterable of way_id
+        The ways that not all speed_matrix contain, i.e. full_way_id_set - usable_way_id_set
+
+    Returns
+    -------
+    predict_speed_dict: Dictionary
+        A dictionary that use way_id as key and the predict bus speed on that road at the given time as value.
+    """
+    predict_speed_dict = {}
+    for way_id, speed, way_no_data in zip(usable_way_ids, speeds, no_data):
+        # all history day has no data for this way
+        # we assign 0 as the speed for the road for now
+        predict_speed_dict[way_id] = 0 if way_no_data else speed
 
     # For those way that not all speed_matrix contain data, we assign 0 for now
-    for way_id in (full_way_id_set - usable_way_id_set):
+    for way_id in other_way_ids:
         predict_speed_dict[way_id] = 0
+    return predict_speed_dict
 
-    # Use nearby way to estimate the way that has 0 as predict speed.
-    predict_speed_dict = estimate_no_data_road_speed_using_BFS(predict_speed_dict, way_graph, way_types,
-                                                               way_type_avg_speed_limit)
 
-    return predict_speed_dict
+def compute_speed_dict_list(interval, history_speed_matrix_list, full_way_id_set, usable_way_id_set,
+                            config_history_data_range, config_weight, way_graph, way_types, way_type_avg_speed_limit,
+                            history_speed_tensor=None, way_graph_index=None,
+                            imputation_mode=PREDICT_ROAD_CONDITION_IMPUTATION_MODE):
+    """
+    compute_speed_dict for all the intervals of a day at once.
+
+    The (ways, intervals) matrix of the weighted sums is computed with a single compute_speed_array call, so the history
+    is only walked once instead of once per interval, and the ways without data are estimated for all the intervals
+    with a single estimate_no_data_road_speed_dict_list call. The results are the same as calling compute_speed_dict
+    for each interval_idx.
+
+    Parameters
+    ----------
+    interval: Int
+        The length of each time interval in minutes. The input number should be divisible by 1440 (24 hour * 60 min)
+
+    history_speed_matrix_list, full_way_id_set, usable_way_id_set, config_history_data_range, config_weight,
+    way_graph, way_types, way_type_avg_speed_limit, history_speed_tensor, way_graph_index, imputation_mode:
+        See compute_speed_dict
+
+    Returns
+    -------
+    predict_speed_dict_list: List of Dictionary
+        predict_speed_dict_list[interval_idx] is the predict_speed_dict of the interval_idx (see compute_speed_dict)
+    """
+    usable_way_ids = list(usable_way_id_set)
+    other_way_ids = list(full_way_id_set - usable_way_id_set)
+    if history_speed_tensor is None:
+        history_speed_tensor = get_history_speed_tensor(history_speed_matrix_list, usable_way_ids)
+    speed_matrix, no_data_matrix = compute_speed_array(np.arange(int(1440 / interval)), history_speed_tensor,
+                                                       config_history_data_range, config_weight)
+
+    predict_speed_dict_list = [get_predict_speed_dict(usable_way_ids, speeds, no_data, other_way_ids)
+                               for speeds, no_data in zip(speed_matrix.T.tolist(), no_data_matrix.T.tolist())]
+
+    # Use nearby way to estimate the way that has 0 as predict speed.
+    if way_graph_index is None:
+        way_graph_index = get_way_graph_index(way_graph, way_types, way_type_avg_speed_limit)
+    return estimate_no_data_road_speed_dict_list(predict_speed_dict_list, way_graph_index, imputation_mode)
 
 
 def predict_road_condition(predict_timestamp=int(datetime.now().timestamp()), interval=5,
                            result_file_path="data/{0}/result/{0}_{1}_min_road.csv",
                            config_history_date=PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE,
                            config_history_data_range=PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
-                           config_weight=PREDICT_ROAD_CONDITION_CONFIG_WEIGHT):
+                           config_weight=PREDICT_ROAD_CONDITION_CONFIG_WEIGHT,
+                           history_store_folder=CONFIG_HISTORY_STORE_FOLDER):
     """
     This function will reading historical data and using weighted sum calculate the bus speed on the road at the
     given time.
@@ -441,6 +1109,9 @@ def predict_road_condition(predict_timestamp=int(datetime.now().timestamp()), in
         This parameter specifies the weight of each day's data when compute the weighted sum.
         by default it will use a predetermined configuration
 
+    history_store_folder: String
+        The folder of the history store (see helper/history_store.py), None to read the result files of each day
+
     Returns
     -------
     predict_speed_dict: Dictionary
@@ -448,16 +1119,16 @@ def predict_road_condition(predict_timestamp=int(datetime.now().timestamp()), in
     When there is an error, it will return a dictionary with key "Error" and the detail of the error as the value
 
     """
-    # TODO: This function could be implemented using pandas and numpy for better performance(Shiluo)
     # Check input, load data and preparation
     if len(config_history_date) != len(config_weight):
         return -1
 
     save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit"]
-    temp_map_dates = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
+    temp_map_dates = cached_graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
     way_graph = temp_map_dates[0]
     way_types = temp_map_dates[1]
     way_type_avg_speed_limit = temp_map_dates[2]
+    way_graph_index = load_way_graph_index(Path("graph/"))
 
     # Find the time of the predict, also find the range index in the day.
     predict_time = datetime.fromtimestamp(predict_timestamp)
@@ -474,21 +1145,22 @@ def predict_road_condition(predict_timestamp=int(datetime.now().timestamp()), in
         print("Predict time: {}".format(predict_time.strftime("%Y-%m-%d %H:%M:%S")))
         print("History data date_str:{}".format(history_data_date_str))
 
-    # Load history data
-    history_speed_matrix_list, config_weight = get_history_speed_matrix_list(history_data_date_str, config_weight,
-                                                                             interval, result_file_path)
+    # Load history data, only the intervals used by the prediction
+    interval_indices = get_interval_indices(interval_idx, config_history_data_range)
+    history_speed_matrix_list, history_speed_tensor, config_weight, full_way_id_set, usable_way_id_set = \
+        load_history_speed(history_data_date_str, config_weight, interval, result_file_path, history_store_folder,
+                           interval_indices)
 
-    if len(history_speed_matrix_list) == 0:
+    if history_speed_tensor is None:
         return {"Error": "No enough data for predict"}
 
     if FLAG_DEBUG:
-        print("{} day(s) load".format(len(history_speed_matrix_list)))
-
-    full_way_id_set, usable_way_id_set = get_way_id_set(history_speed_matrix_list)
+        print("{} day(s) load".format(len(history_speed_tensor)))
 
     predict_speed_dict = compute_speed_dict(interval, interval_idx, history_speed_matrix_list, full_way_id_set,
                                             usable_way_id_set, config_history_data_range, config_weight,
-                                            way_graph, way_types, way_type_avg_speed_limit)
+                                            way_graph, way_types, way_type_avg_speed_limit, history_speed_tensor,
+                                            way_graph_index, interval_indices=interval_indices)
 
     if FLAG_DEBUG:
         print(show_traffic_speed(predict_speed_dict, predict_timestamp))
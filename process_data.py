@@ -1,3 +1,6 @@
+import functools
+import io
+import multiprocessing
 import os
 import re
 import shutil
@@ -7,30 +10,77 @@ from datetime import datetime
 from pathlib import Path
 from typing import List
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 import helper.global_var as global_var
+from helper.day_data import get_day_data_file, read_day_data, write_day_data
 
 
-def load_data_file(data_path: Path, columns: List[str]) -> pd.DataFrame:
+RAW_DATA_COLUMNS = ['vehicle_id', 'route_id_curr', 'direction', 'block_id', 'service_type', 'deviation', 'next_tp_est',
+                    'next_tp_sname', 'next_tp_sched', 'X', 'Y', 'location time', 'route logon id', 'block_num',
+                    'off route', 'run_id', 'empty_columns']
+
+# The extra column added by load_data_files, tells which raw data file each row comes from
+SOURCE_FILE_COLUMN = 'source_file'
+
+# The dtype of each raw column, set at read time so pandas does not have to infer them for every file.
+RAW_DATA_DTYPES = {'vehicle_id': 'int64', 'route_id_curr': 'int64', 'direction': 'int64', 'block_id': 'int64',
+                   'service_type': 'int64', 'deviation': 'int64', 'next_tp_est': 'int64', 'next_tp_sname': str,
+                   'next_tp_sched': 'int64', 'X': 'float64', 'Y': 'float64', 'location time': 'int64',
+                   'route logon id': 'int64', 'block_num': 'int64', 'off route': 'int64', 'run_id': 'int64',
+                   'empty_columns': str}
+
+
+def get_raw_data_dtypes(columns: List[str], nullable: bool = False) -> dict:
     """
-    Load and filter one raw data file.
+    Get the dtype of each column for pd.read_csv, keyed by the column position.
 
     Parameters
     ----------
-    data_path: Path
-        The path of the data file to load
-
     columns: List[str]
         A list of strings denote the headers of each column.
 
+    nullable: bool, default is False
+        If True, use the nullable Int64 instead of int64 for the integer columns. Only needed when some data is missing
+        in the file, as int64 cannot hold NaN.
+
     Returns
     -------
-    DataFrame: The DataFrame obj that contains the data.
+    dict: column position -> dtype
+    """
+    dtypes = {}
+    for i, name in enumerate(columns):
+        if name in RAW_DATA_DTYPES:
+            dtype = RAW_DATA_DTYPES[name]
+            dtypes[i] = 'Int64' if nullable and dtype == 'int64' else dtype
+    return dtypes
+
+
+def read_raw_data_csv(data, columns: List[str]) -> pd.DataFrame:
     """
+    Read the raw data (a path or a file-like object) with the dtypes in RAW_DATA_DTYPES.
+
+    Parameters
+    ----------
+    data: Path or file-like object
+        The raw data to read
+
+    columns: List[str]
+        A list of strings denote the headers of each column. Extra columns found in the data will be appended.
 
-    data = pd.read_csv(data_path, sep=',', header=None)
+    Returns
+    -------
+    DataFrame: The DataFrame obj that contains the raw data.
+    """
+    try:
+        data = pd.read_csv(data, sep=',', header=None, dtype=get_raw_data_dtypes(columns))
+    except ValueError:
+        # Integer column has NA values, e.g. the line that has missing run_id
+        if hasattr(data, 'seek'):
+            data.seek(0)
+        data = pd.read_csv(data, sep=',', header=None, dtype=get_raw_data_dtypes(columns, nullable=True))
 
     # assert len(columns) == data.shape[1] - 1, f"{data_path}'s columns are unexpected"
 
@@ -38,42 +88,342 @@ def load_data_file(data_path: Path, columns: List[str]) -> pd.DataFrame:
         for i in range(data.shape[1] - len(columns)):
             columns.append("unknown_columns_{}".format(i))
     data.columns = columns
+    return data
 
-    # remove lines that have missing data
-    data = data.dropna(subset=["run_id"])
 
-    # remove empty_columns data
-    data = data.drop(columns='empty_columns')
+def local_hour_of_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Get the local hour of each timestamp, the same as datetime.fromtimestamp(timestamp).hour but for an array.
+
+    All the UTC offsets (and the DST changes) are multiple of 15 minutes, so the local hour can only change at the
+    boundary of a 900 second bucket. Only one datetime object is created for each bucket.
+
+    Parameters
+    ----------
+    timestamps: np.ndarray
+        10-digit timestamps
+
+    Returns
+    -------
+    np.ndarray: the local hour of each timestamp
+    """
+    buckets = np.floor_divide(np.asarray(timestamps, dtype=np.int64), 900)
+    unique_buckets, inverse = np.unique(buckets, return_inverse=True)
+    unique_hours = np.array([datetime.fromtimestamp(int(bucket) * 900).hour for bucket in unique_buckets],
+                            dtype=np.int64)
+    return unique_hours[inverse.reshape(-1)]
 
-    # Set route_id_curr column data to int
-    data[["route_id_curr"]] = data[["route_id_curr"]].astype(int)
 
-    # remove lines with 8000 <= vehicle_id < 9000, these vehicles are paratransit vehicle
-    data = data[(data.vehicle_id < 8000) | (data.vehicle_id >= 9000)]
+def get_raw_data_mask(data: pd.DataFrame) -> np.ndarray:
+    """
+    Compute all the filters of the raw data in one vectorized pass.
+
+    A row is kept only if
+        - it has a run_id, a route_id_curr, a vehicle_id and a location time
+        - it is not a paratransit vehicle (8000 <= vehicle_id < 9000)
+        - route_id_curr is not 0 (what does route_id_curr == 0 mean?) or 17 (route 17 doesn't exist)
+        - route_id_curr <= 111. As of Feb 4, 2021 the largest route number is 111.
+          But for history data, 216 is the largest route number all time
+          216 - McKinley Mall-Gowanda (stopped May 1, 2012)
+        - the hour of location time is between PROCESS_DATA_START_TIME and PROCESS_DATA_END_TIME
 
-    # remove lines with route_id_curr == 0
-    # what does route_id_curr == 0 mean?
-    data = data[data.route_id_curr != 0]
+    Parameters
+    ----------
+    data: DataFrame
+        The raw data, with the columns in RAW_DATA_COLUMNS
 
-    # remove lines with route_id_curr == 17
-    # route 17 doesn't exist
-    data = data[data.route_id_curr != 17]
+    Returns
+    -------
+    np.ndarray: boolean mask, True for the rows to keep.
+    """
+    vehicle_id = data['vehicle_id'].to_numpy(dtype='float64', na_value=np.nan)
+    route_id = data['route_id_curr'].to_numpy(dtype='float64', na_value=np.nan)
+    location_time = data['location time'].to_numpy(dtype='float64', na_value=np.nan)
+
+    # NaN always compare to False, so the rows with missing data are removed by the comparisons below
+    mask = data['run_id'].notna().to_numpy(dtype=bool) & ~np.isnan(location_time)
+    mask &= (vehicle_id < 8000) | (vehicle_id >= 9000)
+    mask &= (route_id != 0) & (route_id != 17) & (route_id <= 111)
     # route 45 91 99 are also in the raw data but not exist
 
-    data = data[data.route_id_curr <= 111]
-    # As of Feb 4, 2021 the largest route number is 111
-    # But for history data, 216 is the largest route number all time
-    # 216 - McKinley Mall-Gowanda (stopped May 1, 2012)
+    # filter time, only for the rows that still remain
+    if global_var.PROCESS_DATA_START_TIME > 0 or global_var.PROCESS_DATA_END_TIME < 23:
+        hours = local_hour_of_timestamps(location_time[mask])
+        mask[mask] = (global_var.PROCESS_DATA_START_TIME <= hours) & (hours <= global_var.PROCESS_DATA_END_TIME)
+
+    return mask
+
+
+def filter_raw_data(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply all the filters (see get_raw_data_mask) to the raw data and drop the empty column.
+
+    Parameters
+    ----------
+    data: DataFrame
+        The raw data, with the columns in RAW_DATA_COLUMNS
+
+    Returns
+    -------
+    DataFrame: The filtered data.
+    """
+    data = data[get_raw_data_mask(data)]
+    data = data.drop(columns='empty_columns')
+    if data['route_id_curr'].dtype != np.int64:
+        # read with the nullable dtypes, the rows with missing keys are already removed
+        data = data.astype({'vehicle_id': 'int64', 'route_id_curr': 'int64', 'location time': 'int64'})
+    return data
+
+
+def load_data_file(data_path: Path, columns: List[str]) -> pd.DataFrame:
+    """
+    Load and filter one raw data file.
+
+    Parameters
+    ----------
+    data_path: Path
+        The path of the data file to load
+
+    columns: List[str]
+        A list of strings denote the headers of each column.
+
+    Returns
+    -------
+    DataFrame: The DataFrame obj that contains the data.
+    """
+
+    data = read_raw_data_csv(data_path, columns)
 
-    # filter time
-    data = data[data.apply(lambda row: not pd.isna(row['location time']) and global_var.PROCESS_DATA_START_TIME <=
-                                       datetime.fromtimestamp(row['location time']).hour <=
-                                       global_var.PROCESS_DATA_END_TIME, axis=1)]
+    return filter_raw_data(data)
 
+
+def parse_raw_data_contents(contents: List[bytes], source_names: List[str], columns: List[str]) -> pd.DataFrame:
+    """
+    Parse and filter the contents of several raw data files with a single CSV parse.
+
+    Every line is prefixed with the index of its file, so that the SOURCE_FILE_COLUMN of the result tells which file
+    each row comes from. Blank lines are skipped.
+
+    Parameters
+    ----------
+    contents: List[bytes]
+        The content of each raw data file
+
+    source_names: List[str]
+        The name of each raw data file, in the same order as contents. Should be unique.
+
+    columns: List[str]
+        A list of strings denote the headers of each column.
+
+    Returns
+    -------
+    DataFrame: The DataFrame obj that contains the data of all the files, with an extra categorical column
+               SOURCE_FILE_COLUMN.
+    """
+    buffer = io.BytesIO()
+    for source_index, content in enumerate(contents):
+        prefix = b"%d," % source_index
+        buffer.write(b"".join([prefix + line + b"\n" for line in content.splitlines() if line.strip()]))
+
+    if buffer.tell() == 0:
+        return pd.DataFrame(columns=[SOURCE_FILE_COLUMN] + [name for name in columns if name != 'empty_columns'])
+    buffer.seek(0)
+
+    data = filter_raw_data(read_raw_data_csv(buffer, [SOURCE_FILE_COLUMN] + columns))
+    data[SOURCE_FILE_COLUMN] = pd.Categorical.from_codes(data[SOURCE_FILE_COLUMN].to_numpy(dtype='int64'),
+                                                         categories=source_names)
     return data
 
 
-def merge_data_files(columns: List[str], data_root: Path, all_in_one_file: Path, min_file_size):
+def read_data_sources(data_sources: list) -> List[bytes]:
+    """
+    Read the content of each raw data source.
+
+    Parameters
+    ----------
+    data_sources: list
+        Each data source is either the Path of a raw data file, or a tuple (archive path, member name) for a raw data
+        file inside a zip archive. The member is decompressed in memory, nothing is extracted to the disk. Each archive
+        is only opened once.
+
+    Returns
+    -------
+    List[bytes]: The content of each data source, in the same order as data_sources.
+    """
+    contents = []
+    archives = {}
+    try:
+        for data_source in data_sources:
+            if isinstance(data_source, tuple):
+                archive_path, member_name = data_source
+                if archive_path not in archives:
+                    archives[archive_path] = zipfile.ZipFile(archive_path, 'r')
+                contents.append(archives[archive_path].read(member_name))
+            else:
+                with open(data_source, 'rb') as f:
+                    contents.append(f.read())
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return contents
+
+
+def get_data_source_name(data_source) -> str:
+    """
+    Get the name of a data source (see read_data_sources) for SOURCE_FILE_COLUMN.
+    """
+    if isinstance(data_source, tuple):
+        return "{}/{}".format(*data_source)
+    return str(data_source)
+
+
+def load_data_files(data_sources: list, columns: List[str]) -> pd.DataFrame:
+    """
+    Load and filter a batch of raw data files, the result keeps the order of data_sources.
+
+    The files are concatenated in memory and parsed once (see parse_raw_data_contents), as each file only has a few
+    dozen lines. If the files do not have the same number of columns, they are parsed one by one instead.
+    This is also the task of each worker process in merge_data_files.
+
+    Parameters
+    ----------
+    data_sources: list
+        The data files to load, either Path or (archive path, member name), see read_data_sources.
+
+    columns: List[str]
+        A list of strings denote the headers of each column.
+
+    Returns
+    -------
+    DataFrame: The DataFrame obj that contains the data of all the files, with an extra categorical column
+               SOURCE_FILE_COLUMN.
+    """
+    contents = read_data_sources(data_sources)
+    source_names = [get_data_source_name(data_source) for data_source in data_sources]
+
+    try:
+        return parse_raw_data_contents(contents, source_names, columns)
+    except pd.errors.ParserError:
+        # some file has extra columns
+        all_data = [parse_raw_data_contents([content], [source_name], columns)
+                    for content, source_name in zip(contents, source_names)]
+        data = pd.concat(all_data, ignore_index=True)
+        data[SOURCE_FILE_COLUMN] = data[SOURCE_FILE_COLUMN].astype(pd.CategoricalDtype(source_names))
+        return data
+
+
+def split_into_shards(items: list, shard_count: int) -> List[list]:
+    """
+    Split the items into at most shard_count contiguous shards of (almost) the same size.
+
+    Parameters
+    ----------
+    items: list
+        The items to split
+
+    shard_count: int
+        The number of the shards
+
+    Returns
+    -------
+    List[list]: the shards, in the same order as items
+    """
+    shard_count = max(1, min(shard_count, len(items)))
+    shard_size, remainder = divmod(len(items), shard_count)
+    shards = []
+    start = 0
+    for i in range(shard_count):
+        end = start + shard_size + (1 if i < remainder else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+
+def list_data_sources(data_root: Path, min_file_size: int, archive_file: Path = None, verbose: bool = True) -> list:
+    """
+    List the raw data files of one day, sorted by the file name.
+
+    Parameters
+    ----------
+    data_root: Path
+        The Path of the data directory, it is fine if it does not exist when archive_file is given.
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    archive_file: Path, default is None
+        The zip archive of the raw data. The members of the archive are listed as (archive path, member name), a file
+        under data_root that has the same name as a member is ignored.
+
+    verbose: bool, default is True
+        Print the number of files that are too small.
+
+    Returns
+    -------
+    list: The data sources, see read_data_sources.
+    """
+    data_sources = {}
+    small_file_count = 0
+    if archive_file is not None:
+        with zipfile.ZipFile(archive_file, 'r') as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                # the file might be empty, if so, ignore it
+                if member.file_size <= min_file_size:
+                    small_file_count += 1
+                    continue
+                data_sources[os.path.basename(member.filename)] = (str(archive_file), member.filename)
+
+    if data_root.is_dir():
+        for data_filename in os.listdir(data_root):
+            if data_filename in data_sources:
+                continue
+            data_path = data_root / data_filename
+            # the file might be empty, if so, ignore it
+            if os.stat(data_path).st_size <= min_file_size:
+                small_file_count += 1
+                continue
+            data_sources[data_filename] = data_path
+
+    if verbose and small_file_count > 0:
+        print("number of too small files: {}".format(small_file_count))
+
+    return [data_sources[name] for name in sorted(data_sources)]
+
+
+def select_day_data(all_in_one: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn the loaded raw data into the merged data of one day: sorted, rounded, with a datetime column, and only the
+    columns in helper.day_data.DAY_DATA_COLUMNS, without duplicated rows.
+
+    Parameters
+    ----------
+    all_in_one: DataFrame
+        The return of load_data_files
+
+    Returns
+    -------
+    DataFrame: the merged data
+    """
+    # print("sorting..")
+    all_in_one = all_in_one.sort_values(by=['vehicle_id', 'route_id_curr', 'direction', 'location time'])
+
+    all_in_one['X'] = all_in_one['X'].apply(lambda x: round(x, 6))
+    all_in_one['Y'] = all_in_one['Y'].apply(lambda x: round(x, 6))
+
+    all_in_one['datetime'] = all_in_one['location time'].apply(lambda x: datetime.fromtimestamp(x))
+
+    all_in_one_selected = all_in_one[['vehicle_id', 'route_id_curr', 'direction', 'block_id', 'next_tp_est',
+                                      'next_tp_sname', 'next_tp_sched', 'X', 'Y', 'location time', 'datetime']]
+
+    return all_in_one_selected.drop_duplicates()
+
+
+def merge_data_files(columns: List[str], data_root: Path, all_in_one_file: Path, min_file_size,
+                     workers: int = global_var.PROCESS_DATA_WORKERS,
+                     batch_size: int = global_var.PROCESS_DATA_BATCH_SIZE,
+                     archive_file: Path = None):
     """
     Merge all files under one directory and save the result to the given file.
 
@@ -86,25 +436,43 @@ def merge_data_files(columns: List[str], data_root: Path, all_in_one_file: Path,
         The Path of the data directory
 
     all_in_one_file: Path
-        The full path of the file to store the merged data.
+        The full path of the file to store the merged data. The format is decided by the suffix, .csv, .parquet or
+        .feather, see helper/day_data.py
+
+    min_file_size: int
+        Ignore files whose size is smaller than this limit. Unit is byte.
+
+    workers: int, default is PROCESS_DATA_WORKERS
+        The number of processes used to load the files. If it is 1, all files are loaded in the current process.
+        Each worker loads a contiguous shard of the sorted file list, so the merged result is the same as loading them
+        one by one. When reading from archive_file, each worker decompresses its own shard.
+
+    batch_size: int, default is PROCESS_DATA_BATCH_SIZE
+        The number of files parsed together in one CSV parse when workers is 1. See load_data_files.
+
+    archive_file: Path, default is None
+        If given, the files are also read directly from this zip archive (raw_yyyyMMdd.zip) without extracting it.
+        See list_data_sources.
     """
     # print(f"\nstart merging data under {data_root}")
     # print("loading...")
     data_root = Path(data_root)
+    data_sources = list_data_sources(data_root, min_file_size, archive_file)
+
     all_data = []
-    small_file_count = 0
-    for data_filename in tqdm(sorted(os.listdir(data_root)), desc="Merging {}".format(data_root), unit="file",
-                              position=1):
-        data_path = data_root / data_filename
-        # the file might be empty, if so, ignore it
-        if os.stat(data_path).st_size <= min_file_size:
-            small_file_count += 1
-            continue
-        data = load_data_file(data_path, columns)
-        all_data.append(data)
-
-    if small_file_count > 0:
-        print("number of too small files: {}".format(small_file_count))
+    if workers > 1:
+        # several shards per worker, so that the progress bar moves and a slow shard does not hold the others
+        shards = split_into_shards(data_sources, workers * 4)
+        with multiprocessing.Pool(workers) as pool:
+            for data in tqdm(pool.imap(functools.partial(load_data_files, columns=columns), shards),
+                             total=len(shards), desc="Merging {}".format(data_root), unit="shard", position=1):
+                all_data.append(data)
+    else:
+        with tqdm(total=len(data_sources), desc="Merging {}".format(data_root), unit="file", position=1) as progress:
+            for start in range(0, len(data_sources), batch_size):
+                batch = data_sources[start:start + batch_size]
+                all_data.append(load_data_files(batch, columns))
+                progress.update(len(batch))
 
     # print("Concatenate..")
     all_in_one = pd.concat(all_data, ignore_index=True)
@@ -116,26 +484,17 @@ def merge_data_files(columns: List[str], data_root: Path, all_in_one_file: Path,
     for key, value in groups.items():
         value = value.sort_values(by=['location time'])
 
-    # print("sorting..")
-    all_in_one = all_in_one.sort_values(by=['vehicle_id', 'route_id_curr', 'direction', 'location time'])
-
-    all_in_one['X'] = all_in_one['X'].apply(lambda x: round(x, 6))
-    all_in_one['Y'] = all_in_one['Y'].apply(lambda x: round(x, 6))
-
-    all_in_one['datetime'] = all_in_one['location time'].apply(lambda x: datetime.fromtimestamp(x))
-
-    all_in_one_selected = all_in_one[['vehicle_id', 'route_id_curr', 'direction', 'block_id', 'next_tp_est',
-                                      'next_tp_sname', 'next_tp_sched', 'X', 'Y', 'location time', 'datetime']]
-
-    all_in_one_selected = all_in_one_selected.drop_duplicates()
+    all_in_one_selected = select_day_data(all_in_one)
 
     # print(f"saving to {all_in_one_file}")
-    all_in_one_selected.to_csv(all_in_one_file, index=False)
+    write_day_data(all_in_one_selected, all_in_one_file)
 
 
 def preprocess_data(date_str: str, overwrite: bool = False, min_file_size: int = 10,
                     archive_after_preprocess: bool = False,
-                    skip_if_archived: bool = False) -> None:
+                    skip_if_archived: bool = False,
+                    workers: int = global_var.PROCESS_DATA_WORKERS,
+                    day_data_format: int = global_var.PROCESS_DATA_DAY_DATA_FORMAT) -> None:
     """
     Preprocess data under given directory.
 
@@ -150,6 +509,21 @@ def preprocess_data(date_str: str, overwrite: bool = False, min_file_size: int =
     min_file_size: int, default is 10
         Ignore files whose size is smaller than this limit. Unit is byte.
 
+    archive_after_preprocess: bool, default is False
+        If True, move the raw data files into raw_yyyyMMdd.zip after preprocess (except today's data).
+
+    skip_if_archived: bool, default is False
+        If True, ignore raw_yyyyMMdd.zip and only use the files under data/yyyyMMdd/raw.
+        Otherwise, the members of the archive are read directly from the zip file, nothing is extracted.
+
+    workers: int, default is PROCESS_DATA_WORKERS
+        The number of processes used to load the raw data files. See merge_data_files.
+
+    day_data_format: int, default is PROCESS_DATA_DAY_DATA_FORMAT
+        The format of the merged data file, DAY_DATA_FORMAT_CSV (data/yyyyMMdd/yyyyMMdd.csv),
+        DAY_DATA_FORMAT_PARQUET (data/yyyyMMdd/yyyyMMdd.parquet)
+        or DAY_DATA_FORMAT_FEATHER (data/yyyyMMdd/yyyyMMdd.feather)
+
     Returns:
     --------
     None
@@ -157,18 +531,17 @@ def preprocess_data(date_str: str, overwrite: bool = False, min_file_size: int =
     # print(f"Start preprocessing: {data_root}, overwrite: {overwrite}")
     # print(f"ignore files whose size is smaller than {min_file_size} byte.")
 
-    columns = ['vehicle_id', 'route_id_curr', 'direction', 'block_id', 'service_type', 'deviation', 'next_tp_est',
-               'next_tp_sname', 'next_tp_sched', 'X', 'Y', 'location time', 'route logon id', 'block_num',
-               'off route', 'run_id', 'empty_columns']
+    columns = list(RAW_DATA_COLUMNS)
 
     full_path = Path(global_var.CONFIG_RAW_DATA_FOLDER.format(date_str))
-    if full_path.is_dir() or archive_zip_file_exist(date_str):
-        merged_file = Path(global_var.CONFIG_ALL_DAY_RAW_DATA_FILE.format(date_str))
+    archive_file = None
+    if (not skip_if_archived) and archive_zip_file_exist(date_str):
+        archive_file = Path(global_var.CONFIG_ALL_DAY_ARCHIVED_RAW_DATA_FILE.format(date_str))
+    if full_path.is_dir() or archive_file is not None:
+        merged_file = get_day_data_file(date_str, day_data_format)
         if not merged_file.is_file() or overwrite:
-            if (not skip_if_archived) and archive_zip_file_exist(date_str):
-                archive_unzip(date_str)
-            merge_data_files(columns, full_path, merged_file, min_file_size)
-            if archive_after_preprocess and date_str != (datetime.today()).strftime('%Y%m%d'):
+            merge_data_files(columns, full_path, merged_file, min_file_size, workers=workers, archive_file=archive_file)
+            if archive_after_preprocess and date_str != (datetime.today()).strftime('%Y%m%d') and full_path.is_dir():
                 archive_raw_data(date_str)
         else:
             print(f"Ignore {full_path} as this folder has already processed")
@@ -177,21 +550,19 @@ def preprocess_data(date_str: str, overwrite: bool = False, min_file_size: int =
 def archive_raw_data(date_str):
     raw_path = global_var.CONFIG_RAW_DATA_FOLDER.format(date_str)
     zip_path = global_var.CONFIG_ALL_DAY_ARCHIVED_RAW_DATA_FILE.format(date_str)
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_LZMA) as z:
+    # If the day is already archived, only add the files that are not in the archive yet
+    mode = "a" if os.path.isfile(zip_path) else "w"
+    with zipfile.ZipFile(zip_path, mode, zipfile.ZIP_LZMA) as z:
+        archived_names = set(z.namelist())
         for path, dir_names, filenames in os.walk(raw_path):
             fpath = path.replace(raw_path, '')
             for filename in tqdm(filenames):
+                if os.path.join(fpath, filename) in archived_names:
+                    continue
                 z.write(os.path.join(path, filename), os.path.join(fpath, filename))
     shutil.rmtree(raw_path)
 
 
-def archive_unzip(date_str):
-    raw_path = global_var.CONFIG_RAW_DATA_FOLDER.format(date_str)
-    zip_path = global_var.CONFIG_ALL_DAY_ARCHIVED_RAW_DATA_FILE.format(date_str)
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(raw_path)
-
-
 def archive_zip_file_exist(date_str):
     return Path(global_var.CONFIG_ALL_DAY_ARCHIVED_RAW_DATA_FILE.format(date_str)).is_file()
 
@@ -210,7 +581,7 @@ def get_routes_from_file(data_file: Path):
     -------
     set[int]: A set of routes
     """
-    data = pd.read_csv(data_file, sep=",")
+    data = read_day_data(data_file, columns=['route_id_curr'])
     routes = set(data['route_id_curr'].values.tolist())
     return routes
 
@@ -231,7 +602,7 @@ def routes_showing_up(data_root=global_var.CONFIG_DATA_FOLDER):
         full_name_without_sub_folder = data_root / name
         if os.path.isdir(full_name_without_sub_folder):
             for sub_folder_name in os.listdir(full_name_without_sub_folder):
-                re_result = re.match(r"[0-9]{8}\.csv", str(sub_folder_name))
+                re_result = re.match(r"[0-9]{8}\.(csv|parquet|feather)$", str(sub_folder_name))
                 full_name = full_name_without_sub_folder / sub_folder_name
                 if re_result is None:
                     print("Skip file", full_name)
@@ -259,13 +630,20 @@ def data_statistic(data_root=global_var.CONFIG_DATA_FOLDER):
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage:")
-        print("process_data.py <date_str>")
+        print("process_data.py <date_str> <workers>")
         print("")
         print("Require:")
         print("date_str       : 8 digit number of the date_str")
         print("             it is the folder name in data/")
+        print("")
+        print("Optional:")
+        print("workers        : the number of processes used to load the raw data files")
+        print("             by default is: {}".format(global_var.PROCESS_DATA_WORKERS))
         exit(0)
     date = sys.argv[1]
+    workers = global_var.PROCESS_DATA_WORKERS
+    if len(sys.argv) >= 3:
+        workers = int(sys.argv[2])
     print(date)
-    preprocess_data(date, overwrite=True, min_file_size=10)
+    preprocess_data(date, overwrite=True, min_file_size=10, workers=workers)
     # data_statistic()
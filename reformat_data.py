@@ -4,7 +4,11 @@ import shutil
 import sys
 from pathlib import Path
 
-from helper.global_var import CONFIG_ALL_DAY_RAW_DATA_FILE, CONFIG_SINGLE_DAY_FOLDER
+import numpy as np
+import pandas as pd
+
+from helper.day_data import DAY_DATA_COLUMNS, find_day_data_file, read_day_data
+from helper.global_var import CONFIG_SINGLE_DAY_FOLDER
 
 
 def reformat_by_bus(date_str):
@@ -25,10 +29,22 @@ def reformat_by_bus(date_str):
     root = Path(CONFIG_SINGLE_DAY_FOLDER.format(date_str))
     unsorted_dir = root / "unsorted"
     unsorted_dir.mkdir(parents=True, exist_ok=True)
+
+    day_data_file = find_day_data_file(date_str)
+    if day_data_file is None:
+        raise FileNotFoundError("data/{0}/{0}.csv (or .parquet/.feather) does not exist".format(date_str))
+
+    if day_data_file.suffix != ".csv":
+        # columnar format, the data is already sorted by vehicle
+        data = read_day_data(day_data_file, columns=DAY_DATA_COLUMNS)
+        for bus_id, bus_data in data.groupby('vehicle_id', sort=False):
+            bus_data.to_csv(unsorted_dir / "{}.csv".format(bus_id), header=False, index=False)
+        return 0
+
     output = {}
     csv_writers = {}
 
-    with open(CONFIG_ALL_DAY_RAW_DATA_FILE.format(date_str), "r", newline='') as csv_file:
+    with open(day_data_file, "r", newline='') as csv_file:
         reader_csv_file = csv.reader(csv_file)
 
         for row in reader_csv_file:
@@ -54,6 +70,9 @@ def sort_reformat_data(date):
 
     This code sorts all of the separated bus data by time.
 
+    find_traffic_speed does not need these files anymore (see group_by_bus), reformat_by_bus and sort_reformat_data
+    are only kept to export data/<date>/sorted for debugging.
+
     Parameters
     ----------
     date: string
@@ -81,11 +100,149 @@ def sort_reformat_data(date):
     return 0
 
 
+def get_seconds_of_day(datetime_column: pd.Series) -> np.ndarray:
+    """
+    Get the seconds since midnight of each value in the datetime column of the merged data.
+
+    Parameters
+    ----------
+    datetime_column: Series
+        The datetime column, either datetime64 (columnar formats) or string in "%Y-%m-%d %H:%M:%S" format (csv)
+
+    Returns
+    -------
+    np.ndarray: int64 array of the seconds since midnight
+    """
+    if not pd.api.types.is_datetime64_any_dtype(datetime_column):
+        datetime_column = pd.to_datetime(datetime_column, format="%Y-%m-%d %H:%M:%S")
+    return (datetime_column.dt.hour * 3600 + datetime_column.dt.minute * 60 + datetime_column.dt.second) \
+        .to_numpy(dtype=np.int64)
+
+
+def group_by_bus(date_str):
+    """
+    Group the merged data of one day by bus in memory, each bus' data is sorted by time.
+
+    This gives the same data as reformat_by_bus followed by sort_reformat_data, without writing any file.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date. It should be a folder name in data
+
+    Returns
+    -------
+    Generator of (bus_id, trace), ordered by bus_id. trace is a dictionary of numpy arrays, all with the same length:
+        "route_id": int64, route_id_curr
+        "lat": float64, latitude (X)
+        "lng": float64, longitude (Y)
+        "total_seconds": int64, seconds since midnight of the location time
+        "location_time": int64, the location time (unix timestamp)
+    """
+    day_data_file = find_day_data_file(date_str)
+    if day_data_file is None:
+        raise FileNotFoundError("data/{0}/{0}.csv (or .parquet/.feather) does not exist".format(date_str))
+
+    data = read_day_data(day_data_file, columns=['vehicle_id', 'route_id_curr', 'X', 'Y', 'location time',
+                                                 'datetime'])
+    return group_data_by_bus(data)
+
+
+def group_data_by_bus(data: pd.DataFrame):
+    """
+    Group the merged data by bus in memory, each bus' data is sorted by time. See group_by_bus.
+
+    Parameters
+    ----------
+    data: DataFrame
+        The merged data, with at least the columns vehicle_id, route_id_curr, X, Y, location time and datetime
+
+    Returns
+    -------
+    Generator of (bus_id, trace), see group_by_bus
+    """
+    # stable sort, the rows with the same time keep the order in the merged file as sort_reformat_data does
+    data = data.sort_values(by=['vehicle_id', 'location time'], kind='stable')
+
+    vehicle_ids = data['vehicle_id'].to_numpy(dtype=np.int64)
+    route_ids = data['route_id_curr'].to_numpy(dtype=np.int64)
+    lats = data['X'].to_numpy(dtype=np.float64)
+    lngs = data['Y'].to_numpy(dtype=np.float64)
+    total_seconds = get_seconds_of_day(data['datetime'])
+    location_times = data['location time'].to_numpy(dtype=np.int64)
+
+    boundaries = np.flatnonzero(np.diff(vehicle_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(vehicle_ids)]])
+    for start, end in zip(starts, ends):
+        if start == end:
+            continue
+        yield int(vehicle_ids[start]), {"route_id": route_ids[start:end], "lat": lats[start:end],
+                                        "lng": lngs[start:end], "total_seconds": total_seconds[start:end],
+                                        "location_time": location_times[start:end]}
+
+
+def read_sorted_bus_files(date_str):
+    """
+    Read the data of each bus from data/<date_str>/sorted, i.e., the output of sort_reformat_data.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date. It should be a folder name in data
+
+    Returns
+    -------
+    Generator of (bus_id, trace), see group_by_bus
+    """
+    sorted_dir = Path(CONFIG_SINGLE_DAY_FOLDER.format(date_str)) / "sorted"
+    for filename in sorted(os.listdir(sorted_dir)):
+        route_ids = []
+        lats = []
+        lngs = []
+        total_seconds = []
+        with open(sorted_dir / filename, "r", newline='') as csv_file:
+            for temp_line in csv.reader(csv_file):
+                route_ids.append(int(temp_line[1]))
+                lats.append(float(temp_line[7]))
+                lngs.append(float(temp_line[8]))
+                total_seconds.append(int(temp_line[10][11:13]) * 3600 + int(temp_line[10][14:16]) * 60 +
+                                     int(temp_line[10][17:19]))
+        yield Path(filename).stem, {"route_id": np.array(route_ids, dtype=np.int64),
+                                    "lat": np.array(lats, dtype=np.float64),
+                                    "lng": np.array(lngs, dtype=np.float64),
+                                    "total_seconds": np.array(total_seconds, dtype=np.int64)}
+
+
+def load_bus_traces(date_str):
+    """
+    Get the time sorted data of each bus for find_traffic_speed.
+
+    The data is grouped in memory from the merged data file (see group_by_bus). Only if the merged data file does not
+    exist, the files under data/<date_str>/sorted are used, e.g., the days processed by an older version.
+
+    Parameters
+    ----------
+    date_str: string
+        8 digit number of the date. It should be a folder name in data
+
+    Returns
+    -------
+    Generator of (bus_id, trace), see group_by_bus
+    """
+    if find_day_data_file(date_str) is None and (Path(CONFIG_SINGLE_DAY_FOLDER.format(date_str)) / "sorted").is_dir():
+        return read_sorted_bus_files(date_str)
+    return group_by_bus(date_str)
+
+
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print("Usage:")
         print("reformat_data.py <date_str>")
         print("")
+        print("Export the data of each bus to data/<date_str>/sorted for debugging,")
+        print("find_traffic_speed.py groups the data in memory and does not need these files.")
+        print("")
         print("Require:")
         print("date_str       : 8 digit number of the date_str")
         print("             it is the folder name in data/")
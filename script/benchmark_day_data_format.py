@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append('./')
+from helper.day_data import find_day_data_file, read_day_data, write_day_data
+
+# The columns needed by the later stages, e.g., find_traffic_speed
+PROJECTED_COLUMNS = ['vehicle_id', 'route_id_curr', 'X', 'Y', 'location time']
+
+
+def benchmark_read(day_data_file, columns=None, repeat=5):
+    start_time = time.time()
+    for i in range(repeat):
+        read_day_data(day_data_file, columns=columns)
+    return (time.time() - start_time) / repeat
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/benchmark_day_data_format.py [date_str]")
+        print("")
+        print("Require:")
+        print("date_str       : 8 digit number of the date_str")
+        print("             the day should already be merged by process_data.py")
+        exit(0)
+
+    date_str = sys.argv[1]
+    day_data_file = find_day_data_file(date_str)
+    if day_data_file is None:
+        print("Run process_data.py {} first".format(date_str))
+        exit(0)
+    data = read_day_data(day_data_file)
+
+    print("%d rows" % len(data))
+    print("format  \tsize (KB)\tread all (s)\tread %d columns (s)" % len(PROJECTED_COLUMNS))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for suffix in [".csv", ".parquet", ".feather"]:
+            temp_file = Path(temp_dir) / (date_str + suffix)
+            write_day_data(data, temp_file)
+            print("%s\t%9d\t%12.3f\t%12.3f" % (suffix, os.path.getsize(temp_file) // 1024,
+                                               benchmark_read(temp_file), benchmark_read(temp_file, PROJECTED_COLUMNS)))
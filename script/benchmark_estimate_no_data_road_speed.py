@@ -0,0 +1,110 @@
+import copy
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append('./')
+import predict_road_condition
+from helper.global_var import PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE, \
+    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, SAVE_TYPE_PICKLE
+from helper.graph_reader import graph_reader
+from script.generate_prediction_in_large_batches import road_condition_to_color
+
+
+def get_unfilled_speed_dict_list(interval, history_speed_matrix_list, full_way_id_set, usable_way_id_set,
+                                 config_weight):
+    """
+    The predict_speed_dict of each interval of the day before the ways without data are estimated.
+    """
+    usable_way_ids = list(usable_way_id_set)
+    other_way_ids = list(full_way_id_set - usable_way_id_set)
+    history_speed_tensor = predict_road_condition.get_history_speed_tensor(history_speed_matrix_list, usable_way_ids)
+    speed_matrix, no_data_matrix = predict_road_condition.compute_speed_array(
+        np.arange(int(1440 / interval)), history_speed_tensor, PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
+        config_weight)
+    return [predict_road_condition.get_predict_speed_dict(usable_way_ids, speeds, no_data, other_way_ids)
+            for speeds, no_data in zip(speed_matrix.T.tolist(), no_data_matrix.T.tolist())]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/benchmark_estimate_no_data_road_speed.py [date_str] <interval>")
+        print("")
+        print("Compare the modes of predict_road_condition.estimate_no_data_road_speed_matrix with")
+        print("estimate_no_data_road_speed_using_BFS on all the intervals of a day. Fails if the bfs mode")
+        print("does not give exactly the same speeds.")
+        print("")
+        print("Require:")
+        print("date_str       : 8 digit number of the date_str to predict")
+        print("             the result of the history days (see PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE)")
+        print("             should exist in data/")
+        print("")
+        print("Optional:")
+        print("interval       : the length of each time interval in minutes, by default is 15")
+        exit(0)
+
+    predict_time = datetime.strptime(sys.argv[1], "%Y%m%d")
+    interval = 15
+    if len(sys.argv) >= 3:
+        interval = int(sys.argv[2])
+
+    history_data_date_str = [(predict_time + timedelta(days=offset)).strftime("%Y%m%d")
+                             for offset in PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE]
+    history_speed_matrix_list, config_weight = predict_road_condition.get_history_speed_matrix_list(
+        history_data_date_str, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, interval, "data/{0}/result/{0}_{1}_min_road.csv")
+    if len(history_speed_matrix_list) == 0:
+        print("No history data for {}".format(sys.argv[1]))
+        exit(0)
+    full_way_id_set, usable_way_id_set = predict_road_condition.get_way_id_set(history_speed_matrix_list)
+    unfilled_speed_dict_list = get_unfilled_speed_dict_list(interval, history_speed_matrix_list, full_way_id_set,
+                                                            usable_way_id_set, config_weight)
+
+    save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit"]
+    way_graph, way_types, way_type_avg_speed_limit = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
+
+    start_time = time.time()
+    reference = [predict_road_condition.estimate_no_data_road_speed_using_BFS(predict_speed_dict, way_graph,
+                                                                              way_types, way_type_avg_speed_limit)
+                 for predict_speed_dict in copy.deepcopy(unfilled_speed_dict_list)]
+    reference_time = time.time() - start_time
+
+    start_time = time.time()
+    way_graph_index = predict_road_condition.get_way_graph_index(way_graph, way_types, way_type_avg_speed_limit)
+    index_time = time.time() - start_time
+
+    print("{} intervals, {} ways in way_graph".format(len(unfilled_speed_dict_list), len(way_graph)))
+    print("build index: %.3fs" % index_time)
+    print("estimate_no_data_road_speed_using_BFS: %.3fs" % reference_time)
+    for mode in ["bfs", "sparse"]:
+        start_time = time.time()
+        results = predict_road_condition.estimate_no_data_road_speed_dict_list(
+            copy.deepcopy(unfilled_speed_dict_list), way_graph_index, mode)
+        mode_time = time.time() - start_time
+
+        speed_differences = []
+        color_mismatch = 0
+        missing_way = 0
+        for reference_dict, result_dict in zip(reference, results):
+            missing_way += len(reference_dict.keys() ^ result_dict.keys())
+            for way, speed in reference_dict.items():
+                if way not in result_dict or result_dict[way] == speed:
+                    continue
+                speed_differences.append(abs(result_dict[way] - speed))
+                speed_limit = way_type_avg_speed_limit[way_types.get(way, "unclassified")]
+                if speed_limit > 0 and road_condition_to_color(speed / speed_limit) != \
+                        road_condition_to_color(result_dict[way] / speed_limit):
+                    color_mismatch += 1
+
+        print("")
+        print("mode {}: %.3fs (%.1fx)".format(mode) % (mode_time, reference_time / mode_time))
+        print("ways only in one result: {}".format(missing_way))
+        print("different speeds: {}, different colors: {}".format(len(speed_differences), color_mismatch))
+        if len(speed_differences) > 0:
+            print("speed difference: mean %.3f, max %.3f" % (np.mean(speed_differences), np.max(speed_differences)))
+        # The "bfs" mode is the reference, it must give exactly the result of estimate_no_data_road_speed_using_BFS
+        if mode == "bfs" and (missing_way > 0 or len(speed_differences) > 0):
+            raise AssertionError("mode bfs differs from estimate_no_data_road_speed_using_BFS")
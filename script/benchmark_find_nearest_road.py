@@ -0,0 +1,86 @@
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append('./')
+from find_nearest_road import build_way_index, find_nearest_road, find_nearest_road_batch, \
+    get_bus_route_to_relation_index, get_possible_relations
+from helper.global_var import SAVE_TYPE_PICKLE
+from helper.graph_reader import graph_reader
+from reformat_data import load_bus_traces
+
+
+def get_sample_points(date_str, final_relation_table, bus_route_to_relation_index, max_points):
+    points = []
+    for bus_id, trace in load_bus_traces(date_str):
+        for route_id, lat, lng in zip(trace["route_id"].tolist(), trace["lat"].tolist(), trace["lng"].tolist()):
+            possible_relations = get_possible_relations(route_id, bus_route_to_relation_index, final_relation_table)
+            if len(possible_relations) > 0:
+                points.append((route_id, possible_relations, [lat, lng]))
+    step = max(1, len(points) // max_points)
+    return points[::step][:max_points]
+
+
+def benchmark(points, final_node_table, final_way_table, final_relation_table, way_index):
+    start_time = time.time()
+    results = [find_nearest_road(final_node_table, final_way_table, final_relation_table, possible_relations,
+                                 datapoint, way_index=way_index) for route_id, possible_relations, datapoint in points]
+    return results, time.time() - start_time
+
+
+def benchmark_batch(points, final_node_table, final_way_table, final_relation_table, bus_route_to_relation_index,
+                    way_index):
+    start_time = time.time()
+    projections, ways = find_nearest_road_batch(final_node_table, final_way_table, final_relation_table,
+                                                np.array([point[0] for point in points]),
+                                                np.array([point[2][0] for point in points]),
+                                                np.array([point[2][1] for point in points]),
+                                                bus_route_to_relation_index, way_index=way_index)
+    results = list(zip(projections.tolist(), ways.tolist()))
+    return results, time.time() - start_time
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/benchmark_find_nearest_road.py [date_str] <number of points>")
+        print("")
+        print("Require:")
+        print("date_str       : 8 digit number of the date_str, the GPS points of this day are used")
+        print("")
+        print("Optional:")
+        print("number of points: by default is 5000")
+        exit(0)
+
+    date_str = sys.argv[1]
+    max_points = 5000
+    if len(sys.argv) >= 3:
+        max_points = int(sys.argv[2])
+
+    save_filename_list = ["final_node_table", "final_way_table", "final_relation_table"]
+    final_node_table, final_way_table, final_relation_table = graph_reader(Path("graph"), SAVE_TYPE_PICKLE,
+                                                                           save_filename_list)
+    bus_route_to_relation_index = get_bus_route_to_relation_index(final_relation_table)
+    points = get_sample_points(date_str, final_relation_table, bus_route_to_relation_index, max_points)
+
+    start_time = time.time()
+    way_index = build_way_index(final_node_table, final_way_table, final_relation_table)
+    print("build index: %.3fs" % (time.time() - start_time))
+
+    linear_results, linear_time = benchmark(points, final_node_table, final_way_table, final_relation_table, None)
+    index_results, index_time = benchmark(points, final_node_table, final_way_table, final_relation_table, way_index)
+    batch_results, batch_time = benchmark_batch(points, final_node_table, final_way_table, final_relation_table,
+                                                bus_route_to_relation_index, way_index)
+
+    print("%d points" % len(points))
+    print("linear search: %.3fs, %.0f points/s" % (linear_time, len(points) / linear_time))
+    print("grid index   : %.3fs, %.0f points/s (%.1fx)" % (index_time, len(points) / index_time,
+                                                          linear_time / index_time))
+    print("batch        : %.3fs, %.0f points/s (%.1fx)" % (batch_time, len(points) / batch_time,
+                                                          linear_time / batch_time))
+    mismatch = sum(1 for a, b in zip(linear_results, index_results) if a != b)
+    print("grid index mismatch: %d" % mismatch)
+    mismatch = sum(1 for a, b in zip(linear_results, batch_results) if a != b)
+    print("batch mismatch: %d" % mismatch)
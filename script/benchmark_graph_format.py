@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append('./')
+from helper.compact_graph import COMPACT_GRAPH_ARRAYS, COMPACT_GRAPH_SOURCES, build_compact_graph, \
+    load_compact_graph, save_compact_graph
+from helper.global_var import CONFIG_COMPACT_GRAPH_FILE, SAVE_TYPE_JSON, SAVE_TYPE_NUMPY, SAVE_TYPE_PICKLE
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX
+from helper.graph_reader import graph_reader
+from helper.graph_writer import graph_writer
+from script.generate_prediction_in_large_batches import get_output_dict, get_output_dict_from_compact_graph
+
+# All the files made by osm_interpreter.py
+GRAPH_FILES = ["final_node_table", "final_way_table", "final_relation_table", "relations", "way_graph", "way_types",
+               "way_type_avg_speed_limit"]
+
+
+def benchmark_load(load, repeat=5):
+    """
+    The average time of load(), and the memory allocated by Python for its return (the memory-mapped files are not
+    counted, they are only read when used and shared by the processes).
+    """
+    start_time = time.time()
+    for i in range(repeat):
+        load()
+    load_time = (time.time() - start_time) / repeat
+
+    tracemalloc.start()
+    result = load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return load_time, memory
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print("Usage:")
+        print("./script/benchmark_graph_format.py [graph path]")
+        print("")
+        print("Optional:")
+        print("graph path : the folder of the graph files (pickle) made by osm_interpreter.py, by default is: graph/")
+        exit(0)
+
+    graph_path = Path(sys.argv[1]) if len(sys.argv) == 2 else Path("graph")
+
+    graph_tables = graph_reader(graph_path, SAVE_TYPE_PICKLE, COMPACT_GRAPH_SOURCES)
+    start_time = time.time()
+    compact_graph_arrays = build_compact_graph(*graph_tables)
+    print("compact graph built in {:.3f}s, {} KB of arrays".format(
+        time.time() - start_time, sum(compact_graph_arrays[name].nbytes for name in COMPACT_GRAPH_ARRAYS) // 1024))
+    save_compact_graph(compact_graph_arrays, graph_path)
+
+    # All the tables in each format, and the compact graph (the node, way, way type and way graph tables as arrays)
+    print("format  	size (KB)	load (s)	memory (KB)")
+    all_graph_tables = graph_reader(graph_path, SAVE_TYPE_PICKLE, GRAPH_FILES)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for format_name, save_type, suffix in [("pickle", SAVE_TYPE_PICKLE, ".p"), ("JSON", SAVE_TYPE_JSON, ".json"),
+                                               ("numpy", SAVE_TYPE_NUMPY, GRAPH_BUNDLE_SUFFIX)]:
+            graph_writer(Path(temp_dir), save_type, GRAPH_FILES, all_graph_tables)
+            size = sum(os.path.getsize(Path(temp_dir) / (name + suffix)) for name in GRAPH_FILES)
+            load_time, memory = benchmark_load(lambda: graph_reader(Path(temp_dir), save_type, GRAPH_FILES))
+            print("%s  \t%9d\t%8.4f\t%11d" % (format_name, size // 1024, load_time, memory // 1024))
+    size = os.path.getsize(graph_path / (CONFIG_COMPACT_GRAPH_FILE + GRAPH_BUNDLE_SUFFIX))
+    load_time, memory = benchmark_load(lambda: load_compact_graph(graph_path))
+    print("compact \t%9d\t%8.4f\t%11d" % (size // 1024, load_time, memory // 1024))
+
+    # The output of homepage.py for a prediction of all the ways
+    final_node_table, final_way_table, way_types, way_type_avg_speed_limit, way_graph = graph_tables
+    compact_graph = load_compact_graph(graph_path)
+    predict_speed_dict = {way_id: 20.0 + way_id % 30 for way_id in final_way_table}
+    predict_time = datetime.now()
+    output_dict = get_output_dict(predict_speed_dict, predict_time, 15, 0, final_node_table, final_way_table,
+                                  way_types, way_type_avg_speed_limit)
+    compact_output_dict = get_output_dict_from_compact_graph(predict_speed_dict, predict_time, 15, 0, compact_graph)
+    dict_time = benchmark_load(lambda: get_output_dict(predict_speed_dict, predict_time, 15, 0, final_node_table,
+                                                       final_way_table, way_types, way_type_avg_speed_limit))[0]
+    compact_time = benchmark_load(lambda: get_output_dict_from_compact_graph(predict_speed_dict, predict_time, 15, 0,
+                                                                             compact_graph))[0]
+    print("get_output_dict: {:.4f}s with the tables, {:.4f}s with the compact graph, same links: {}".format(
+        dict_time, compact_time, output_dict["links"] == compact_output_dict["links"]))
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append('./')
+import helper.global_var as global_var
+import process_data
+
+
+def load_data_file_row_wise(data_path, columns):
+    """
+    The row-wise implementation of process_data.load_data_file before the filters were vectorized.
+    Only kept here as the baseline of the benchmark.
+    """
+    data = pd.read_csv(data_path, sep=',', header=None)
+    if len(columns) < data.shape[1]:
+        for i in range(data.shape[1] - len(columns)):
+            columns.append("unknown_columns_{}".format(i))
+    data.columns = columns
+    data = data.dropna(subset=["run_id"])
+    data = data.drop(columns='empty_columns')
+    data[["route_id_curr"]] = data[["route_id_curr"]].astype(int)
+    data = data[(data.vehicle_id < 8000) | (data.vehicle_id >= 9000)]
+    data = data[data.route_id_curr != 0]
+    data = data[data.route_id_curr != 17]
+    data = data[data.route_id_curr <= 111]
+    data = data[data.apply(lambda row: not pd.isna(row['location time']) and global_var.PROCESS_DATA_START_TIME <=
+                                       datetime.fromtimestamp(row['location time']).hour <=
+                                       global_var.PROCESS_DATA_END_TIME, axis=1)]
+    return data
+
+
+def benchmark(load_function, data_paths):
+    start_time = time.time()
+    all_data = [load_function(data_path, list(process_data.RAW_DATA_COLUMNS)) for data_path in data_paths]
+    end_time = time.time()
+    return pd.concat(all_data, ignore_index=True), end_time - start_time
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/benchmark_load_data_file.py [date_str] <start hour> <end hour>")
+        print("")
+        print("Require:")
+        print("date_str       : 8 digit number of the date_str")
+        print("             it is the folder name in data/, data/<date_str>/raw should exist")
+        print("")
+        print("Optional:")
+        print("start hour, end hour: override PROCESS_DATA_START_TIME and PROCESS_DATA_END_TIME")
+        exit(0)
+
+    date_str = sys.argv[1]
+    if len(sys.argv) >= 4:
+        global_var.PROCESS_DATA_START_TIME = int(sys.argv[2])
+        global_var.PROCESS_DATA_END_TIME = int(sys.argv[3])
+
+    raw_path = Path(global_var.CONFIG_RAW_DATA_FOLDER.format(date_str))
+    data_paths = [raw_path / filename for filename in sorted(os.listdir(raw_path))
+                  if os.stat(raw_path / filename).st_size > 10]
+
+    row_wise_data, row_wise_time = benchmark(load_data_file_row_wise, data_paths)
+    vectorized_data, vectorized_time = benchmark(process_data.load_data_file, data_paths)
+
+    print("{} files, {} rows kept".format(len(data_paths), len(vectorized_data)))
+    print("row-wise  : %.3fs" % row_wise_time)
+    print("vectorized: %.3fs (%.1fx)" % (vectorized_time, row_wise_time / vectorized_time))
+
+    pd.testing.assert_frame_equal(row_wise_data.reset_index(drop=True), vectorized_data.reset_index(drop=True),
+                                  check_dtype=False)
+    print("Same result")
@@ -0,0 +1,137 @@
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append('./')
+import predict_road_condition
+from helper.global_var import PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE, \
+    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, SAVE_TYPE_PICKLE
+from helper.graph_reader import graph_reader
+
+
+def compute_speed_dict_loop(interval_idx, history_speed_matrix_list, usable_way_id_set, config_history_data_range,
+                            config_weight):
+    """
+    The loop implementation of the weighted sum in predict_road_condition.compute_speed_dict before it was vectorized
+    (without the BFS fill). Only kept here as the baseline of the benchmark.
+    """
+    predict_speed_dict = {}
+    for way_id in usable_way_id_set:
+        temp_history_speed = []
+        temp_need_estimate_idx = set()
+        for speed_matrix in history_speed_matrix_list:
+            temp_speed = speed_matrix[way_id][interval_idx]
+            if temp_speed <= 0:
+                for i in config_history_data_range:
+                    temp_speed = speed_matrix[way_id][(interval_idx + i) % 96]
+                    if temp_speed > 0:
+                        break
+                if temp_speed <= 0:
+                    temp_need_estimate_idx.add(len(temp_history_speed))
+            temp_history_speed.append(temp_speed)
+
+        if len(temp_need_estimate_idx) >= len(config_weight):
+            predict_speed_dict[way_id] = 0
+        else:
+            if 0 < len(temp_need_estimate_idx):
+                temp_history_speed = predict_road_condition.estimate_missing_value(temp_history_speed,
+                                                                                   temp_need_estimate_idx,
+                                                                                   config_weight)
+            predict_speed_dict[way_id] = predict_road_condition.compute_predict_speed(temp_history_speed,
+                                                                                      config_weight)
+    return predict_speed_dict
+
+
+def compute_speed_dict_vectorized(interval_idx, usable_way_ids, history_speed_tensor, config_history_data_range,
+                                  config_weight):
+    speeds, no_data = predict_road_condition.compute_speed_array(interval_idx, history_speed_tensor,
+                                                                 config_history_data_range, config_weight)
+    return {way_id: 0 if way_no_data else speed
+            for way_id, speed, way_no_data in zip(usable_way_ids, speeds.tolist(), no_data.tolist())}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/benchmark_predict_road_condition.py [date_str] <interval>")
+        print("")
+        print("Require:")
+        print("date_str       : 8 digit number of the date_str to predict")
+        print("             the result of the history days (see PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE)")
+        print("             should exist in data/")
+        print("")
+        print("Optional:")
+        print("interval       : the length of each time interval in minutes, by default is 15")
+        exit(0)
+
+    predict_time = datetime.strptime(sys.argv[1], "%Y%m%d")
+    interval = 15
+    if len(sys.argv) >= 3:
+        interval = int(sys.argv[2])
+
+    history_data_date_str = [(predict_time + timedelta(days=offset)).strftime("%Y%m%d")
+                             for offset in PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE]
+    history_speed_matrix_list, config_weight = predict_road_condition.get_history_speed_matrix_list(
+        history_data_date_str, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, interval, "data/{0}/result/{0}_{1}_min_road.csv")
+    if len(history_speed_matrix_list) == 0:
+        print("No history data for {}".format(sys.argv[1]))
+        exit(0)
+    full_way_id_set, usable_way_id_set = predict_road_condition.get_way_id_set(history_speed_matrix_list)
+    usable_way_ids = list(usable_way_id_set)
+
+    start_time = time.time()
+    history_speed_tensor = predict_road_condition.get_history_speed_tensor(history_speed_matrix_list, usable_way_ids)
+    tensor_time = time.time() - start_time
+
+    interval_count = int(1440 / interval)
+    loop_time = 0
+    vectorized_time = 0
+    mismatch = 0
+    for interval_idx in range(interval_count):
+        start_time = time.time()
+        loop_result = compute_speed_dict_loop(interval_idx, history_speed_matrix_list, usable_way_id_set,
+                                              PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, config_weight)
+        loop_time += time.time() - start_time
+
+        start_time = time.time()
+        vectorized_result = compute_speed_dict_vectorized(interval_idx, usable_way_ids, history_speed_tensor,
+                                                          PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
+                                                          config_weight)
+        vectorized_time += time.time() - start_time
+
+        mismatch += sum(1 for way_id, speed in loop_result.items()
+                        if vectorized_result[way_id] != speed or type(vectorized_result[way_id]) != type(speed))
+
+    print("{} day(s), {} ways, {} intervals".format(len(history_speed_matrix_list), len(usable_way_ids),
+                                                    interval_count))
+    print("build tensor: %.3fs" % tensor_time)
+    print("loop      : %.2f ms/interval" % (loop_time / interval_count * 1000))
+    print("vectorized: %.2f ms/interval (%.1fx)" % (vectorized_time / interval_count * 1000,
+                                                   loop_time / vectorized_time))
+    print("mismatch: {}".format(mismatch))
+
+    # A whole day with the BFS fill: one compute_speed_dict per interval against compute_speed_dict_list
+    save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit"]
+    way_graph, way_types, way_type_avg_speed_limit = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
+    start_time = time.time()
+    interval_results = [predict_road_condition.compute_speed_dict(interval, interval_idx, history_speed_matrix_list,
+                                                                  full_way_id_set, usable_way_id_set,
+                                                                  PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
+                                                                  config_weight, way_graph, way_types,
+                                                                  way_type_avg_speed_limit, history_speed_tensor)
+                        for interval_idx in range(interval_count)]
+    interval_time = time.time() - start_time
+
+    start_time = time.time()
+    day_results = predict_road_condition.compute_speed_dict_list(interval, history_speed_matrix_list, full_way_id_set,
+                                                                 usable_way_id_set,
+                                                                 PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
+                                                                 config_weight, way_graph, way_types,
+                                                                 way_type_avg_speed_limit)
+    day_time = time.time() - start_time
+
+    print("whole day, per interval: %.2fs" % interval_time)
+    print("whole day, batch       : %.2fs (%.1fx)" % (day_time, interval_time / day_time))
+    mismatch = sum(1 for a, b in zip(interval_results, day_results) if list(a.items()) != list(b.items()))
+    print("mismatch: {}".format(mismatch))
@@ -0,0 +1,40 @@
+import os
+import re
+import sys
+import time
+
+sys.path.append('./')
+from helper.global_var import CONFIG_DATA_FOLDER, CONFIG_HISTORY_STORE_FOLDER
+from helper.history_store import import_history_days, open_history_store
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("./script/build_history_store.py [interval] <start date_str> <end date_str>")
+        print("")
+        print("Add the result files of the days in data/ to the history store")
+        print("({}).".format(CONFIG_HISTORY_STORE_FOLDER))
+        print("The days already in the store (unless their result file changed) and today are skipped,")
+        print("script/process_yesterday_data.py adds the new days by itself.")
+        print("")
+        print("Require:")
+        print("interval       : the length of each time interval in minutes, e.g. 15")
+        print("")
+        print("Optional:")
+        print("start date_str : 8 digit number of the first day, by default all the days in data/")
+        print("end date_str   : 8 digit number of the last day (included)")
+        exit(0)
+
+    interval = int(sys.argv[1])
+    start_date_str = sys.argv[2] if len(sys.argv) >= 3 else "00000000"
+    end_date_str = sys.argv[3] if len(sys.argv) >= 4 else "99999999"
+
+    date_str_list = sorted(name for name in os.listdir(CONFIG_DATA_FOLDER)
+                           if re.match(r"[0-9]{8}$", name) is not None and start_date_str <= name <= end_date_str)
+    start_time = time.time()
+    day_count = import_history_days(date_str_list, interval)
+    store = open_history_store(interval)
+    print("{} day(s) added in {:.1f}s".format(day_count, time.time() - start_time))
+    if store is not None:
+        print("{} day(s), {} ways, {} intervals in the store".format(len(store["date_rows"]),
+                                                                    *store["speeds"].shape[1:]))
@@ -0,0 +1,125 @@
+import copy
+import math
+import random
+import sys
+
+sys.path.append('./')
+import predict_road_condition
+
+# The way types of the small graphs, with their average speed limit
+CHECK_WAY_TYPE_AVG_SPEED_LIMIT = {"motorway": 60, "motorway_link": 40, "primary": 35, "residential": 25,
+                                  "unclassified": 0}
+
+
+def get_random_graph(rng, way_count, edge_count):
+    """
+    A small random way_graph: a chain through all the ways (so it is connected) and edge_count random edges, both
+    directions of each edge are in the graph like in the graph of osm_interpreter.py.
+
+    Returns
+    -------
+    way_graph, way_types: see predict_road_condition.compute_speed_dict
+    """
+    way_ids = rng.sample(range(1000, 100000), way_count)
+    way_graph = {way: [] for way in way_ids}
+    edges = list(zip(way_ids, way_ids[1:])) + [tuple(rng.sample(way_ids, 2)) for _ in range(edge_count)]
+    for way_a, way_b in edges:
+        if way_b not in way_graph[way_a]:
+            way_graph[way_a].append(way_b)
+            way_graph[way_b].append(way_a)
+    way_types = {way: rng.choice(list(CHECK_WAY_TYPE_AVG_SPEED_LIMIT)) for way in way_ids}
+    return way_graph, way_types
+
+
+def get_random_speed_dict(rng, way_graph, no_data_ratio, isolated):
+    """
+    A random predict_speed_dict before the ways without data are estimated: the ways without data are 0, and some of
+    them are not in the dictionary at all (they are only in way_graph).
+
+    isolated: the ways without data are never neighbors, then each of them only depends on ways with data.
+    """
+    predict_speed_dict = {}
+    for way in rng.sample(list(way_graph), len(way_graph)):
+        no_data = rng.random() < no_data_ratio
+        if no_data and isolated and any(neighbor in predict_speed_dict and predict_speed_dict[neighbor] <= 0
+                                        for neighbor in way_graph[way]):
+            no_data = False
+        if not no_data:
+            predict_speed_dict[way] = round(rng.uniform(1, 60), 3)
+        elif isolated or rng.random() < 0.7:
+            predict_speed_dict[way] = 0
+    return predict_speed_dict
+
+
+def check_estimate_no_data_road_speed(case_count=200, seed=0):
+    """
+    Compare the modes of predict_road_condition.estimate_no_data_road_speed_dict_list with
+    estimate_no_data_road_speed_using_BFS on small random graphs:
+        "bfs" must give exactly the same dictionaries, for any graph and speeds.
+        "sparse" must fill the same ways. When the ways without data are never neighbors, the speeds must be the same
+        up to the rounding (numpy adds the neighbors in another order), otherwise they can differ a little (the
+        differences are counted).
+
+    Returns
+    -------
+    sparse_different_speeds: int
+        The number of speeds of the "sparse" mode that differ from estimate_no_data_road_speed_using_BFS (more than the
+        rounding)
+    """
+    rng = random.Random(seed)
+    sparse_different_speeds = 0
+    for case in range(case_count):
+        way_graph, way_types = get_random_graph(rng, rng.randint(2, 40), rng.randint(0, 40))
+        way_graph_index = predict_road_condition.get_way_graph_index(way_graph, way_types,
+                                                                     CHECK_WAY_TYPE_AVG_SPEED_LIMIT)
+        isolated = case % 2 == 0
+        # one dictionary per interval, the last one of some cases has no data at all
+        unfilled_speed_dict_list = [get_random_speed_dict(rng, way_graph, rng.uniform(0, 0.8), isolated)
+                                    for _ in range(rng.randint(1, 4))]
+        if case % 5 == 0:
+            unfilled_speed_dict_list.append({way: 0 for way in way_graph})
+        reference = [predict_road_condition.estimate_no_data_road_speed_using_BFS(
+            predict_speed_dict, way_graph, way_types, CHECK_WAY_TYPE_AVG_SPEED_LIMIT)
+            for predict_speed_dict in copy.deepcopy(unfilled_speed_dict_list)]
+
+        for mode in ["bfs", "sparse"]:
+            results = predict_road_condition.estimate_no_data_road_speed_dict_list(
+                copy.deepcopy(unfilled_speed_dict_list), way_graph_index, mode)
+            for reference_dict, result_dict in zip(reference, results):
+                if reference_dict.keys() != result_dict.keys():
+                    raise AssertionError("case {}: mode {} does not fill the same ways as "
+                                         "estimate_no_data_road_speed_using_BFS".format(case, mode))
+                if mode == "bfs":
+                    different_speeds = sum(result_dict[way] != speed for way, speed in reference_dict.items())
+                else:
+                    different_speeds = sum(not math.isclose(result_dict[way], speed, rel_tol=1e-9)
+                                           for way, speed in reference_dict.items())
+                if different_speeds > 0 and (mode == "bfs" or isolated):
+                    raise AssertionError("case {}: mode {} gives {} speeds different from "
+                                         "estimate_no_data_road_speed_using_BFS".format(case, mode, different_speeds))
+                if mode == "sparse":
+                    sparse_different_speeds += different_speeds
+    return sparse_different_speeds
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] in ["-h", "--help"]:
+        print("Usage:")
+        print("./script/check_estimate_no_data_road_speed.py <case count>")
+        print("")
+        print("Check the modes of predict_road_condition.estimate_no_data_road_speed_dict_list against")
+        print("estimate_no_data_road_speed_using_BFS on small random graphs, no data file is needed. Fails if the")
+        print("bfs mode gives a different result, or the sparse mode when the ways without data are never neighbors.")
+        print("See script/benchmark_estimate_no_data_road_speed.py for the comparison on the data of a day.")
+        print("")
+        print("Optional:")
+        print("case count     : the number of random graphs, by default is 200")
+        exit(0)
+
+    case_count = 200
+    if len(sys.argv) >= 2:
+        case_count = int(sys.argv[1])
+    sparse_different_speeds = check_estimate_no_data_road_speed(case_count)
+    print("{} cases: mode bfs is the same as estimate_no_data_road_speed_using_BFS".format(case_count))
+    print("mode sparse: the same ways, {} different speeds when the ways without data are neighbors".format(
+        sparse_different_speeds))
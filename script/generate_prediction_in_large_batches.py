@@ -1,26 +1,36 @@
+import gzip
 import json
 import os
 import shutil
 import sys
+import tempfile
 import time
 
+import numpy as np
 from tqdm import tqdm
 
 sys.path.append('./')
 from helper.global_var import FLAG_DEBUG, PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE, \
-    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, GPILB_CACHE_PATH
+    PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE, PREDICT_ROAD_CONDITION_CONFIG_WEIGHT, GPILB_CACHE_PATH, \
+    GPILB_STATUS_CACHE_PATH, CONFIG_HISTORY_STORE_FOLDER
 from pathlib import Path
 from helper.helper_time_range_index_to_str import time_range_index_to_time_range_str
 import predict_road_condition
 from helper.global_var import SAVE_TYPE_PICKLE
+from helper.compact_graph import get_all_way_points, get_compact_graph, get_way_positions
 from helper.graph_reader import graph_reader
+from helper.history_store import import_history_days
 from datetime import datetime, timedelta
 
 
-def get_output_dict(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
-                    final_node_table, final_way_table, way_types, way_type_avg_speed_limit):
+# See encode_way_geometry
+WAY_GEOMETRY_MAGIC = b"WAYS"
+WAY_GEOMETRY_VERSION = 1
+WAY_GEOMETRY_SCALE = 1e6
 
-    output_dict = {
+
+def get_output_dict_header(predict_time, time_slot_interval, interval_idx):
+    return {
         "boundaries": {
             "lat1": 42.233307124,  # Hard code boundaries for now
             "lon1": -78.835716683,
@@ -38,9 +48,15 @@ def get_output_dict(predict_speed_dict, predict_time, time_slot_interval, interv
                                                                                                      interval_idx + 1,
                                                                                                      time_slot_interval)
                                                                   ),
-        "links": []
     }
 
+
+def get_output_dict(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
+                    final_node_table, final_way_table, way_types, way_type_avg_speed_limit):
+
+    output_dict = get_output_dict_header(predict_time, time_slot_interval, interval_idx)
+    output_dict["links"] = []
+
     for way_id, single_road_speed in predict_speed_dict.items():
         speed_limit = way_type_avg_speed_limit[way_types.get(way_id, "unclassified")]
         if speed_limit > 0:
@@ -60,6 +76,60 @@ def get_output_dict(predict_speed_dict, predict_time, time_slot_interval, interv
     return output_dict
 
 
+def get_output_dict_from_compact_graph(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
+                                       compact_graph):
+    """
+    The same as get_output_dict, with the graph of helper/compact_graph.py. The ways are looked up all at once in the
+    arrays, instead of one by one in the tables.
+    """
+    output_dict = get_output_dict_header(predict_time, time_slot_interval, interval_idx)
+    output_dict["links"] = []
+
+    way_positions = get_way_positions(compact_graph, list(predict_speed_dict)).tolist()
+    way_speed_limits = compact_graph["way_speed_limits"].tolist()
+    way_points = get_all_way_points(compact_graph)
+    for single_road_speed, position in zip(predict_speed_dict.values(), way_positions):
+        if position < 0:
+            continue
+        speed_limit = way_speed_limits[position]
+        if speed_limit > 0:
+            speed_ratio = single_road_speed / speed_limit
+        else:
+            speed_ratio = 1.0
+
+        way_dict = {
+            "status": road_condition_to_color(speed_ratio),
+            "points": way_points[position]
+        }
+
+        output_dict["links"].append(way_dict)
+    return output_dict
+
+
+def get_status_dict_from_compact_graph(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
+                                       compact_graph):
+    """
+    The output of homepage.py without the geometry, the client loads the points of each way once from
+    /load_way_structure. "links" of get_output_dict is replaced by "road_status": {way_id: the color of the road
+    condition (see road_condition_to_color)}.
+    """
+    output_dict = get_output_dict_header(predict_time, time_slot_interval, interval_idx)
+    output_dict["road_status"] = {}
+
+    way_positions = get_way_positions(compact_graph, list(predict_speed_dict)).tolist()
+    way_speed_limits = compact_graph["way_speed_limits"].tolist()
+    for (way_id, single_road_speed), position in zip(predict_speed_dict.items(), way_positions):
+        if position < 0:
+            continue
+        speed_limit = way_speed_limits[position]
+        if speed_limit > 0:
+            speed_ratio = single_road_speed / speed_limit
+        else:
+            speed_ratio = 1.0
+        output_dict["road_status"][way_id] = road_condition_to_color(speed_ratio)
+    return output_dict
+
+
 def get_output_dict_old(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
                         final_way_table, way_types, way_type_avg_speed_limit):
 
@@ -93,17 +163,93 @@ def get_output_dict_old(predict_speed_dict, predict_time, time_slot_interval, in
 
 
 def get_output_dict_with_less_parameter(predict_speed_dict, target_dt, time_slot_interval):
-    save_filename_list = ["way_types", "way_type_avg_speed_limit", "final_way_table", "final_node_table"]
-    temp_map_dates = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
-    way_types = temp_map_dates[0]
-    way_type_avg_speed_limit = temp_map_dates[1]
-    final_way_table = temp_map_dates[2]
-    final_node_table = temp_map_dates[3]
+    compact_graph = get_compact_graph(Path("graph/"))
+
+    interval_idx = (target_dt.hour * 60 + target_dt.minute) // time_slot_interval
+
+    return get_output_dict_from_compact_graph(predict_speed_dict, target_dt, time_slot_interval, interval_idx,
+                                              compact_graph)
+
+
+def get_status_dict_with_less_parameter(predict_speed_dict, target_dt, time_slot_interval):
+    compact_graph = get_compact_graph(Path("graph/"))
 
     interval_idx = (target_dt.hour * 60 + target_dt.minute) // time_slot_interval
 
-    return get_output_dict(predict_speed_dict, target_dt, time_slot_interval, interval_idx,final_node_table,
-                           final_way_table, way_types, way_type_avg_speed_limit)
+    return get_status_dict_from_compact_graph(predict_speed_dict, target_dt, time_slot_interval, interval_idx,
+                                              compact_graph)
+
+
+def encode_status_payload(status_dict):
+    """
+    The gzip compressed JSON of the return of get_status_dict_from_compact_graph, as sent by homepage.py. The same
+    status_dict always gives the same bytes (no time in the gzip header), so they can be used as the ETag.
+    """
+    return gzip.compress(json.dumps(status_dict, separators=(",", ":")).encode("utf-8"), mtime=0)
+
+
+def save_status_payload(payload, file_path):
+    """
+    Save the return of encode_status_payload. The file is written aside and replaced at once, so homepage.py never
+    sends a file that is half written. Each writer has its own temporary file, as the threads of homepage.py and this
+    script may save the same payload at the same time.
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=file_path.parent, prefix=file_path.name + ".", suffix=".tmp",
+                                     delete=False) as f:
+        f.write(payload)
+    try:
+        # the temporary file is only readable by its owner, the payload is read by the user of homepage.py
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, file_path)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+
+def predict_speed_dict_to_status_payload(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
+                                         compact_graph, save_path=GPILB_STATUS_CACHE_PATH):
+    """
+    The same as predict_speed_dict_to_json, the file saved is the payload of homepage.py (see encode_status_payload).
+
+    Parameters
+    ----------
+    compact_graph: Dictionary
+        The return of helper.compact_graph.get_compact_graph
+
+    save_path: String
+        {0} is a 8-digit date_str in yyyyMMdd format.
+        {1} is the value of interval
+        {2} is the interval_idx
+
+    Other parameters: see predict_speed_dict_to_json
+    """
+    status_dict = get_status_dict_from_compact_graph(predict_speed_dict, predict_time, time_slot_interval,
+                                                     interval_idx, compact_graph)
+    save_status_payload(encode_status_payload(status_dict),
+                        save_path.format(predict_time.strftime("%Y%m%d"), time_slot_interval, interval_idx))
+    return 0
+
+
+def predict_speed_dict_to_json_from_compact_graph(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
+                                                  compact_graph, save_path=GPILB_CACHE_PATH):
+    """
+    The same as predict_speed_dict_to_json, with the graph of helper/compact_graph.py. The file is written aside and
+    replaced at once, as the status payload (see save_status_payload).
+
+    Parameters
+    ----------
+    compact_graph: Dictionary
+        The return of helper.compact_graph.get_compact_graph
+
+    Other parameters: see predict_speed_dict_to_json
+    """
+    output_dict = get_output_dict_from_compact_graph(predict_speed_dict, predict_time, time_slot_interval,
+                                                     interval_idx, compact_graph)
+    save_status_payload(json.dumps(output_dict).encode("utf-8"),
+                        save_path.format(predict_time.strftime("%Y%m%d"), time_slot_interval, interval_idx))
+    return 0
 
 
 def predict_speed_dict_to_json(predict_speed_dict, predict_time, time_slot_interval, interval_idx,
@@ -162,17 +308,77 @@ def predict_speed_dict_to_json(predict_speed_dict, predict_time, time_slot_inter
     return 0
 
 
+def encode_varints(values):
+    """
+    Encode signed integers as zigzag varints (LEB128): 7 bits per byte, the high bit is set on all the bytes of a
+    value but the last one. Small values (e.g. the difference between two points of a way) take 1 or 2 bytes.
+
+    Parameters
+    ----------
+    values: np.ndarray of int64
+
+    Returns
+    -------
+    bytes
+    """
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    byte_counts = np.ones(len(zigzag), dtype=np.int64)
+    for k in range(1, 10):
+        byte_counts += zigzag >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(byte_counts) - byte_counts
+    result = np.zeros(int(byte_counts.sum()), dtype=np.uint8)
+    for k in range(int(byte_counts.max(initial=0))):
+        mask = byte_counts > k
+        payload_bits = (zigzag[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        continuation = np.where(byte_counts[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        result[starts[mask] + k] = (payload_bits | continuation).astype(np.uint8)
+    return result.tobytes()
+
+
+def encode_way_geometry(compact_graph):
+    """
+    Encode the points of all the ways (the same as generate_way_structure_json) in a compact binary form, decoded by
+    decode_way_structure() in templates/index_js.js.
+
+    The coordinates are rounded to WAY_GEOMETRY_SCALE (1e-6 degree, about 0.1 m) as integers, and each point is saved
+    as the difference to the previous point of the way, so most of them take 1 or 2 bytes.
+
+    Layout (little-endian):
+        WAY_GEOMETRY_MAGIC, uint8 WAY_GEOMETRY_VERSION, 3 bytes 0, uint32 number of ways, uint32 number of points
+        float64 id of each way (exact below 2^53, JavaScript has no int64)
+        uint32 number of points of each way
+        zigzag varints (see encode_varints): lat and lon of each point of each way in 1e-6 degree, minus the lat and lon
+        of the previous point of the way (the first point of a way is not a difference)
+
+    Parameters
+    ----------
+    compact_graph: Dictionary
+        The return of helper.compact_graph.get_compact_graph
+
+    Returns
+    -------
+    bytes
+    """
+    way_node_offsets = np.asarray(compact_graph["way_node_offsets"])
+    way_node_indices = compact_graph["way_node_indices"]
+    coordinates = np.column_stack((compact_graph["node_lats"][way_node_indices],
+                                   compact_graph["node_lons"][way_node_indices]))
+    coordinates = np.round(coordinates * WAY_GEOMETRY_SCALE).astype(np.int64)
+    deltas = coordinates.copy()
+    deltas[1:] -= coordinates[:-1]
+    way_starts = way_node_offsets[:-1][np.diff(way_node_offsets) > 0]
+    deltas[way_starts] = coordinates[way_starts]
+
+    way_count = len(compact_graph["way_ids"])
+    header = WAY_GEOMETRY_MAGIC + bytes([WAY_GEOMETRY_VERSION, 0, 0, 0]) + \
+        np.array([way_count, len(coordinates)], dtype="<u4").tobytes()
+    return header + np.asarray(compact_graph["way_ids"], dtype="<f8").tobytes() + \
+        np.diff(way_node_offsets).astype("<u4").tobytes() + encode_varints(deltas.reshape(-1))
+
+
 def generate_way_structure_json(save_path="static/mapdata/way_structure.json"):
-    save_filename_list = ["final_node_table", "final_way_table"]
-    temp_map_dates = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
-    final_node_table = temp_map_dates[0]
-    final_way_table = temp_map_dates[1]
-    way_structure = {}
-    for way, waypoints in final_way_table.items():
-        points = []
-        for waypoint in waypoints:
-            points.append([final_node_table[waypoint][0], final_node_table[waypoint][1]])
-        way_structure[way] = points
+    compact_graph = get_compact_graph(Path("graph/"))
+    way_structure = dict(zip(compact_graph["way_ids"].tolist(), get_all_way_points(compact_graph)))
 
     temp_filepath = Path(save_path)
     temp_filepath.parent.mkdir(parents=True, exist_ok=True)
@@ -186,7 +392,8 @@ def generate_prediction_in_large_batches(predict_timestamp=int(datetime.now().ti
                                          result_file_path="data/{0}/result/{0}_{1}_min_road.csv",
                                          config_history_date=PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATE,
                                          config_history_data_range=PREDICT_ROAD_CONDITION_CONFIG_HISTORY_DATA_RANGE,
-                                         config_weight=PREDICT_ROAD_CONDITION_CONFIG_WEIGHT):
+                                         config_weight=PREDICT_ROAD_CONDITION_CONFIG_WEIGHT,
+                                         history_store_folder=CONFIG_HISTORY_STORE_FOLDER):
     """
     Generate prediction in large batches (in day(s))
 
@@ -213,6 +420,9 @@ def generate_prediction_in_large_batches(predict_timestamp=int(datetime.now().ti
         This parameter specifies the weight of each day's data when compute the weighted sum.
         by default it will use a predetermined configuration
 
+    history_store_folder: String
+        The folder of the history store (see helper/history_store.py), None to read the result files of each day
+
     Returns
     -------
     None
@@ -223,13 +433,12 @@ def generate_prediction_in_large_batches(predict_timestamp=int(datetime.now().ti
         print("error: len(config_history_date) != len(config_weight)")
         return -1
 
-    save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit", "final_node_table", "final_way_table"]
+    save_filename_list = ["way_graph", "way_types", "way_type_avg_speed_limit"]
     temp_map_dates = graph_reader(Path("graph/"), SAVE_TYPE_PICKLE, save_filename_list)
     way_graph = temp_map_dates[0]
     way_types = temp_map_dates[1]
     way_type_avg_speed_limit = temp_map_dates[2]
-    final_node_table = temp_map_dates[3]
-    final_way_table = temp_map_dates[4]
+    compact_graph = get_compact_graph(Path("graph/"))
 
     # Find the time of the predict, also find the range index in the day.
     predict_time = datetime.fromtimestamp(predict_timestamp)
@@ -244,29 +453,33 @@ def generate_prediction_in_large_batches(predict_timestamp=int(datetime.now().ti
         print("Predict time: {}".format(predict_time.strftime("%Y-%m-%d %H:%M:%S")))
         print("History data date_str:{}".format(history_data_date_str))
 
-    # Load history data
-    history_speed_matrix_list, config_weight = \
-        predict_road_condition.get_history_speed_matrix_list(history_data_date_str, config_weight, interval,
-                                                             result_file_path)
+    # Load history data, the finished days missing from the history store (or changed) are added first, the requests
+    # of homepage.py only read the store
+    if history_store_folder is not None:
+        import_history_days(history_data_date_str, interval, result_file_path, history_store_folder)
+    history_speed_matrix_list, history_speed_tensor, config_weight, full_way_id_set, usable_way_id_set = \
+        predict_road_condition.load_history_speed(history_data_date_str, config_weight, interval, result_file_path,
+                                                  history_store_folder)
 
-    if len(history_speed_matrix_list) == 0:
+    if history_speed_tensor is None:
         print({"Error": "No enough data for predict"})
         return {"Error": "No enough data for predict"}
 
     if FLAG_DEBUG:
-        print("{} day(s) load".format(len(history_speed_matrix_list)))
+        print("{} day(s) load".format(len(history_speed_tensor)))
 
-    full_way_id_set, usable_way_id_set = predict_road_condition.get_way_id_set(history_speed_matrix_list)
+    # All the intervals of the day are predicted at once, the history is only walked once
+    predict_speed_dict_list = \
+        predict_road_condition.compute_speed_dict_list(interval, history_speed_matrix_list, full_way_id_set,
+                                                       usable_way_id_set, config_history_data_range, config_weight,
+                                                       way_graph, way_types, way_type_avg_speed_limit,
+                                                       history_speed_tensor)
 
-    for interval_idx in tqdm(range(int(1440 / interval))):
+    for interval_idx, predict_speed_dict in enumerate(tqdm(predict_speed_dict_list)):
         # print(interval_idx, time_range_index_to_str(interval_idx, interval))
-        predict_speed_dict = \
-            predict_road_condition.compute_speed_dict(interval, interval_idx, history_speed_matrix_list,
-                                                      full_way_id_set,
-                                                      usable_way_id_set, config_history_data_range, config_weight,
-                                                      way_graph, way_types, way_type_avg_speed_limit)
-        predict_speed_dict_to_json(predict_speed_dict, predict_time, interval, interval_idx,
-                                   final_node_table, final_way_table, way_types, way_type_avg_speed_limit)
+        predict_speed_dict_to_json_from_compact_graph(predict_speed_dict, predict_time, interval, interval_idx,
+                                                      compact_graph)
+        predict_speed_dict_to_status_payload(predict_speed_dict, predict_time, interval, interval_idx, compact_graph)
 
     return 0
 
@@ -1,14 +1,13 @@
 import os
 import re
-import shutil
 import sys
 from pathlib import Path
 from tqdm import tqdm
 sys.path.append('./')
 import process_data
-import reformat_data
 import find_traffic_speed
-from helper.global_var import SAVE_TYPE_PICKLE, CONFIG_SINGLE_DAY_FOLDER
+from find_nearest_road import load_way_index
+from helper.global_var import SAVE_TYPE_PICKLE
 from helper.graph_reader import graph_reader
 from datetime import datetime
 
@@ -21,6 +20,7 @@ if __name__ == '__main__':
     final_node_table = map_dates[0]
     final_way_table = map_dates[1]
     final_relation_table = map_dates[2]
+    way_index = load_way_index(Path("graph"), final_node_table, final_way_table, final_relation_table)
 
     today_str = (datetime.today()).strftime('%Y%m%d')
     for date_str in tqdm(os.listdir(data_root), unit="folder", position=-1):
@@ -32,15 +32,8 @@ if __name__ == '__main__':
                 process_data.preprocess_data(date_str, overwrite=True, min_file_size=10, archive_after_preprocess=True,
                                              skip_if_archived=False)
 
-
-                # reformat_data part
-                reformat_data.reformat_by_bus(date_str)
-                reformat_data.sort_reformat_data(date_str)
-
                 # find_traffic_speed part
                 time_slot_intervals = [5, 15]
-                for interval in time_slot_intervals:
-                    find_traffic_speed.find_traffic_speed(date_str, final_node_table, final_way_table,
-                                                          final_relation_table, time_slot_interval=interval)
-                sorted_dir = Path(CONFIG_SINGLE_DAY_FOLDER.format(date_str)) / "sorted"
-                shutil.rmtree(sorted_dir)
+                find_traffic_speed.find_traffic_speed(date_str, final_node_table, final_way_table,
+                                                      final_relation_table, time_slot_interval=time_slot_intervals,
+                                                      way_index=way_index, add_to_history=True)
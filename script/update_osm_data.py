@@ -3,7 +3,8 @@ from pathlib import Path
 import requests
 from tqdm import tqdm
 
-from helper.global_var import SAVE_TYPE_PICKLE, SAVE_TYPE_JSON
+from helper.global_var import SAVE_TYPE_PICKLE, SAVE_TYPE_JSON, SAVE_TYPE_NUMPY
+from helper.graph_bundle import GRAPH_BUNDLE_SUFFIX, get_file_checksum, read_graph_manifest
 from osm_interpreter import get_map_data
 
 
@@ -21,5 +22,13 @@ if __name__ == '__main__':
     result_file_path = Path("graph")
 
     update_osm_data(map_file)
+    # The graph is only built again when the map is changed, the graph bundles are written last and keep the checksum
+    # of the map they are built from
+    graph_bundle_file = result_file_path / "way_type_avg_speed_limit{}".format(GRAPH_BUNDLE_SUFFIX)
+    if graph_bundle_file.is_file() and \
+            read_graph_manifest(graph_bundle_file).get("source_sha256") == get_file_checksum(map_file):
+        print("The map is not changed, the graph is up to date")
+        exit(0)
     get_map_data(map_file, result_file_path, SAVE_TYPE_PICKLE)
     get_map_data(map_file, result_file_path, SAVE_TYPE_JSON)
+    get_map_data(map_file, result_file_path, SAVE_TYPE_NUMPY)
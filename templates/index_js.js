@@ -36,49 +36,97 @@ function get_traffic_for_given_time(timestamp) {
 function get_traffic_for_selected_time_callback(raw_json){
     let traffic_info = JSON.parse(raw_json);
     // console.log(traffic_info);
-    // console.log(traffic_info['road_speed'][0]['points']);
     clear_polylines_from_google_maps();
-    plot_traffic_on_google_maps(traffic_info['road_speed']);
+    if (traffic_info['road_status'] === undefined) return;  // {"error": "no_data"}
+    plot_traffic_on_google_maps(traffic_info['road_status']);
 }
 
 /**
  * Load the way structure, i.e., way id and the associated points.
  */
 function load_way_structure() {
-    ajaxGetRequest("static/mapdata/way_structure.json", load_way_structure_callback);
+    ajaxGetBinaryRequest("/load_way_structure", load_way_structure_callback);
 }
 
 /**
  *
- * @param raw_json {string} way_structure - {way_id: [[Latitude, Longitude], [Latitude, Longitude], ... ]}
+ * @param buffer {ArrayBuffer} the way structure encoded by encode_way_geometry() (see decode_way_structure)
  */
-function load_way_structure_callback(raw_json){
-    way_and_points = JSON.parse(raw_json);
+function load_way_structure_callback(buffer){
+    way_and_points = decode_way_structure(buffer);
     get_traffic_for_given_time(new Date().getTime().toString().substr(0,10));
 }
 
+/**
+ * Decode the way structure sent by /load_way_structure, see encode_way_geometry() in
+ * script/generate_prediction_in_large_batches.py for the layout.
+ * @param buffer {ArrayBuffer}
+ * @return {Object} way_structure - {way_id: [[Latitude, Longitude], [Latitude, Longitude], ... ]}
+ */
+function decode_way_structure(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    if (String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) !== "WAYS" || bytes[4] !== 1) {
+        throw new Error("Unknown way structure format");
+    }
+    const way_count = view.getUint32(8, true);
+    const way_ids_offset = 16;
+    const point_counts_offset = way_ids_offset + 8 * way_count;
+    let offset = point_counts_offset + 4 * way_count;
+
+    // zigzag varint, see encode_varints()
+    function read_varint() {
+        let value = 0;
+        let scale = 1;
+        let byte;
+        do {
+            byte = bytes[offset++];
+            value += (byte & 0x7f) * scale;
+            scale *= 128;
+        } while (byte & 0x80);
+        return (value % 2 === 0) ? value / 2 : -(value + 1) / 2;
+    }
+
+    const way_structure = {};
+    for (let i = 0; i < way_count; i++) {
+        const way_id = view.getFloat64(way_ids_offset + 8 * i, true);
+        const point_count = view.getUint32(point_counts_offset + 4 * i, true);
+        const points = [];
+        let lat = 0;
+        let lng = 0;
+        for (let j = 0; j < point_count; j++) {
+            lat += read_varint();
+            lng += read_varint();
+            points.push([lat / 1e6, lng / 1e6]);
+        }
+        way_structure[way_id] = points;
+    }
+    return way_structure;
+}
+
 /**
  * Plot the traffic conditions on the Google Maps.
- * @param {Object} road_speed - {way_id: {'speed': float, 'speed_ratio': float}}
+ * The response only has the color of each way, the points come from the way structure loaded once.
+ * @param {Object} road_status - {way_id: color}
  * @return null
  */
-async function plot_traffic_on_google_maps(road_speed) {
+async function plot_traffic_on_google_maps(road_status) {
     polylines = [];
     const way_ids = Object.keys(way_and_points);
     let way_length = way_ids.length
     for (let i = 0; i < way_length; i++) {
+        const color = road_status[way_ids[i]];
+        if (color === undefined) continue;
         const points = way_and_points[way_ids[i]];
         let coordinates = [];
         for (let i = 0; i < points.length; i++) {
             coordinates.push({lat: points[i][0], lng: points[i][1]});
         }
-        // const speed = road_speed[i]['speed'];
-        const speed_ratio = road_speed[way_ids[i]]['speed_ratio'];
 
         const polyline = new google.maps.Polyline({
             path: coordinates,
             geodesic: true,
-            strokeColor: get_color_based_on_speed(speed_ratio),
+            strokeColor: color,
             strokeOpacity: 1.0,
             strokeWeight: 4,
         });
@@ -144,6 +192,18 @@ function ajaxPostRequest(path, data, callback) {
     request.send(data);
 }
 
+function ajaxGetBinaryRequest(path, callback) {
+    let request = new XMLHttpRequest();
+    request.responseType = "arraybuffer";
+    request.onreadystatechange = function () {
+        if (this.readyState === 4 && this.status === 200) {
+            callback(this.response);
+        }
+    };
+    request.open("GET", path);
+    request.send();
+}
+
 function ajaxGetRequest(path, callback) {
     let request = new XMLHttpRequest();
     request.onreadystatechange = function () {